@@ -1,20 +1,29 @@
 
 #!/usr/bin/env python3
-# bot.py v2.0.0 (11.03.2026)
-# - Исправлен импорт choose_plan
-# - Актуализированы версии файлов и лог запуска
+# bot.py v2.1.0 (18.10.2026)
+# - Справочник округов (gazetteer.py) загружается при старте
+# - Реестр подписчиков (subscribers.py) загружается и подписывается на изменения при старте
+# - Очередь доставки (delivery.py) вместо семафора telegram_semaphore
+# - Режим webhook (BOT_MODE=webhook, webhook.py) как альтернатива run_polling; TELEGRAM_BASE_URL для тестового Bot API
+# - Обновления обрабатываются параллельно по чатам (update_processor.ChatOrderedUpdateProcessor)
+# - Имя бота и клавиатуры фильтров (keyboards.py) готовятся в post_init
+# - utils.shutdown зарегистрирован как post_stop (собственный обработчик сигналов перекрывался run_polling)
 
 import asyncio
 import logging
-import signal
 
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, ConversationHandler
 )
 
-from config import TOKEN, DATABASE_URL, TELEGRAM_RATE_LIMIT
+from config import TOKEN, DATABASE_URL, BOT_MODE, TELEGRAM_BASE_URL
 from database import Database
-__version__ = '2.0.0'
+from gazetteer import Gazetteer
+from subscribers import SubscriberRegistry
+from delivery import Delivery
+import keyboards
+from update_processor import ChatOrderedUpdateProcessor
+__version__ = '2.1.0'
 
 from handlers import (
     # Старт и меню
@@ -52,7 +61,7 @@ from handlers import (
     admin_active_subs_command, ban_user, unban_user,
     set_balance, add_balance, export_users,
     # Фоновые задачи
-    collector_loop, update_checker_loop,
+    collector_loop, update_checker_loop, send_ad_to_user,
     # Состояния
     ROLE_SELECTION,
     # ConversationHandler объекты
@@ -69,7 +78,12 @@ logger = logging.getLogger(__name__)
 
 async def post_init(app: Application):
     await Database.init(DATABASE_URL)
-    app.bot_data['telegram_semaphore'] = asyncio.Semaphore(TELEGRAM_RATE_LIMIT)
+    Gazetteer.load()
+    await SubscriberRegistry.start()
+    Delivery.start(app.bot, send_ad_to_user)
+    # get_me уже выполнен в Application.initialize: обработчики берут имя из context.bot.username
+    logger.info(f"Бот @{app.bot.username}")
+    keyboards.warm_up()
     app.bot_data['debug_mode'] = False
 
     tasks = [
@@ -86,7 +100,18 @@ def main():
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL не установлен! Проверьте .env файл.")
 
-    app = Application.builder().token(TOKEN).post_init(post_init).build()
+    builder = (
+        Application.builder().token(TOKEN).post_init(post_init).post_stop(shutdown)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    if BOT_MODE == 'webhook':
+        # Обновления приходят на встроенный сервер webhook.py, Updater (long polling) не нужен;
+        # UpdateQueue считает незавершённые обновления для ограничения WEBHOOK_QUEUE_SIZE
+        from webhook import UpdateQueue
+        builder = builder.updater(None).update_queue(UpdateQueue())
+    app = builder.build()
 
     # ===== ConversationHandler для выбора роли =====
     role_conv = ConversationHandler(
@@ -199,13 +224,17 @@ def main():
     app.add_handler(CallbackQueryHandler(users_page, pattern='^users_page_'))
     app.add_handler(CallbackQueryHandler(broadcast_confirm, pattern='^bc_'))
 
-    # ===== Graceful shutdown =====
-    loop = asyncio.get_event_loop()
-    for sig in (signal.SIGTERM, signal.SIGINT):
-        loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown(app)))
+    allowed_updates = ['message', 'callback_query']
+    if BOT_MODE == 'webhook':
+        from webhook import run_webhook
+        logger.info("🚀 Бот запускается (webhook)...")
+        asyncio.run(run_webhook(app, allowed_updates))
+        return
 
+    # Graceful shutdown: run_polling ставит свои обработчики SIGTERM/SIGINT и после app.stop вызывает
+    # post_stop (utils.shutdown) — очередь доставки возвращает задачи в outbox и пишет подтверждения
     logger.info("🚀 Бот запускается...")
-    app.run_polling(allowed_updates=['message', 'callback_query'])
+    app.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# browser_pool.py v2.1.0 (18.10.2026)
+# - Долгоживущий пул Chromium: тёплые браузеры по прокси, переиспользуемые контексты
+# - Контекст пересоздаётся после N навигаций или при ошибке/антиботе
+# - Проверка здоровья браузеров и корректное закрытие при shutdown
+# - Фильтр ресурсов на уровне route: профили ЦИАН/Авито, блокировка картинок/шрифтов/медиа/трекеров, счётчики
+# - Аренда браузера засчитывается под блокировкой пула (вытеснение и health_check не закроют выданный слот);
+#   при заполненном пуле новый прокси ждёт освобождения браузера, пул не растёт сверх BROWSER_POOL_MAX
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+try:
+    from playwright.async_api import async_playwright
+    PLAYWRIGHT_AVAILABLE = True
+except ImportError:
+    PLAYWRIGHT_AVAILABLE = False
+
+from config import (
+    USER_AGENTS, BROWSER_CONTEXT_MAX_USES, BROWSER_IDLE_TTL, BROWSER_POOL_MAX,
+    RESOURCE_FILTER_ENABLED, RESOURCE_BLOCK_TYPES, RESOURCE_BLOCK_HOSTS, RESOURCE_ALLOW_HOSTS,
+)
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--window-size=1600,1200',
+]
+
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    window.chrome = { runtime: {} };
+    Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU', 'ru', 'en-US', 'en']});
+    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4]});
+"""
+
+HEALTH_CHECK_INTERVAL = 60
+
+TRACKER_HOSTS = (
+    'mc.yandex.ru', 'an.yandex.ru', 'yandexadexchange.net', 'adfox.ru', 'ads.adfox.ru',
+    'google-analytics.com', 'googletagmanager.com', 'googlesyndication.com', 'doubleclick.net',
+    'top-fwz1.mail.ru', 'top.mail.ru', 'ad.mail.ru', 'counter.yadro.ru', 'tns-counter.ru',
+    'mediametrics.ru', 'adriver.ru', 'criteo.com', 'criteo.net', 'facebook.net', 'connect.facebook.net',
+    'hotjar.com', 'scorecardresearch.com', 'sentry.io', 'vk.com', 'mycdn.me', 'tiktok.com',
+)
+
+# Грубая оценка размера заблокированного ресурса, байт (точный размер без загрузки неизвестен)
+ESTIMATED_RESOURCE_BYTES = {
+    'image': 60_000,
+    'media': 500_000,
+    'font': 40_000,
+    'stylesheet': 30_000,
+    'script': 80_000,
+    'xhr': 5_000,
+    'fetch': 5_000,
+}
+
+
+class _PooledContext:
+    __slots__ = ('context', 'uses', 'active', 'retired')
+
+    def __init__(self, context):
+        self.context = context
+        self.uses = 0
+        self.active = 0
+        self.retired = False
+
+
+class _BrowserSlot:
+    __slots__ = ('key', 'proxy', 'browser', 'current', 'lock', 'last_used', 'leases')
+
+    def __init__(self, key: str, proxy: Optional[str]):
+        self.key = key
+        self.proxy = proxy
+        self.browser = None
+        self.current: Optional[_PooledContext] = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.leases = 0
+
+    def busy(self) -> bool:
+        return self.leases > 0
+
+
+def _host_matches(host: str, patterns: Iterable[str]) -> bool:
+    return any(host == p or host.endswith('.' + p) for p in patterns)
+
+
+class ResourceFilter:
+    """Профиль блокировки ресурсов для page.route: типы ресурсов и хосты, allow-список имеет приоритет"""
+
+    def __init__(self, name: str, blocked_types: Iterable[str], blocked_hosts: Iterable[str] = (),
+                 allowed_hosts: Iterable[str] = ()):
+        self.name = name
+        self.blocked_types = frozenset(blocked_types) - {'document'}
+        self.blocked_hosts = tuple(blocked_hosts)
+        self.allowed_hosts = tuple(allowed_hosts)
+        self.stats: Dict[str, int] = {'allowed': 0, 'blocked': 0, 'bytes_saved': 0}
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        host = (urlsplit(url).hostname or '').lower()
+        if _host_matches(host, self.allowed_hosts):
+            return False
+        if resource_type in self.blocked_types:
+            return True
+        return _host_matches(host, self.blocked_hosts)
+
+    async def install(self, page) -> Dict[str, int]:
+        """Вешает фильтр на страницу, возвращает счётчики этой страницы"""
+        counters = {'allowed': 0, 'blocked': 0, 'bytes_saved': 0}
+
+        async def handle(route):
+            request = route.request
+            if self.should_block(request.resource_type, request.url):
+                saved = ESTIMATED_RESOURCE_BYTES.get(request.resource_type, 10_000)
+                for bucket in (counters, self.stats):
+                    bucket['blocked'] += 1
+                    bucket['bytes_saved'] += saved
+                try:
+                    await route.abort()
+                except Exception:
+                    pass
+                return
+            for bucket in (counters, self.stats):
+                bucket['allowed'] += 1
+            try:
+                await route.continue_()
+            except Exception:
+                pass
+
+        await page.route('**/*', handle)
+        return counters
+
+
+RESOURCE_PROFILES: Dict[str, ResourceFilter] = {
+    'cian': ResourceFilter(
+        'cian',
+        blocked_types=RESOURCE_BLOCK_TYPES,
+        blocked_hosts=TRACKER_HOSTS + tuple(RESOURCE_BLOCK_HOSTS),
+        allowed_hosts=('api.cian.ru',) + tuple(RESOURCE_ALLOW_HOSTS),
+    ),
+    'avito': ResourceFilter(
+        'avito',
+        blocked_types=RESOURCE_BLOCK_TYPES,
+        blocked_hosts=TRACKER_HOSTS + ('stats.avito.ru', 'sntr.avito.ru') + tuple(RESOURCE_BLOCK_HOSTS),
+        allowed_hosts=tuple(RESOURCE_ALLOW_HOSTS),
+    ),
+}
+
+
+def get_resource_filter(profile: Optional[str]) -> Optional[ResourceFilter]:
+    if not RESOURCE_FILTER_ENABLED or not profile:
+        return None
+    return RESOURCE_PROFILES.get(profile)
+
+
+class BrowserPool:
+    """Пул тёплых браузеров Chromium: один браузер на прокси, контекст переиспользуется между загрузками"""
+    _playwright = None
+    _slots: Dict[str, _BrowserSlot] = {}
+    _lock: Optional[asyncio.Lock] = None
+    # Условие на блокировке пула: ожидание освобождения браузера, когда пул заполнен
+    _released: Optional[asyncio.Condition] = None
+    _last_health_check: float = 0.0
+    stats: Dict[str, int] = {'launches': 0, 'contexts': 0, 'recycles': 0, 'navigations': 0}
+
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
+    @classmethod
+    def _get_released(cls) -> asyncio.Condition:
+        if cls._released is None:
+            cls._released = asyncio.Condition(cls._get_lock())
+        return cls._released
+
+    @classmethod
+    async def _get_slot(cls, proxy: Optional[str]) -> _BrowserSlot:
+        """Возвращает слот с уже засчитанной арендой; освобождать через _release"""
+        key = proxy or 'direct'
+        released = cls._get_released()
+        async with released:
+            if cls._playwright is None:
+                cls._playwright = await async_playwright().start()
+            while True:
+                slot = cls._slots.get(key)
+                if slot is not None:
+                    break
+                if await cls._evict_for_new_slot():
+                    slot = _BrowserSlot(key, proxy)
+                    cls._slots[key] = slot
+                    break
+                # Все браузеры заняты — ждём, пока какой-нибудь освободится
+                await released.wait()
+            slot.leases += 1
+            return slot
+
+    @classmethod
+    async def _release(cls, slot: _BrowserSlot):
+        released = cls._get_released()
+        async with released:
+            slot.leases -= 1
+            slot.last_used = time.monotonic()
+            if not slot.busy():
+                released.notify_all()
+
+    @classmethod
+    async def _evict_for_new_slot(cls) -> bool:
+        """Освобождает место под новый браузер, закрывая самый давно неиспользуемый свободный;
+        False — все браузеры заняты и места нет"""
+        while len(cls._slots) >= BROWSER_POOL_MAX:
+            idle = [s for s in cls._slots.values() if not s.busy()]
+            if not idle:
+                return False
+            victim = min(idle, key=lambda s: s.last_used)
+            cls._slots.pop(victim.key, None)
+            logger.info('BrowserPool: закрываем браузер %s (лимит пула %s)', victim.key, BROWSER_POOL_MAX)
+            await cls._close_slot(victim)
+        return True
+
+    @classmethod
+    async def _lease_context(cls, slot: _BrowserSlot) -> _PooledContext:
+        async with slot.lock:
+            if slot.browser is None or not slot.browser.is_connected():
+                if slot.browser is not None:
+                    logger.warning('BrowserPool: браузер %s отвалился, перезапускаем', slot.key)
+                    slot.current = None
+                slot.browser = await cls._playwright.chromium.launch(
+                    headless=True,
+                    proxy={'server': slot.proxy} if slot.proxy else None,
+                    args=LAUNCH_ARGS,
+                )
+                cls.stats['launches'] += 1
+            pooled = slot.current
+            if pooled is not None and (pooled.retired or pooled.uses >= BROWSER_CONTEXT_MAX_USES):
+                cls._retire(pooled)
+                if pooled.active == 0:
+                    await cls._close_quietly(pooled.context)
+                pooled = None
+            if pooled is None:
+                context = await slot.browser.new_context(
+                    user_agent=random.choice(USER_AGENTS),
+                    viewport={'width': 1600, 'height': 1200},
+                    locale='ru-RU',
+                    timezone_id='Europe/Moscow',
+                    java_script_enabled=True,
+                    ignore_https_errors=True,
+                    service_workers='block',
+                )
+                await context.add_init_script(STEALTH_SCRIPT)
+                pooled = _PooledContext(context)
+                slot.current = pooled
+                cls.stats['contexts'] += 1
+            pooled.uses += 1
+            pooled.active += 1
+            slot.last_used = time.monotonic()
+            cls.stats['navigations'] += 1
+            return pooled
+
+    @classmethod
+    def _retire(cls, pooled: _PooledContext):
+        if not pooled.retired:
+            pooled.retired = True
+            cls.stats['recycles'] += 1
+
+    @staticmethod
+    async def _close_quietly(obj):
+        try:
+            await obj.close()
+        except Exception:
+            pass
+
+    @classmethod
+    @asynccontextmanager
+    async def page(cls, proxy: Optional[str] = None):
+        """Выдаёт страницу из тёплого контекста; при исключении внутри блока контекст выводится из оборота"""
+        await cls.health_check()
+        slot = await cls._get_slot(proxy)
+        pooled = None
+        page = None
+        try:
+            pooled = await cls._lease_context(slot)
+            page = await pooled.context.new_page()
+            yield page
+        except BaseException:
+            if pooled is not None:
+                cls._retire(pooled)
+            raise
+        finally:
+            if page is not None:
+                await cls._close_quietly(page)
+            if pooled is not None:
+                pooled.active -= 1
+                if pooled.retired:
+                    if slot.current is pooled:
+                        slot.current = None
+                    if pooled.active == 0:
+                        await cls._close_quietly(pooled.context)
+            await cls._release(slot)
+
+    @classmethod
+    async def health_check(cls, force: bool = False):
+        """Закрывает отвалившиеся и простаивающие дольше BROWSER_IDLE_TTL браузеры"""
+        now = time.monotonic()
+        if not force and now - cls._last_health_check < HEALTH_CHECK_INTERVAL:
+            return
+        cls._last_health_check = now
+        async with cls._get_lock():
+            for key, slot in list(cls._slots.items()):
+                if slot.busy():
+                    continue
+                dead = slot.browser is not None and not slot.browser.is_connected()
+                idle = now - slot.last_used > BROWSER_IDLE_TTL
+                if dead or idle:
+                    logger.info('BrowserPool: закрываем браузер %s (%s)', key, 'dead' if dead else 'idle')
+                    cls._slots.pop(key, None)
+                    await cls._close_slot(slot)
+
+    @classmethod
+    async def _close_slot(cls, slot: _BrowserSlot):
+        if slot.current is not None:
+            await cls._close_quietly(slot.current.context)
+            slot.current = None
+        if slot.browser is not None:
+            await cls._close_quietly(slot.browser)
+            slot.browser = None
+
+    @classmethod
+    async def close(cls):
+        async with cls._get_lock():
+            for slot in list(cls._slots.values()):
+                await cls._close_slot(slot)
+            cls._slots.clear()
+            if cls._playwright is not None:
+                try:
+                    await cls._playwright.stop()
+                except Exception:
+                    pass
+                cls._playwright = None
+        logger.info('BrowserPool закрыт: %s', cls.stats)
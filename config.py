@@ -1,7 +1,25 @@
 #!/usr/bin/env python3
-# config.py v2.0.0 (11.03.2026)
+# config.py v2.1.0 (18.10.2026)
+# - Настройки пула браузеров Playwright
+# - Настройки фильтра ресурсов (RESOURCE_*)
+# - Настройки HTTP-уровня загрузчика (HTTP_FIRST_ENABLED, HTTP_FETCH_TIMEOUT)
+# - Настройки параллельного сбора (PARSER_SOURCE_CONCURRENCY, PARSER_BROWSER_SLOTS, PARSER_DELAY_*)
+# - Настройки листания выдачи (PARSER_MAX_PAGES, PARSER_PAGE_BUDGET_*, PARSER_STOP_KNOWN)
+# - Разбор JSON-состояния страницы (PARSER_STATE_ENABLED, PARSER_STATE_COMPARE)
+# - Бэкенд разбора HTML по источнику (PARSE_BACKEND_CIAN, PARSE_BACKEND_AVITO: soup/strained/lxml)
+# - Сохранение HTML-фикстур парсеров (PARSER_FIXTURE_CAPTURE, PARSER_FIXTURES_DIR)
+# - Настройки определения округа (DADATA_SECRET_KEY, DADATA_BATCH_SIZE, DADATA_CONCURRENCY, DISTRICT_*)
+# - Сверка индекса подписок с перебором (MATCHER_VERIFY)
+# - Бэкенд подбора подписчиков (MATCHER_BACKEND: index/numpy)
+# - Реестр подписчиков в памяти (SUBSCRIBERS_LISTEN, SUBSCRIBERS_FULL_RELOAD)
+# - Очередь доставки в Telegram (DELIVERY_*)
+# - Таблица outbox: размер выборки, аренда взятой записи, период опроса (OUTBOX_*)
+# - Пакетные подтверждения доставки (DELIVERY_ACK_INTERVAL, DELIVERY_ACK_BATCH)
+# - Кэш file_id фотографий (PHOTO_CACHE_SIZE, PHOTO_FETCH_TIMEOUT)
+# - Режим получения обновлений (BOT_MODE: polling/webhook, WEBHOOK_*), адрес Bot API (TELEGRAM_BASE_URL)
+# - Параллельная обработка обновлений (UPDATES_CONCURRENCY, UPDATES_MAX_PENDING)
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 import os
 from typing import Dict, Any
@@ -11,6 +29,12 @@ ADMIN_ID = int(os.environ.get('ADMIN_ID', 0))
 TON_WALLET = os.environ.get('TON_WALLET', '')
 TONCENTER_API_KEY = os.environ.get('TONCENTER_API_KEY', '')
 DADATA_API_KEY = os.environ.get('DADATA_API_KEY', '')
+DADATA_SECRET_KEY = os.environ.get('DADATA_SECRET_KEY', '')
+DADATA_BATCH_SIZE = int(os.environ.get('DADATA_BATCH_SIZE', 10))
+DADATA_CONCURRENCY = int(os.environ.get('DADATA_CONCURRENCY', 3))
+DISTRICT_CACHE_TTL_DAYS = int(os.environ.get('DISTRICT_CACHE_TTL_DAYS', 30))
+DISTRICT_NEGATIVE_TTL_HOURS = int(os.environ.get('DISTRICT_NEGATIVE_TTL_HOURS', 24))
+DISTRICT_LRU_SIZE = int(os.environ.get('DISTRICT_LRU_SIZE', 20000))
 DATABASE_URL = os.environ.get('DATABASE_URL')
 PROXY_URL = os.environ.get('PROXY_URL')
 PAYMENT_PROVIDER_TOKEN = None  # оплата временно отключена
@@ -30,6 +54,69 @@ PARSING_INTERVAL = int(os.environ.get('PARSING_INTERVAL', 600))
 TELEGRAM_RATE_LIMIT = int(os.environ.get('TELEGRAM_RATE_LIMIT', 15))
 PROXY_LIST = [p.strip() for p in PROXY_URL.split(',') if p.strip()] if PROXY_URL else []
 
+BROWSER_CONTEXT_MAX_USES = int(os.environ.get('BROWSER_CONTEXT_MAX_USES', 20))
+BROWSER_IDLE_TTL = int(os.environ.get('BROWSER_IDLE_TTL', 1800))
+BROWSER_POOL_MAX = int(os.environ.get('BROWSER_POOL_MAX', 2))
+
+RESOURCE_FILTER_ENABLED = os.environ.get('RESOURCE_FILTER_ENABLED', '1') == '1'
+RESOURCE_BLOCK_TYPES = [t.strip() for t in os.environ.get('RESOURCE_BLOCK_TYPES', 'image,media,font').split(',') if t.strip()]
+RESOURCE_BLOCK_HOSTS = [h.strip().lower() for h in os.environ.get('RESOURCE_BLOCK_HOSTS', '').split(',') if h.strip()]
+RESOURCE_ALLOW_HOSTS = [h.strip().lower() for h in os.environ.get('RESOURCE_ALLOW_HOSTS', '').split(',') if h.strip()]
+
+HTTP_FIRST_ENABLED = os.environ.get('HTTP_FIRST_ENABLED', '1') == '1'
+HTTP_FETCH_TIMEOUT = int(os.environ.get('HTTP_FETCH_TIMEOUT', 25))
+
+PARSER_SOURCE_CONCURRENCY = int(os.environ.get('PARSER_SOURCE_CONCURRENCY', 2))
+PARSER_BROWSER_SLOTS = int(os.environ.get('PARSER_BROWSER_SLOTS', 2))
+PARSER_POLITENESS_DELAY = {
+    'cian': float(os.environ.get('PARSER_DELAY_CIAN', 1.5)),
+    'avito': float(os.environ.get('PARSER_DELAY_AVITO', 2.5)),
+}
+PARSER_MAX_PAGES = int(os.environ.get('PARSER_MAX_PAGES', 3))
+PARSER_PAGE_BUDGET = {
+    'cian': int(os.environ.get('PARSER_PAGE_BUDGET_CIAN', 5)),
+    'avito': int(os.environ.get('PARSER_PAGE_BUDGET_AVITO', 5)),
+}
+PARSER_STOP_KNOWN = int(os.environ.get('PARSER_STOP_KNOWN', 1))
+PARSER_STATE_ENABLED = os.environ.get('PARSER_STATE_ENABLED', '1') == '1'
+PARSER_STATE_COMPARE = os.environ.get('PARSER_STATE_COMPARE', '0') == '1'
+PARSE_BACKEND = {
+    'cian': os.environ.get('PARSE_BACKEND_CIAN', 'strained'),
+    'avito': os.environ.get('PARSE_BACKEND_AVITO', 'strained'),
+}
+PARSER_FIXTURE_CAPTURE = os.environ.get('PARSER_FIXTURE_CAPTURE', '0') == '1'
+PARSER_FIXTURES_DIR = os.environ.get('PARSER_FIXTURES_DIR', '/tmp/bot_parser_fixtures')
+MATCHER_VERIFY = os.environ.get('MATCHER_VERIFY', '0') == '1'
+MATCHER_BACKEND = os.environ.get('MATCHER_BACKEND', 'index').strip().lower()
+SUBSCRIBERS_LISTEN = os.environ.get('SUBSCRIBERS_LISTEN', '1') == '1'
+SUBSCRIBERS_FULL_RELOAD = int(os.environ.get('SUBSCRIBERS_FULL_RELOAD', 3600))
+DELIVERY_GLOBAL_RATE = float(os.environ.get('DELIVERY_GLOBAL_RATE', 30))
+DELIVERY_CHAT_RATE = float(os.environ.get('DELIVERY_CHAT_RATE', 1))
+DELIVERY_QUEUE_SIZE = int(os.environ.get('DELIVERY_QUEUE_SIZE', 5000))
+DELIVERY_WORKERS = int(os.environ.get('DELIVERY_WORKERS', TELEGRAM_RATE_LIMIT))
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', 5))
+DELIVERY_STATS_INTERVAL = int(os.environ.get('DELIVERY_STATS_INTERVAL', 60))
+DELIVERY_ACK_INTERVAL = float(os.environ.get('DELIVERY_ACK_INTERVAL', 1))
+DELIVERY_ACK_BATCH = int(os.environ.get('DELIVERY_ACK_BATCH', 500))
+PHOTO_CACHE_SIZE = int(os.environ.get('PHOTO_CACHE_SIZE', 20000))
+PHOTO_FETCH_TIMEOUT = int(os.environ.get('PHOTO_FETCH_TIMEOUT', 15))
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').strip().lower()
+# Публичный адрес webhook целиком, путь должен совпадать с WEBHOOK_PATH (https://bot.example.com/telegram)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get('WEBHOOK_DRAIN_TIMEOUT', 25))
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL', '')
+UPDATES_CONCURRENCY = int(os.environ.get('UPDATES_CONCURRENCY', 32))
+UPDATES_MAX_PENDING = int(os.environ.get('UPDATES_MAX_PENDING', 256))
+OUTBOX_CLAIM_BATCH = int(os.environ.get('OUTBOX_CLAIM_BATCH', 100))
+OUTBOX_LEASE = int(os.environ.get('OUTBOX_LEASE', 600))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+
 DISTRICTS = ['ЦАО', 'САО', 'СВАО', 'ВАО', 'ЮВАО', 'ЮАО', 'ЮЗАО', 'ЗАО', 'СЗАО', 'НАО', 'ТАО', 'ЗелАО']
 ROOM_OPTIONS = ['Студия', '1-комнатная', '2-комнатная', '3-комнатная', '4-комнатная+']
 DEAL_TYPES = ['sale', 'rent']
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
-# database.py v2.0.0 (11.03.2026)
-# - Актуализирована версия модуля
+# database.py v2.1.0 (18.10.2026)
+# - get_existing_ad_ids: проверка уже сохранённых объявлений одним запросом
+# - Таблица address_districts: кэш адрес -> округ с TTL для DistrictResolver
+# - users.filters_version: увеличивается в set_user_filters, отдаётся в get_active_subscribers
+# - Триггер users_subscriber_change: NOTIFY subscribers_changed при изменении фильтров, подписки или бана
+# - get_active_subscribers не возвращает забаненных; get_subscriber_rows и listen для реестра подписчиков
+# - Таблица outbox: очередь отправки со статусами, попытками и причиной ошибки; выборка FOR UPDATE SKIP LOCKED
+# - save_ads: пачка объявлений одним INSERT … SELECT unnest … RETURNING ad_id вместо save_ad на каждое
+# - add_to_outbox возвращает зарезервированные пары; outbox_delivered подтверждает пачку записей
+# - Таблица photo_files: URL фото объявления -> file_id Telegram
+# - Роль пользователя в строках реестра подписчиков и в условии триггера users_subscriber_change
 
 import asyncpg
 import json
@@ -10,16 +19,21 @@ from typing import Optional, List, Tuple, Any
 from datetime import datetime, timedelta
 from models import Ad
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 logger = logging.getLogger(__name__)
 
 
+SUBSCRIBERS_CHANNEL = 'subscribers_changed'
+
+
 class Database:
     _pool: Optional[asyncpg.Pool] = None
+    _dsn: Optional[str] = None
 
     @classmethod
     async def init(cls, dsn: str):
+        cls._dsn = dsn
         cls._pool = await asyncpg.create_pool(dsn, min_size=5, max_size=20)
         async with cls._pool.acquire() as conn:
             # Таблица пользователей
@@ -34,7 +48,8 @@ class Database:
                     plan TEXT,
                     subscription_source TEXT DEFAULT NULL,
                     created_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())::BIGINT,
-                    banned BOOLEAN DEFAULT FALSE
+                    banned BOOLEAN DEFAULT FALSE,
+                    filters_version INTEGER DEFAULT 0
                 )
             ''')
             # Добавляем колонки если их нет (для существующих БД)
@@ -42,6 +57,7 @@ class Database:
                 ('banned', 'BOOLEAN DEFAULT FALSE'),
                 ('subscription_source', 'TEXT DEFAULT NULL'),
                 ('role', "TEXT DEFAULT 'user'"),
+                ('filters_version', 'INTEGER DEFAULT 0'),
             ]:
                 try:
                     await conn.execute(f'ALTER TABLE users ADD COLUMN IF NOT EXISTS {col} {definition}')
@@ -160,11 +176,67 @@ class Database:
                 )
             ''')
 
+            # Очередь отправки: pending -> in_flight -> delivered / failed (с причиной и числом попыток)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    ad_id VARCHAR(255) NOT NULL,
+                    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    locked_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    delivered_at TIMESTAMP,
+                    UNIQUE(user_id, ad_id)
+                )
+            ''')
+
+            # Кэш адрес -> округ (district NULL — округ не определён, хранится меньше)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS address_districts (
+                    address TEXT PRIMARY KEY,
+                    district VARCHAR(10),
+                    resolved_at TIMESTAMP DEFAULT NOW()
+                )
+            ''')
+
+            # file_id уже загруженных в Telegram фотографий объявлений
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS photo_files (
+                    url TEXT PRIMARY KEY,
+                    ad_id VARCHAR(255),
+                    file_id TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+            ''')
+
+            # Уведомление реестра подписчиков об изменении фильтров, подписки, роли или бана
+            await conn.execute(f'''
+                CREATE OR REPLACE FUNCTION notify_subscriber_change() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('{SUBSCRIBERS_CHANNEL}', COALESCE(NEW.user_id, OLD.user_id)::text);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            await conn.execute('DROP TRIGGER IF EXISTS users_subscriber_change ON users')
+            await conn.execute('''
+                CREATE TRIGGER users_subscriber_change
+                AFTER INSERT OR DELETE OR UPDATE OF filters, filters_version, subscribed_until, role, banned ON users
+                FOR EACH ROW EXECUTE FUNCTION notify_subscriber_change()
+            ''')
+
             # Индексы
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_ads_created ON ads(created_at)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_subscribed ON users(subscribed_until)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_user_status ON payments(user_id, status)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_txid ON payments(txid)')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(available_at) WHERE status = 'pending'")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_in_flight ON outbox(locked_at) WHERE status = 'in_flight'")
 
         logger.info("База данных инициализирована")
 
@@ -207,11 +279,14 @@ class Database:
             ''', referrer_id, user_id, int(time.time()))
 
     @classmethod
-    async def set_user_filters(cls, user_id: int, filters_dict: dict):
+    async def set_user_filters(cls, user_id: int, filters_dict: dict) -> int:
+        """Сохраняет фильтры и возвращает новую версию (по ней сбрасывается кэш скомпилированных фильтров)"""
         async with cls._pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO users (user_id, filters) VALUES ($1, $2)
-                ON CONFLICT (user_id) DO UPDATE SET filters = EXCLUDED.filters
+            return await conn.fetchval('''
+                INSERT INTO users (user_id, filters, filters_version) VALUES ($1, $2, 1)
+                ON CONFLICT (user_id) DO UPDATE
+                SET filters = EXCLUDED.filters, filters_version = COALESCE(users.filters_version, 0) + 1
+                RETURNING filters_version
             ''', user_id, json.dumps(filters_dict, ensure_ascii=False))
 
     @classmethod
@@ -337,7 +412,28 @@ class Database:
     async def get_active_subscribers(cls):
         now = int(time.time())
         async with cls._pool.acquire() as conn:
-            return await conn.fetch('SELECT user_id, filters FROM users WHERE subscribed_until > $1', now)
+            return await conn.fetch('''
+                SELECT user_id, filters, filters_version, subscribed_until, role FROM users
+                WHERE subscribed_until > $1 AND NOT COALESCE(banned, FALSE)
+            ''', now)
+
+    @classmethod
+    async def get_subscriber_rows(cls, user_ids: List[int]):
+        """Строки пользователей для реестра подписчиков, в том числе без подписки и забаненные"""
+        async with cls._pool.acquire() as conn:
+            return await conn.fetch('''
+                SELECT user_id, filters, filters_version, subscribed_until, role, COALESCE(banned, FALSE) AS banned
+                FROM users WHERE user_id = ANY($1::bigint[])
+            ''', list(user_ids))
+
+    @classmethod
+    async def listen(cls, channel: str, callback, on_termination=None) -> asyncpg.Connection:
+        """Отдельное соединение вне пула под LISTEN (соединение из пула держать нельзя)"""
+        conn = await asyncpg.connect(cls._dsn)
+        await conn.add_listener(channel, callback)
+        if on_termination is not None:
+            conn.add_termination_listener(on_termination)
+        return conn
 
     @classmethod
     async def get_active_subscribers_detailed(cls):
@@ -473,6 +569,51 @@ class Database:
                 logger.error(f"Ошибка сохранения объявления {ad.id}: {e}")
                 return False
 
+    @classmethod
+    async def save_ads(cls, ads: List[Ad]) -> List[Ad]:
+        """Сохраняет пачку объявлений одним запросом и возвращает только новые (в исходном порядке)"""
+        unique = list({ad.id: ad for ad in ads}.values())
+        if not unique:
+            return []
+        started = time.perf_counter()
+        now = datetime.now()
+        try:
+            async with cls._pool.acquire() as conn:
+                rows = await conn.fetch('''
+                    INSERT INTO ads (ad_id, source, deal_type, title, price, price_value, address, metro,
+                                     rooms, floor, area, owner, district, url, photos, published_at)
+                    SELECT a.ad_id, a.source, a.deal_type, a.title, a.price, a.price_value, a.address, a.metro,
+                           a.rooms, a.floor, a.area, a.owner, a.district, a.url, a.photos::jsonb, $16
+                    FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::integer[],
+                                $7::text[], $8::text[], $9::text[], $10::text[], $11::text[], $12::boolean[],
+                                $13::text[], $14::text[], $15::text[])
+                         AS a(ad_id, source, deal_type, title, price, price_value, address, metro,
+                              rooms, floor, area, owner, district, url, photos)
+                    ON CONFLICT (ad_id) DO NOTHING
+                    RETURNING ad_id
+                ''', [ad.id for ad in unique], [ad.source for ad in unique], [ad.deal_type for ad in unique],
+                    [ad.title for ad in unique], [ad.price for ad in unique], [ad.price_value for ad in unique],
+                    [ad.address for ad in unique], [ad.metro for ad in unique], [ad.rooms for ad in unique],
+                    [ad.floor for ad in unique], [ad.area for ad in unique], [ad.owner for ad in unique],
+                    [ad.district_detected for ad in unique], [ad.link for ad in unique],
+                    [json.dumps(ad.photos) for ad in unique], now)
+        except Exception as e:
+            # Одно кривое объявление не должно терять всю пачку — сохраняем по одному
+            logger.error(f"Ошибка пакетного сохранения {len(unique)} объявлений: {e}, сохраняем по одному")
+            return [ad for ad in unique if await cls.save_ad(ad)]
+        inserted = {row['ad_id'] for row in rows}
+        logger.info(f"Сохранение объявлений: {len(unique)} за {(time.perf_counter() - started) * 1000:.0f} мс, "
+                    f"новых {len(inserted)}")
+        return [ad for ad in unique if ad.id in inserted]
+
+    @classmethod
+    async def get_existing_ad_ids(cls, ad_ids: List[str]) -> set:
+        if not ad_ids:
+            return set()
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('SELECT ad_id FROM ads WHERE ad_id = ANY($1::text[])', ad_ids)
+            return {row['ad_id'] for row in rows}
+
     @classmethod
     async def was_ad_sent_to_user(cls, user_id: int, ad_id: str) -> bool:
         async with cls._pool.acquire() as conn:
@@ -482,7 +623,7 @@ class Database:
 
     @classmethod
     async def mark_ad_sent(cls, user_id: int, ad_id: str):
-        # Атомарная вставка с ON CONFLICT используется непосредственно в send_ad_to_user
+        # Отметка ставится при подтверждении доставки из outbox (outbox_delivered)
         pass
 
     # ========== Балансы (оставлено для совместимости) ==========
@@ -535,6 +676,174 @@ class Database:
                 DO UPDATE SET amount = $3, updated_at = NOW()
             ''', user_id, currency, amount)
 
+    # ========== Очередь отправки (outbox) ==========
+    @classmethod
+    async def add_to_outbox(cls, pairs: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+        """Резервирует пары (user_id, ad_id) одним запросом и возвращает только действительно добавленные:
+        уже отправленные (sent_ads) и уже стоящие в очереди пропускаются"""
+        if not pairs:
+            return []
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                INSERT INTO outbox (user_id, ad_id)
+                SELECT p.user_id, p.ad_id FROM unnest($1::bigint[], $2::text[]) AS p(user_id, ad_id)
+                WHERE NOT EXISTS (SELECT 1 FROM sent_ads s WHERE s.user_id = p.user_id AND s.ad_id = p.ad_id)
+                ON CONFLICT (user_id, ad_id) DO NOTHING
+                RETURNING user_id, ad_id
+            ''', [p[0] for p in pairs], [p[1] for p in pairs])
+            return [(row['user_id'], row['ad_id']) for row in rows]
+
+    @classmethod
+    async def claim_outbox(cls, limit: int, lease: timedelta):
+        """Забирает готовые к отправке записи (и зависшие in_flight старше lease) без блокировки других процессов"""
+        async with cls._pool.acquire() as conn:
+            return await conn.fetch('''
+                UPDATE outbox SET status = 'in_flight', locked_at = NOW(), attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE (status = 'pending' AND available_at <= NOW())
+                       OR (status = 'in_flight' AND locked_at < NOW() - $2::interval)
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, user_id, ad_id, attempts
+            ''', limit, lease)
+
+    @classmethod
+    async def outbox_renew(cls, outbox_ids: List[int]):
+        """Продлевает аренду записей, которые процесс держит в памяти (очередь, отложенные, неподтверждённые)"""
+        if not outbox_ids:
+            return
+        async with cls._pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE outbox SET locked_at = NOW() WHERE id = ANY($1::bigint[]) AND status = 'in_flight'",
+                list(outbox_ids))
+
+    @classmethod
+    async def outbox_delivered(cls, outbox_ids: List[int]):
+        """Пачка подтверждений доставки: статус в outbox и отметки sent_ads одним запросом"""
+        if not outbox_ids:
+            return
+        async with cls._pool.acquire() as conn:
+            await conn.execute('''
+                WITH done AS (
+                    UPDATE outbox SET status = 'delivered', delivered_at = NOW(), last_error = NULL
+                    WHERE id = ANY($1::bigint[]) RETURNING user_id, ad_id
+                )
+                INSERT INTO sent_ads (user_id, ad_id) SELECT user_id, ad_id FROM done
+                ON CONFLICT (user_id, ad_id) DO NOTHING
+            ''', list(outbox_ids))
+
+    @classmethod
+    async def outbox_retry(cls, outbox_id: int, delay: timedelta, error: str):
+        async with cls._pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE outbox SET status = 'pending', available_at = NOW() + $2::interval, locked_at = NULL,
+                                  last_error = $3
+                WHERE id = $1
+            ''', outbox_id, delay, error)
+
+    @classmethod
+    async def outbox_failed(cls, outbox_id: int, error: str):
+        async with cls._pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE outbox SET status = 'failed', locked_at = NULL, last_error = $2 WHERE id = $1",
+                outbox_id, error)
+
+    @classmethod
+    async def outbox_release(cls, outbox_ids: List[int]):
+        """Возвращает взятые, но не отправленные записи (остановка бота) — попытка не засчитывается"""
+        if not outbox_ids:
+            return
+        async with cls._pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE outbox SET status = 'pending', locked_at = NULL, attempts = GREATEST(attempts - 1, 0)
+                WHERE id = ANY($1::bigint[]) AND status = 'in_flight'
+            ''', outbox_ids)
+
+    @classmethod
+    async def get_outbox_counts(cls) -> dict:
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('SELECT status, COUNT(*) AS n FROM outbox GROUP BY status')
+            return {row['status']: row['n'] for row in rows}
+
+    @classmethod
+    async def get_ads_by_ids(cls, ad_ids: List[str]) -> List[Ad]:
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT ad_id, source, deal_type, title, price, price_value, address, metro, rooms, floor, area,
+                       owner, district, url, photos
+                FROM ads WHERE ad_id = ANY($1::text[])
+            ''', list(ad_ids))
+        ads = []
+        for row in rows:
+            photos = row['photos']
+            if isinstance(photos, str):
+                photos = json.loads(photos)
+            ads.append(Ad(
+                id=row['ad_id'], source=row['source'], deal_type=row['deal_type'], title=row['title'] or '',
+                link=row['url'] or '', price=row['price'] or '', price_value=row['price_value'] or 0,
+                address=row['address'] or '', metro=row['metro'] or '', floor=row['floor'] or '',
+                area=row['area'] or '', rooms=row['rooms'] or '', owner=bool(row['owner']),
+                photos=photos or [], district_detected=row['district'],
+            ))
+        return ads
+
+    @classmethod
+    async def cleanup_outbox(cls, days: int = 7):
+        async with cls._pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM outbox WHERE status IN ('delivered', 'failed') AND created_at < NOW() - $1::interval",
+                timedelta(days=days))
+
+    # ========== Кэш округов ==========
+    @classmethod
+    async def get_address_districts(cls, addresses: List[str], ttl: timedelta,
+                                    negative_ttl: timedelta) -> dict:
+        if not addresses:
+            return {}
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT address, district FROM address_districts
+                WHERE address = ANY($1::text[])
+                  AND resolved_at > NOW() - CASE WHEN district IS NULL THEN $3::interval ELSE $2::interval END
+            ''', addresses, ttl, negative_ttl)
+            return {row['address']: row['district'] for row in rows}
+
+    @classmethod
+    async def save_address_districts(cls, resolved: dict):
+        if not resolved:
+            return
+        async with cls._pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO address_districts (address, district, resolved_at)
+                SELECT a, d, NOW() FROM unnest($1::text[], $2::text[]) AS t(a, d)
+                ON CONFLICT (address) DO UPDATE SET district = EXCLUDED.district, resolved_at = NOW()
+            ''', list(resolved.keys()), list(resolved.values()))
+
+    # ========== Кэш фото ==========
+    @classmethod
+    async def get_photo_files(cls, urls: List[str]) -> dict:
+        if not urls:
+            return {}
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('SELECT url, file_id FROM photo_files WHERE url = ANY($1::text[])', urls)
+            return {row['url']: row['file_id'] for row in rows}
+
+    @classmethod
+    async def save_photo_file(cls, url: str, ad_id: str, file_id: str):
+        async with cls._pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO photo_files (url, ad_id, file_id) VALUES ($1, $2, $3)
+                ON CONFLICT (url) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = NOW()
+            ''', url, ad_id, file_id)
+
+    @classmethod
+    async def delete_photo_file(cls, url: str):
+        async with cls._pool.acquire() as conn:
+            await conn.execute('DELETE FROM photo_files WHERE url = $1', url)
+
     # ========== Очистка ==========
     @classmethod
     async def cleanup_old_ads(cls, days: int = 30):
@@ -542,4 +851,6 @@ class Database:
             result = await conn.execute(
                 "DELETE FROM ads WHERE created_at < NOW() - $1::interval", timedelta(days=days))
             deleted = result.split()[-1] if result else "0"
+            await conn.execute(
+                "DELETE FROM photo_files WHERE created_at < NOW() - $1::interval", timedelta(days=days))
             logger.info(f"Очистка БД: удалено {deleted} старых объявлений")
\ No newline at end of file
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# delivery.py v2.1.0 (18.10.2026)
+# - Очередь доставки объявлений в Telegram: ограниченная очередь, пул воркеров, общий token bucket
+#   (DELIVERY_GLOBAL_RATE, ~30 сообщений/с) и bucket на чат (DELIVERY_CHAT_RATE, 1 сообщение/с)
+# - RetryAfter и таймауты: задача откладывается и возвращается в очередь, а не теряется; RetryAfter
+#   приостанавливает и общий bucket
+# - Счётчики отправок, скорость и глубина очереди пишутся в лог раз в DELIVERY_STATS_INTERVAL
+# - Задачи берутся из таблицы outbox (FOR UPDATE SKIP LOCKED): переживают перезапуск, несколько процессов
+#   бота делят рассылку; итог каждой отправки (доставлено, повтор, ошибка с причиной) пишется в outbox
+# - Аренда записей, которые процесс держит в памяти (в очереди и отложенные бакетом чата), продлевается раз
+#   в OUTBOX_LEASE/3 — их не заберёт повторно ни этот, ни другой процесс
+# - Подтверждения доставки копятся и пишутся пачкой раз в DELIVERY_ACK_INTERVAL: воркер после отправки
+#   не ждёт базу; до записи подтверждения аренда записи продлевается, при остановке буфер записывается
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from config import (
+    DELIVERY_GLOBAL_RATE, DELIVERY_CHAT_RATE, DELIVERY_QUEUE_SIZE, DELIVERY_WORKERS, DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_STATS_INTERVAL, DELIVERY_ACK_INTERVAL, DELIVERY_ACK_BATCH, OUTBOX_CLAIM_BATCH, OUTBOX_LEASE, OUTBOX_POLL_INTERVAL,
+)
+from database import Database
+from models import Ad
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity в запасе"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Берёт токен и возвращает 0, либо возвращает, сколько секунд ждать до следующего"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Занимает токен в долг: возвращает, через сколько секунд он станет доступен"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def penalize(self, seconds: float):
+        """После RetryAfter: токены появятся не раньше чем через seconds"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class DeliveryJob:
+    __slots__ = ('outbox_id', 'user_id', 'ad', 'attempts', 'slot')
+
+    def __init__(self, outbox_id: int, user_id: int, ad: Ad, attempts: int):
+        self.outbox_id = outbox_id
+        self.user_id = user_id
+        self.ad = ad
+        # Номер попытки из outbox (увеличивается при каждой выборке записи)
+        self.attempts = attempts
+        # Токен чата уже занят под эту задачу, после отсрочки проверять его повторно не нужно
+        self.slot = False
+
+
+# send(bot, user_id, ad): ошибки Telegram пробрасываются и обрабатываются очередью
+SendFunc = Callable[[object, int, Ad], Awaitable[None]]
+
+
+class Delivery:
+    """Подкачка берёт записи outbox, пока в очереди есть место; воркеры отправляют. Задача для чата без
+    свободного токена занимает токен в долг и откладывается до его появления, воркер берёт следующую"""
+    _bot = None
+    _send: Optional[SendFunc] = None
+    _queue: Optional[asyncio.Queue] = None
+    _delayed: List[Tuple[float, int, DeliveryJob]] = []
+    _delayed_event: Optional[asyncio.Event] = None
+    _outbox_event: Optional[asyncio.Event] = None
+    # Доставленные записи outbox, ещё не подтверждённые в базе
+    _acks: List[int] = []
+    _ack_event: Optional[asyncio.Event] = None
+    # Записи outbox, взятые этим процессом и ещё не закрытые в базе: аренда продлевается _renewer
+    _held: Set[int] = set()
+    _seq = itertools.count()
+    _global: Optional[TokenBucket] = None
+    _chats: Dict[int, TokenBucket] = {}
+    # Объявления текущих циклов, чтобы не читать их из ads при каждой выборке outbox
+    _ads: 'OrderedDict[str, Ad]' = OrderedDict()
+    _tasks: List[asyncio.Task] = []
+    stats: Dict[str, int] = {'enqueued': 0, 'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0}
+
+    @classmethod
+    def start(cls, bot, send: SendFunc):
+        cls._bot = bot
+        cls._send = send
+        cls._queue = asyncio.Queue(maxsize=DELIVERY_QUEUE_SIZE)
+        cls._delayed = []
+        cls._delayed_event = asyncio.Event()
+        cls._outbox_event = asyncio.Event()
+        cls._acks = []
+        cls._ack_event = asyncio.Event()
+        cls._held = set()
+        cls._global = TokenBucket(DELIVERY_GLOBAL_RATE, DELIVERY_GLOBAL_RATE)
+        cls._chats = {}
+        cls._tasks = [asyncio.create_task(cls._worker(i)) for i in range(DELIVERY_WORKERS)]
+        cls._tasks.append(asyncio.create_task(cls._scheduler()))
+        cls._tasks.append(asyncio.create_task(cls._feeder()))
+        cls._tasks.append(asyncio.create_task(cls._acker()))
+        cls._tasks.append(asyncio.create_task(cls._renewer()))
+        cls._tasks.append(asyncio.create_task(cls._stats_loop()))
+        logger.info('Очередь доставки запущена: воркеров %s, %s сообщ./с, очередь до %s',
+                    DELIVERY_WORKERS, DELIVERY_GLOBAL_RATE, DELIVERY_QUEUE_SIZE)
+
+    @classmethod
+    def remember_ads(cls, ads: Iterable[Ad]):
+        for ad in ads:
+            cls._ads[ad.id] = ad
+            cls._ads.move_to_end(ad.id)
+        while len(cls._ads) > DELIVERY_QUEUE_SIZE:
+            cls._ads.popitem(last=False)
+
+    @classmethod
+    async def submit(cls, pairs: List[Tuple[int, Ad]]) -> int:
+        """Резервирует пары (user_id, объявление) в outbox одним запросом и будит подкачку; в доставку
+        попадают только пары, которые вернул INSERT (не отправленные и не стоящие в очереди раньше)"""
+        added = await Database.add_to_outbox([(user_id, ad.id) for user_id, ad in pairs])
+        if added:
+            ads = {ad.id: ad for _, ad in pairs}
+            cls.remember_ads(ads[ad_id] for ad_id in {ad_id for _, ad_id in added})
+            cls.stats['enqueued'] += len(added)
+            if cls._outbox_event is not None:
+                cls._outbox_event.set()
+        return len(added)
+
+    @classmethod
+    async def throttle(cls):
+        """Токен общего bucket для сообщений вне очереди (рассылка администратора): лимит Telegram общий на бота"""
+        if cls._global is not None:
+            await cls._global.acquire()
+
+    @classmethod
+    def pause(cls, seconds: float):
+        """Flood wait на весь бот: общий bucket не выдаёт токены seconds секунд"""
+        if cls._global is not None:
+            cls._global.penalize(seconds)
+
+    @classmethod
+    def depth(cls) -> int:
+        return (cls._queue.qsize() if cls._queue else 0) + len(cls._delayed)
+
+    @classmethod
+    async def _feeder(cls):
+        """Подкачка из outbox: берёт не больше, чем помещается в очередь"""
+        lease = timedelta(seconds=OUTBOX_LEASE)
+        while True:
+            room = DELIVERY_QUEUE_SIZE - cls.depth()
+            claimed = []
+            if room > 0:
+                try:
+                    claimed = await Database.claim_outbox(min(room, OUTBOX_CLAIM_BATCH), lease)
+                except Exception:
+                    logger.warning('Не удалось выбрать записи outbox', exc_info=True)
+            if claimed:
+                # Запись, которую процесс уже держит, вернулась из-за просроченной аренды — второй раз не ставим
+                claimed = [row for row in claimed if row['id'] not in cls._held]
+                cls.stats['claimed'] += len(claimed)
+                for job in await cls._jobs(claimed):
+                    await cls._queue.put(job)
+                continue
+            cls._outbox_event.clear()
+            try:
+                await asyncio.wait_for(cls._outbox_event.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    async def _jobs(cls, rows) -> List[DeliveryJob]:
+        missing = {row['ad_id'] for row in rows if row['ad_id'] not in cls._ads}
+        if missing:
+            cls.remember_ads(await Database.get_ads_by_ids(list(missing)))
+        jobs = []
+        for row in rows:
+            ad = cls._ads.get(row['ad_id'])
+            if ad is None:
+                cls.stats['failed'] += 1
+                await Database.outbox_failed(row['id'], 'объявление удалено из ads')
+                continue
+            cls._held.add(row['id'])
+            jobs.append(DeliveryJob(row['id'], row['user_id'], ad, row['attempts']))
+        return jobs
+
+    @classmethod
+    def _defer(cls, job: DeliveryJob, delay: float):
+        heapq.heappush(cls._delayed, (time.monotonic() + delay, next(cls._seq), job))
+        cls._delayed_event.set()
+
+    @classmethod
+    async def _scheduler(cls):
+        """Возвращает отложенные задачи в очередь, когда подходит их время"""
+        while True:
+            cls._delayed_event.clear()
+            now = time.monotonic()
+            while cls._delayed and cls._delayed[0][0] <= now:
+                _, _, job = heapq.heappop(cls._delayed)
+                await cls._queue.put(job)
+            timeout = cls._delayed[0][0] - time.monotonic() if cls._delayed else None
+            try:
+                await asyncio.wait_for(cls._delayed_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    def _chat_bucket(cls, user_id: int) -> TokenBucket:
+        bucket = cls._chats.get(user_id)
+        if bucket is None:
+            bucket = cls._chats[user_id] = TokenBucket(DELIVERY_CHAT_RATE, 1)
+        return bucket
+
+    @classmethod
+    async def _worker(cls, number: int):
+        while True:
+            job = await cls._queue.get()
+            try:
+                await cls._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception('Воркер доставки %s: ошибка задачи для %s', number, job.user_id)
+                # Повтор с учётом DELIVERY_MAX_ATTEMPTS: запись, которая падает всегда, закончится failed,
+                # а не будет возвращаться после каждой аренды
+                try:
+                    await cls._retry(job, min(60.0, 2.0 ** job.attempts), f'{type(e).__name__}: {e}')
+                except Exception:
+                    # Запись останется in_flight и вернётся после аренды
+                    cls._held.discard(job.outbox_id)
+                    logger.warning('Не удалось записать повтор задачи %s в outbox', job.outbox_id, exc_info=True)
+            finally:
+                cls._queue.task_done()
+
+    @classmethod
+    async def _process(cls, job: DeliveryJob):
+        await cls._global.acquire()
+        chat = cls._chat_bucket(job.user_id)
+        if not job.slot:
+            wait = chat.reserve()
+            if wait:
+                # Общий токен возвращаем: в этот раз задача не отправляется
+                cls._global.refund()
+                job.slot = True
+                cls.stats['deferred'] += 1
+                cls._defer(job, wait)
+                return
+        job.slot = False
+        try:
+            await cls._send(cls._bot, job.user_id, job.ad)
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            logger.warning('Rate limit Telegram для %s: откладываем на %s с', job.user_id, retry_after)
+            # Лимит чата бакет чата не превышает, значит, flood wait на весь бот — паузу берут все отправки
+            chat.penalize(retry_after)
+            cls.pause(retry_after)
+            await cls._retry(job, retry_after, f'RetryAfter {retry_after}')
+            return
+        except (Forbidden, BadRequest) as e:
+            cls.stats['failed'] += 1
+            logger.warning('Не удалось доставить объявление пользователю %s: %s', job.user_id, e)
+            try:
+                await Database.outbox_failed(job.outbox_id, f'{type(e).__name__}: {e}')
+            finally:
+                cls._held.discard(job.outbox_id)
+            return
+        except (TimedOut, NetworkError) as e:
+            logger.warning('Таймаут отправки пользователю %s (попытка %s)', job.user_id, job.attempts)
+            await cls._retry(job, min(60.0, 2.0 ** job.attempts), f'{type(e).__name__}: {e}')
+            return
+        # Запись остаётся в _held до записи подтверждения: пока оно в памяти, аренда продлевается
+        cls._acks.append(job.outbox_id)
+        if len(cls._acks) >= DELIVERY_ACK_BATCH:
+            cls._ack_event.set()
+        cls.stats['sent'] += 1
+
+    @classmethod
+    async def _retry(cls, job: DeliveryJob, delay: float, error: str):
+        """Повтор через outbox: запись снова становится pending с available_at в будущем"""
+        try:
+            if job.attempts >= DELIVERY_MAX_ATTEMPTS:
+                cls.stats['failed'] += 1
+                logger.warning('Объявление %s пользователю %s не доставлено за %s попыток',
+                               job.ad.id, job.user_id, job.attempts)
+                await Database.outbox_failed(job.outbox_id, error)
+                return
+            cls.stats['retried'] += 1
+            await Database.outbox_retry(job.outbox_id, timedelta(seconds=delay), error)
+            cls._outbox_event.set()
+        finally:
+            cls._held.discard(job.outbox_id)
+
+    @classmethod
+    async def _acker(cls):
+        while True:
+            try:
+                await asyncio.wait_for(cls._ack_event.wait(), timeout=DELIVERY_ACK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            cls._ack_event.clear()
+            await cls._flush_acks()
+
+    @classmethod
+    async def _flush_acks(cls) -> bool:
+        """Неудачная запись подтверждений повторяется в следующий раз, аренда этих записей продлевается;
+        при падении процесса записи вернутся после аренды и будут отправлены повторно"""
+        while cls._acks:
+            batch, cls._acks = cls._acks[:DELIVERY_ACK_BATCH], cls._acks[DELIVERY_ACK_BATCH:]
+            try:
+                await Database.outbox_delivered(batch)
+            except Exception:
+                cls._acks[:0] = batch
+                logger.warning('Не удалось подтвердить доставку %s записей outbox', len(batch), exc_info=True)
+                return False
+            cls._held.difference_update(batch)
+        return True
+
+    @classmethod
+    async def _renewer(cls):
+        """Задача, отложенная бакетом чата, может ждать дольше OUTBOX_LEASE (сотни объявлений одному
+        пользователю при DELIVERY_CHAT_RATE=1/с) — без продления claim_outbox отдал бы её повторно"""
+        while True:
+            await asyncio.sleep(OUTBOX_LEASE / 3)
+            if not cls._held:
+                continue
+            try:
+                await Database.outbox_renew(list(cls._held))
+            except Exception:
+                logger.warning('Не удалось продлить аренду %s записей outbox', len(cls._held), exc_info=True)
+
+    @classmethod
+    async def _stats_loop(cls):
+        last_sent, last_time = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(DELIVERY_STATS_INTERVAL)
+            now = time.monotonic()
+            rate = (cls.stats['sent'] - last_sent) / (now - last_time)
+            last_sent, last_time = cls.stats['sent'], now
+            # Чаты без активности не держим в памяти
+            for user_id in [u for u, b in cls._chats.items() if b.idle()]:
+                del cls._chats[user_id]
+            if rate or cls.depth():
+                try:
+                    outbox = await Database.get_outbox_counts()
+                except Exception:
+                    outbox = {}
+                logger.info('Доставка: %.1f сообщ./с, в очереди %s (отложено %s), outbox %s, %s',
+                            rate, cls._queue.qsize(), len(cls._delayed), outbox, cls.stats)
+
+    @classmethod
+    async def close(cls):
+        for task in cls._tasks:
+            task.cancel()
+        await asyncio.gather(*cls._tasks, return_exceptions=True)
+        cls._tasks = []
+        # Подтверждения из памяти пишутся до закрытия базы, иначе после перезапуска эти сообщения ушли бы снова
+        if not await cls._flush_acks():
+            logger.warning('Подтверждения %s доставок не записаны, они будут отправлены повторно', len(cls._acks))
+        cls._acks = []
+        # Взятые, но не начатые задачи возвращаем в outbox сразу, не дожидаясь истечения аренды
+        pending = [job.outbox_id for _, _, job in cls._delayed]
+        while cls._queue is not None and not cls._queue.empty():
+            pending.append(cls._queue.get_nowait().outbox_id)
+        cls._delayed = []
+        cls._held.clear()
+        if pending:
+            try:
+                await Database.outbox_release(pending)
+                logger.info('Очередь доставки остановлена, возвращено в outbox: %s', len(pending))
+            except Exception:
+                logger.warning('Не удалось вернуть %s задач в outbox, их заберут после аренды', len(pending),
+                               exc_info=True)
@@ -1,5 +1,6 @@
 #!/bin/bash
-# deploy.sh v1.1 (04.03.2026)
+# deploy.sh v1.2 (18.10.2026)
+# - Копируется каталог data/ (справочник округов)
 # Скрипт развёртывания бота на VPS
 # Запуск: bash deploy.sh
 
@@ -22,6 +23,7 @@ mkdir -p "$BOT_DIR"
 echo "[3/7] Копируем файлы..."
 cp *.py "$BOT_DIR/"
 cp requirements.txt "$BOT_DIR/"
+cp -r data "$BOT_DIR/"
 cp .env "$BOT_DIR/" 2>/dev/null || echo "  ВНИМАНИЕ: .env не найден, создайте его вручную!"
 
 # 4. Создать виртуальное окружение
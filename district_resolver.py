@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# district_resolver.py v2.1.0 (18.10.2026)
+# - Определение округа Москвы по адресу через DaData: общая сессия, пакетные запросы, ограничение параллельности
+# - Кэш адрес -> округ: LRU в памяти перед таблицей address_districts с TTL (отрицательные ответы тоже кэшируются)
+# - Счётчики попаданий/промахов за цикл сбора
+# - Офлайн-справочник (gazetteer.py) проверяется до кэша и DaData: сначала улица/район адреса, затем станция метро
+
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+from config import (
+    DADATA_API_KEY, DADATA_SECRET_KEY, DADATA_BATCH_SIZE, DADATA_CONCURRENCY,
+    DISTRICT_CACHE_TTL_DAYS, DISTRICT_NEGATIVE_TTL_HOURS, DISTRICT_LRU_SIZE,
+)
+from database import Database
+from gazetteer import Gazetteer
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+DADATA_CLEAN_URL = 'https://cleaner.dadata.ru/api/v1/clean/address'
+
+# Административные округа в ответе DaData (city_area) -> сокращения из config.DISTRICTS
+OKRUG_ABBREVIATIONS = {
+    'центральный': 'ЦАО',
+    'северный': 'САО',
+    'северо-восточный': 'СВАО',
+    'восточный': 'ВАО',
+    'юго-восточный': 'ЮВАО',
+    'южный': 'ЮАО',
+    'юго-западный': 'ЮЗАО',
+    'западный': 'ЗАО',
+    'северо-западный': 'СЗАО',
+    'новомосковский': 'НАО',
+    'троицкий': 'ТАО',
+    'зеленоградский': 'ЗелАО',
+}
+
+_WS_RE = re.compile(r'\s+')
+_OKRUG_SUFFIX_RE = re.compile(r'\s*(административный\s+)?округ$')
+
+
+def _address_key(address: str) -> str:
+    return _WS_RE.sub(' ', (address or '').strip()).lower()
+
+
+def okrug_abbreviation(name: Optional[str]) -> Optional[str]:
+    """'Центральный' / 'Центральный административный округ' -> 'ЦАО'"""
+    if not name:
+        return None
+    key = _OKRUG_SUFFIX_RE.sub('', _WS_RE.sub(' ', name.strip()).lower())
+    return OKRUG_ABBREVIATIONS.get(key)
+
+
+def _district_from_clean(item: dict) -> Optional[str]:
+    if not isinstance(item, dict):
+        return None
+    district = okrug_abbreviation(item.get('city_area'))
+    if district:
+        return district
+    if item.get('area_type') == 'округ':
+        return okrug_abbreviation(item.get('area'))
+    return None
+
+
+class DistrictResolver:
+    """Адрес -> округ: офлайн-справочник, LRU в памяти, address_districts в PostgreSQL, пакетный запрос в DaData"""
+    _session: Optional['aiohttp.ClientSession'] = None
+    _semaphore: Optional[asyncio.Semaphore] = None
+    _lru: 'OrderedDict[str, Optional[str]]' = OrderedDict()
+    stats: Dict[str, int] = {'gazetteer': 0, 'metro': 0, 'lru_hit': 0, 'db_hit': 0, 'api_resolved': 0, 'api_empty': 0, 'api_errors': 0, 'api_calls': 0}
+
+    @classmethod
+    def _remember(cls, key: str, district: Optional[str]):
+        cls._lru[key] = district
+        cls._lru.move_to_end(key)
+        while len(cls._lru) > DISTRICT_LRU_SIZE:
+            cls._lru.popitem(last=False)
+
+    @classmethod
+    async def resolve(cls, address: str, metro: Optional[str] = None) -> Optional[str]:
+        return (await cls.resolve_many([address], {address: metro} if metro else None)).get(address)
+
+    @classmethod
+    async def resolve_many(cls, addresses: Iterable[str],
+                           metro_hints: Optional[Dict[str, str]] = None) -> Dict[str, Optional[str]]:
+        """Возвращает {адрес: округ или None}; одинаковые после нормализации адреса запрашиваются один раз.
+        metro_hints — {адрес: строка метро}: округ станции по справочнику, если адрес в справочнике не найден.
+        В кэш и DaData идут только адреса, которые справочник не разрешил ни по адресу, ни по метро"""
+        addresses = [a for a in addresses if a]
+        keys = {address: _address_key(address) for address in addresses}
+        metros: Dict[str, str] = {}
+        for address, metro in (metro_hints or {}).items():
+            if metro and keys.get(address):
+                metros.setdefault(keys[address], metro)
+        result: Dict[str, Optional[str]] = {}
+        pending: List[str] = []
+        for key in dict.fromkeys(keys.values()):
+            if not key:
+                continue
+            district = Gazetteer.district_for_address(key)
+            if district:
+                result[key] = district
+                cls.stats['gazetteer'] += 1
+                continue
+            district = Gazetteer.district_for_metro(metros[key]) if key in metros else None
+            if district:
+                # Округ по метро не кэшируется как округ адреса
+                result[key] = district
+                cls.stats['metro'] += 1
+            elif key in cls._lru:
+                cls._lru.move_to_end(key)
+                result[key] = cls._lru[key]
+                cls.stats['lru_hit'] += 1
+            else:
+                pending.append(key)
+
+        if pending and Database._pool is not None:
+            try:
+                cached = await Database.get_address_districts(
+                    pending, timedelta(days=DISTRICT_CACHE_TTL_DAYS), timedelta(hours=DISTRICT_NEGATIVE_TTL_HOURS),
+                )
+            except Exception:
+                logger.warning('Не удалось прочитать кэш округов из БД', exc_info=True)
+                cached = {}
+            for key, district in cached.items():
+                result[key] = district
+                cls._remember(key, district)
+            cls.stats['db_hit'] += len(cached)
+            pending = [key for key in pending if key not in cached]
+
+        if pending:
+            fetched = await cls._fetch_dadata(pending)
+            for key, district in fetched.items():
+                result[key] = district
+                cls._remember(key, district)
+            if fetched and Database._pool is not None:
+                try:
+                    await Database.save_address_districts(fetched)
+                except Exception:
+                    logger.warning('Не удалось сохранить кэш округов в БД', exc_info=True)
+
+        return {address: result.get(key) for address, key in keys.items()}
+
+    @classmethod
+    async def _fetch_dadata(cls, keys: List[str]) -> Dict[str, Optional[str]]:
+        """Пакеты по DADATA_BATCH_SIZE параллельно (не больше DADATA_CONCURRENCY). Ошибки не кэшируются"""
+        if not (DADATA_API_KEY and AIOHTTP_AVAILABLE):
+            return {}
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(DADATA_CONCURRENCY)
+        batches = [keys[i:i + DADATA_BATCH_SIZE] for i in range(0, len(keys), DADATA_BATCH_SIZE)]
+        resolved: Dict[str, Optional[str]] = {}
+        for batch_result in await asyncio.gather(*(cls._fetch_batch(batch) for batch in batches)):
+            resolved.update(batch_result)
+        return resolved
+
+    @classmethod
+    async def _fetch_batch(cls, batch: List[str]) -> Dict[str, Optional[str]]:
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f'Token {DADATA_API_KEY}',
+        }
+        if DADATA_SECRET_KEY:
+            headers['X-Secret'] = DADATA_SECRET_KEY
+        async with cls._semaphore:
+            cls.stats['api_calls'] += 1
+            try:
+                session = cls._get_session()
+                async with session.post(DADATA_CLEAN_URL, headers=headers, json=batch) as resp:
+                    if resp.status != 200:
+                        cls.stats['api_errors'] += 1
+                        logger.info('DaData: статус %s на пакет из %s адресов', resp.status, len(batch))
+                        return {}
+                    payload = await resp.json()
+            except Exception:
+                cls.stats['api_errors'] += 1
+                logger.debug('DaData не смог определить округ', exc_info=True)
+                return {}
+        if not isinstance(payload, list) or len(payload) != len(batch):
+            cls.stats['api_errors'] += 1
+            return {}
+        resolved = {key: _district_from_clean(item) for key, item in zip(batch, payload)}
+        for district in resolved.values():
+            cls.stats['api_resolved' if district else 'api_empty'] += 1
+        return resolved
+
+    @classmethod
+    def _get_session(cls) -> 'aiohttp.ClientSession':
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=DADATA_CONCURRENCY, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+        return cls._session
+
+    @classmethod
+    def log_cycle_stats(cls):
+        """Пишет счётчики за цикл сбора и обнуляет их"""
+        total = cls.stats['gazetteer'] + cls.stats['lru_hit'] + cls.stats['db_hit'] + cls.stats['api_resolved'] + cls.stats['api_empty']
+        if total or cls.stats['api_errors']:
+            logger.info(
+                'Округа за цикл: справочник=%s lru=%s db=%s dadata=%s (пусто %s, ошибок %s, запросов %s), '
+                'по метро=%s, lru_size=%s',
+                cls.stats['gazetteer'], cls.stats['lru_hit'], cls.stats['db_hit'], cls.stats['api_resolved'], cls.stats['api_empty'],
+                cls.stats['api_errors'], cls.stats['api_calls'], cls.stats['metro'], len(cls._lru),
+            )
+        for key in cls.stats:
+            cls.stats[key] = 0
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# gazetteer.py v2.1.0 (18.10.2026)
+# - Офлайн-справочник Москвы: район, поселение, улица и станция метро -> округ (data/moscow_gazetteer.json)
+# - Индексы строятся один раз при старте, поиск округа по адресу и строке метро без сетевых запросов
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = Path(os.environ.get('GAZETTEER_PATH') or Path(__file__).resolve().parent / 'data' / 'moscow_gazetteer.json')
+
+_WS_RE = re.compile(r'\s+')
+_SPLIT_RE = re.compile(r'[,;|/\n]+')
+_MINUTES_RE = re.compile(r'\([^)]*мин[^)]*\)|\d+\s*(?:[–-]\s*\d+\s*)?мин\S*.*$')
+_METRO_PREFIX_RE = re.compile(r'^(?:м\.|метро)\s*')
+_RAION_RE = re.compile(r'^(?:р-н|район|р\.)\s+|\s+(?:р-н|район)$')
+_SETTLEMENT_RE = re.compile(
+    r'^(?:поселение|пос\.|п\.|поселок|г\.|город|городской округ|го|дп|рп|мкр\.?|микрорайон)\s+|\s+(?:поселение|п\.)$'
+)
+_OKRUG_RE = re.compile(r'\s+(?:административный\s+округ|ао|округ)$')
+
+STREET_TYPES = frozenset((
+    'улица', 'ул.', 'ул', 'проспект', 'пр-т', 'пр-кт', 'просп.', 'пр.', 'переулок', 'пер.', 'бульвар', 'б-р',
+    'шоссе', 'ш.', 'площадь', 'пл.', 'набережная', 'наб.', 'проезд', 'пр-д', 'тупик', 'аллея', 'кв-л', 'квартал',
+))
+
+
+def normalize(value: Optional[str]) -> str:
+    return _WS_RE.sub(' ', (value or '').replace('ё', 'е').replace('Ё', 'Е')).strip(' .,').lower()
+
+
+def _street_name(segment: str) -> str:
+    return ' '.join(word for word in segment.split(' ') if word not in STREET_TYPES)
+
+
+def metro_variants(metro: Optional[str]) -> list[str]:
+    """'м. Тверская (5 мин) | Пушкинская, 10 мин пешком' -> ['тверская', 'пушкинская']"""
+    variants: list[str] = []
+    for part in _SPLIT_RE.split(metro or ''):
+        name = _MINUTES_RE.sub('', _METRO_PREFIX_RE.sub('', normalize(part))).strip(' .-–—')
+        if name and name not in variants:
+            variants.append(name)
+    return variants
+
+
+class Gazetteer:
+    """Индексы справочника: нормализованное название -> сокращение округа"""
+    _okrugs: Dict[str, str] = {}
+    _okrug_names: Dict[str, str] = {}
+    _settlements: Dict[str, str] = {}
+    _raions: Dict[str, str] = {}
+    _streets: Dict[str, str] = {}
+    _metro: Dict[str, str] = {}
+    _loaded = False
+
+    @classmethod
+    def load(cls, path: Path = GAZETTEER_PATH):
+        try:
+            data = json.loads(Path(path).read_text(encoding='utf-8'))
+        except Exception:
+            logger.exception('Не удалось загрузить справочник округов %s', path)
+            cls._loaded = True
+            return
+        indexes: Dict[str, Dict[str, Optional[str]]] = {
+            'okrugs': {}, 'okrug_names': {}, 'settlements': {}, 'raions': {}, 'streets': {}, 'metro': {},
+        }
+        for okrug, tables in data.get('okrugs', {}).items():
+            cls._add(indexes['okrugs'], [okrug], okrug)
+            for kind in ('okrug_names', 'settlements', 'raions', 'streets', 'metro'):
+                cls._add(indexes[kind], tables.get(kind, []), okrug)
+        # Названия, встречающиеся в нескольких округах, не дают ответа
+        clean = {kind: {k: v for k, v in index.items() if v} for kind, index in indexes.items()}
+        cls._okrugs = clean['okrugs']
+        cls._okrug_names = clean['okrug_names']
+        cls._settlements = clean['settlements']
+        cls._raions = clean['raions']
+        cls._streets = clean['streets']
+        cls._metro = clean['metro']
+        cls._loaded = True
+        logger.info(
+            'Справочник округов загружен: районов %s, поселений %s, улиц %s, станций %s',
+            len(cls._raions), len(cls._settlements), len(cls._streets), len(cls._metro),
+        )
+
+    @staticmethod
+    def _add(index: Dict[str, Optional[str]], names: Iterable[str], okrug: str):
+        for name in names:
+            key = normalize(name)
+            if key in index and index[key] != okrug:
+                index[key] = None
+            else:
+                index.setdefault(key, okrug)
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if not cls._loaded:
+            cls.load()
+
+    @classmethod
+    def district_for_address(cls, address: Optional[str]) -> Optional[str]:
+        """Округ по адресу: явный округ, поселение, район, станция метро в адресе, затем улица"""
+        cls._ensure_loaded()
+        segments = [normalize(part) for part in (address or '').split(',')]
+        segments = [s for s in segments if s and s != 'москва']
+        for segment in segments:
+            # Полное название округа учитываем только со словом «округ»/«АО»: «Северный» без него — район СВАО
+            okrug = cls._okrugs.get(segment)
+            if okrug is None and _OKRUG_RE.search(segment):
+                okrug = cls._okrug_names.get(_OKRUG_RE.sub('', segment))
+            if okrug:
+                return okrug
+        for segment in segments:
+            okrug = cls._settlements.get(_SETTLEMENT_RE.sub('', segment)) or cls._raions.get(_RAION_RE.sub('', segment))
+            if okrug:
+                return okrug
+        for segment in segments:
+            if _METRO_PREFIX_RE.match(segment):
+                okrug = cls._metro.get(_METRO_PREFIX_RE.sub('', segment))
+                if okrug:
+                    return okrug
+        for segment in segments:
+            okrug = cls._streets.get(_street_name(segment))
+            if okrug:
+                return okrug
+        return None
+
+    @classmethod
+    def district_for_metro(cls, metro: Optional[str]) -> Optional[str]:
+        """Округ ближайшей станции (станции в строке метро идут по удалённости)"""
+        cls._ensure_loaded()
+        for name in metro_variants(metro):
+            okrug = cls._metro.get(name)
+            if okrug:
+                return okrug
+        return None
+
+    @classmethod
+    def detect(cls, address: Optional[str], metro: Optional[str] = None) -> Optional[str]:
+        return cls.district_for_address(address) or cls.district_for_metro(metro)
@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
-# handlers.py v2.0.0 (11.03.2026)
-# - Актуализирована версия модуля
-# - Исправлен profile(): добавлен вывод балансов
-# - Отправка объявлений сделана мягче для Telegram
+# handlers.py v2.1.0 (18.10.2026)
+# - Округ объявления: словарь сокращений вынесен на уровень модуля (регулярка с границами слов),
+#   запасной путь — офлайн-справочник улиц/районов/метро (gazetteer.py)
+# - Подбор подписчиков в collector_loop через matcher.SubscriptionIndex; matches_filters перенесён в matcher.py
+# - filters_done сразу кладёт скомпилированные фильтры в matcher.FilterCache
+# - Признаки объявлений (matcher.enrich_ads) считаются один раз до подбора и используются при рассылке
+# - Подборщик подписчиков выбирается matcher.build_matcher (MATCHER_BACKEND), объявления проверяются пачкой
+# - collector_loop берёт подписчиков из реестра в памяти (subscribers.SubscriberRegistry)
+# - Рассылка через очередь доставки (delivery.Delivery) вместо gather всех отправок под семафором
+# - Пары (пользователь, объявление) записываются в таблицу outbox одним запросом на цикл
+# - Новые объявления сохраняются пачкой (Database.save_ads) вместо save_ad на каждое
+# - Фото объявления отправляется через кэш file_id (photo_cache.PhotoCache), доля попаданий в статистике админа
+# - Текст рассылки собирается один раз на объявление (render.render_ads), вариант по роли пользователя
+# - /testparse, подтверждение рассылки и /export_users выполняются фоновыми задачами (run_admin_job) с отчётом в чат;
+#   остановка бота их отменяет (utils.shutdown), а не ждёт
+# - Клавиатуры фильтров берутся из keyboards.py по маске выбора; имя бота для реферальной ссылки — без get_me
 
 import json
 import logging
@@ -18,7 +30,6 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMe
 from telegram.ext import ContextTypes, ConversationHandler, CallbackQueryHandler, MessageHandler, filters, Application
 from telegram.constants import ParseMode
 from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut
-from html import escape as html_escape
 
 from config import (
     ADMIN_ID, TON_WALLET, PAYMENT_PROVIDER_TOKEN, PRICES_RUB, PRICES_TON, PRICES_STARS,
@@ -27,11 +38,20 @@ from config import (
     GITHUB_REPO, GITHUB_BRANCH, GITHUB_TOKEN, AUTO_UPDATE_CHECK_INTERVAL
 )
 from database import Database
+from matcher import FilterCache, build_matcher, enrich_ads
+from subscribers import SubscriberRegistry
+from delivery import Delivery
+from photo_cache import PhotoCache, is_photo_error
+from render import ad_payload, render_ads
+from keyboards import (
+    districts_keyboard, rooms_keyboard, sources_keyboard, owner_keyboard, deal_type_keyboard,
+    metro_line_keyboard, metro_lines_keyboard, filters_menu_keyboard,
+)
 from models import Ad
 from parsers import fetch_all_ads
 from utils import validate_txid, verify_ton_transaction, escape_markdown, check_user_exists
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +82,33 @@ async def notify_moderators(bot, text: str):
                 pass
 
 
+def run_admin_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int, name: str, job):
+    """Долгая админская операция в фоне: обработчик обновления сразу освобождается, job сам сообщает
+    результат в чат; необработанная ошибка тоже отправляется в чат. Задача не из Application.create_task:
+    Application.stop её не ждёт, utils.shutdown отменяет задачи из bot_data['admin_jobs']"""
+    async def runner():
+        started = time.monotonic()
+        try:
+            await job()
+        except asyncio.CancelledError:
+            logger.warning(f"Фоновая задача «{name}» прервана остановкой бота")
+            raise
+        except Exception as e:
+            logger.error(f"Фоновая задача «{name}» завершилась ошибкой: {e}", exc_info=True)
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=f"❌ {name}: ошибка {e}")
+            except Exception:
+                pass
+        else:
+            logger.info(f"Фоновая задача «{name}» выполнена за {time.monotonic() - started:.1f} с")
+
+    jobs = context.application.bot_data.setdefault('admin_jobs', set())
+    task = asyncio.create_task(runner(), name=f'admin_job:{name}')
+    jobs.add(task)
+    task.add_done_callback(jobs.discard)
+    return task
+
+
 def get_back_keyboard(callback: str = 'main_menu', text: str = '🏠 Главное меню'):
     return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=callback)]])
 
@@ -293,8 +340,8 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         balance_text = ""
 
-    bot_info = await context.bot.get_me()
-    ref_link = f"https://t.me/{bot_info.username}?start=ref_{user_id}"
+    # Имя бота известно с инициализации Application (get_me один раз при старте)
+    ref_link = f"https://t.me/{context.bot.username}?start=ref_{user_id}"
 
     text = (
         f"👤 *Ваш профиль*\n\n"
@@ -574,21 +621,10 @@ async def start_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     r_count = len(context.user_data.get('rooms', []))
     m_count = len(context.user_data.get('metros', []))
 
-    keyboard = [
-        [InlineKeyboardButton(f"🏘 Округа ({d_count})", callback_data='f_districts')],
-        [InlineKeyboardButton(f"🛏 Комнаты ({r_count})", callback_data='f_rooms')],
-        [InlineKeyboardButton(f"🚇 Метро ({m_count})", callback_data='f_metros')],
-        [InlineKeyboardButton("📱 Площадки", callback_data='f_sources')],
-        [InlineKeyboardButton("👤 Тип объявлений", callback_data='f_owner')],
-        [InlineKeyboardButton("📋 Тип сделки", callback_data='f_deal_type')],
-        [InlineKeyboardButton("✅ Сохранить фильтры", callback_data='f_done')],
-        [InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu')]
-    ]
-
     await q.edit_message_text(
         "⚙️ *Настройка фильтров*\n\nВыберите что настроить:",
         parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=filters_menu_keyboard(d_count, r_count, m_count)
     )
 
 
@@ -596,14 +632,7 @@ async def filter_districts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     selected = context.user_data.get('districts', [])
-
-    keyboard = []
-    for d in DISTRICTS:
-        mark = "✅" if d in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {d}", callback_data=f'd_{d}')])
-    keyboard.append([InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')])
-
-    await q.edit_message_text("🏘 Выберите округа:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_text("🏘 Выберите округа:", reply_markup=districts_keyboard(selected))
 
 
 async def toggle_district(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -617,26 +646,14 @@ async def toggle_district(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         selected.append(district)
     context.user_data['districts'] = selected
-
-    keyboard = []
-    for d in DISTRICTS:
-        mark = "✅" if d in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {d}", callback_data=f'd_{d}')])
-    keyboard.append([InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')])
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=districts_keyboard(selected))
 
 
 async def filter_rooms(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     selected = context.user_data.get('rooms', [])
-
-    keyboard = []
-    for r in ROOM_OPTIONS:
-        mark = "✅" if r in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {r}", callback_data=f'r_{r}')])
-    keyboard.append([InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')])
-    await q.edit_message_text("🛏 Выберите количество комнат:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_text("🛏 Выберите количество комнат:", reply_markup=rooms_keyboard(selected))
 
 
 async def toggle_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -650,13 +667,7 @@ async def toggle_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         selected.append(room)
     context.user_data['rooms'] = selected
-
-    keyboard = []
-    for r in ROOM_OPTIONS:
-        mark = "✅" if r in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {r}", callback_data=f'r_{r}')])
-    keyboard.append([InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')])
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=rooms_keyboard(selected))
 
 
 async def filter_metros(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -664,21 +675,10 @@ async def filter_metros(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     selected = context.user_data.get('metros', [])
 
-    keyboard = []
-    for code, line in METRO_LINES.items():
-        # Считаем выбранные станции на этой линии
-        count = sum(1 for s in line['stations'] if s in selected)
-        suffix = f" ({count})" if count > 0 else ""
-        keyboard.append([InlineKeyboardButton(f"{line['name']}{suffix}", callback_data=f'l_{code}')])
-    keyboard.append([InlineKeyboardButton("🔍 Поиск по названию", callback_data='metro_search')])
-    if selected:
-        keyboard.append([InlineKeyboardButton(f"🗑 Сбросить всё ({len(selected)})", callback_data='metro_clear')])
-    keyboard.append([InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')])
-
     await q.edit_message_text(
         f"🚇 Выберите ветку метро:\n_Выбрано станций: {len(selected)}_",
         parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=metro_lines_keyboard(selected)
     )
 
 
@@ -697,16 +697,10 @@ async def metro_line(update: Update, context: ContextTypes.DEFAULT_TYPE):
     line = METRO_LINES[line_code]
     selected = context.user_data.get('metros', [])
 
-    keyboard = []
-    for idx, station in enumerate(line['stations']):
-        mark = "✅" if station in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {station}", callback_data=f"m_{line_code}_{idx}")])
-    keyboard.append([InlineKeyboardButton("« Назад к веткам", callback_data='f_metros')])
-
     await q.edit_message_text(
         f"🚇 *{line['name']}*\nВыберите станции:",
         parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=metro_line_keyboard(line_code, selected)
     )
 
 
@@ -725,14 +719,7 @@ async def toggle_metro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         selected.append(station)
     context.user_data['metros'] = selected
-
-    keyboard = []
-    for i, s in enumerate(line['stations']):
-        mark = "✅" if s in selected else "⬜"
-        keyboard.append([InlineKeyboardButton(f"{mark} {s}", callback_data=f"m_{line_code}_{i}")])
-    keyboard.append([InlineKeyboardButton("« Назад к веткам", callback_data='f_metros')])
-
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=metro_line_keyboard(line_code, selected))
 
 
 async def metro_search_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -813,13 +800,7 @@ async def filter_sources(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     selected = context.user_data.get('sources', ['cian', 'avito'])
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if 'cian' in selected else '⬜'} ЦИАН", callback_data='src_cian')],
-        [InlineKeyboardButton(f"{'✅' if 'avito' in selected else '⬜'} Авито", callback_data='src_avito')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_text("📱 Выберите площадки для мониторинга:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_text("📱 Выберите площадки для мониторинга:", reply_markup=sources_keyboard(selected))
 
 
 async def toggle_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -837,67 +818,35 @@ async def toggle_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         selected.append(source)
     context.user_data['sources'] = selected
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if 'cian' in selected else '⬜'} ЦИАН", callback_data='src_cian')],
-        [InlineKeyboardButton(f"{'✅' if 'avito' in selected else '⬜'} Авито", callback_data='src_avito')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=sources_keyboard(selected))
 
 
 async def filter_owner(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     current = context.user_data.get('owner_only', False)
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if not current else '⬜'} Все объявления", callback_data='owner_all')],
-        [InlineKeyboardButton(f"{'✅' if current else '⬜'} Только собственники", callback_data='owner_only')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_text("👤 Выберите тип объявлений:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_text("👤 Выберите тип объявлений:", reply_markup=owner_keyboard(current))
 
 
 async def toggle_owner(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     context.user_data['owner_only'] = (q.data == 'owner_only')
-    current = context.user_data['owner_only']
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if not current else '⬜'} Все объявления", callback_data='owner_all')],
-        [InlineKeyboardButton(f"{'✅' if current else '⬜'} Только собственники", callback_data='owner_only')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=owner_keyboard(context.user_data['owner_only']))
 
 
 async def filter_deal_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     current = context.user_data.get('deal_type', 'sale')
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if current == 'sale' else '⬜'} Продажа", callback_data='deal_sale')],
-        [InlineKeyboardButton(f"{'✅' if current == 'rent' else '⬜'} Аренда", callback_data='deal_rent')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_text("📋 Выберите тип сделки:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_text("📋 Выберите тип сделки:", reply_markup=deal_type_keyboard(current))
 
 
 async def toggle_deal_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     context.user_data['deal_type'] = 'sale' if q.data == 'deal_sale' else 'rent'
-    current = context.user_data['deal_type']
-
-    keyboard = [
-        [InlineKeyboardButton(f"{'✅' if current == 'sale' else '⬜'} Продажа", callback_data='deal_sale')],
-        [InlineKeyboardButton(f"{'✅' if current == 'rent' else '⬜'} Аренда", callback_data='deal_rent')],
-        [InlineKeyboardButton("« Назад к фильтрам", callback_data='f_back')]
-    ]
-    await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+    await q.edit_message_reply_markup(reply_markup=deal_type_keyboard(context.user_data['deal_type']))
 
 
 async def filter_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -919,7 +868,8 @@ async def filters_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'sources': context.user_data.get('sources', ['cian', 'avito'])
     }
 
-    await Database.set_user_filters(user_id, filters_dict)
+    version = await Database.set_user_filters(user_id, filters_dict)
+    FilterCache.put(user_id, filters_dict, version)
 
     deal_name = DEAL_TYPE_NAMES.get(filters_dict['deal_type'], 'Продажа')
     source_names = {'cian': 'ЦИАН', 'avito': 'Авито'}
@@ -1251,6 +1201,7 @@ async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     await q.answer()
 
     total, active, pending, total_ton, total_rub, total_stars, monthly_ton, open_tickets, ads_count = await Database.get_stats()
+    photos = PhotoCache.summary()
 
     text = (
         f"📊 *Статистика бота*\n\n"
@@ -1263,6 +1214,7 @@ async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         f"⭐️ Общий доход Stars: *{total_stars}*\n"
         f"🆘 Открытых тикетов: {open_tickets}\n"
         f"📰 Объявлений в базе: {ads_count}\n"
+        f"🖼 Фото по file_id: {photos['hit_rate'] * 100:.0f}%, сэкономлено {photos['saved_s']:.0f} с\n"
         f"⏱ Интервал парсинга: {PARSING_INTERVAL // 60} мин"
     )
 
@@ -1808,31 +1760,46 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    if update.effective_user.id != ADMIN_ID:
+        return
     if q.data == 'bc_cancel':
         await q.edit_message_text("Рассылка отменена.")
         context.user_data.pop('broadcast_text', None)
         return
 
-    text = context.user_data.get('broadcast_text', '')
+    text = context.user_data.pop('broadcast_text', '')
     if not text:
         await q.edit_message_text("Ошибка: текст не найден.")
         return
 
-    await q.edit_message_text("📢 Рассылка началась...")
-    users = await Database.get_all_users(limit=100000, offset=0)
-    sent = 0
-    failed = 0
-    for row in users:
+    await q.edit_message_text("📢 Рассылка началась, по завершении придёт отчёт...")
+
+    async def job():
+        users = await Database.get_all_users(limit=100000, offset=0)
+        sent = 0
+        failed = 0
         try:
-            await context.bot.send_message(chat_id=row['user_id'], text=text, parse_mode='Markdown')
-            sent += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            logger.debug(f"Рассылка {row['user_id']}: {e}")
-            failed += 1
+            for row in users:
+                # Темп задаёт общий bucket очереди доставки: рассылка и объявления делят лимит Telegram
+                while True:
+                    await Delivery.throttle()
+                    try:
+                        await context.bot.send_message(chat_id=row['user_id'], text=text, parse_mode='Markdown')
+                        sent += 1
+                    except RetryAfter as e:
+                        Delivery.pause(float(e.retry_after))
+                        continue
+                    except Exception as e:
+                        logger.debug(f"Рассылка {row['user_id']}: {e}")
+                        failed += 1
+                    break
+        except asyncio.CancelledError:
+            logger.warning(f"Рассылка прервана остановкой бота: отправлено {sent}, ошибок {failed}, "
+                           f"не отправлено {len(users) - sent - failed} из {len(users)}")
+            raise
+        await q.message.reply_text(f"✅ Рассылка завершена.\nУспешно: {sent}\nОшибок: {failed}")
 
-    await q.message.reply_text(f"✅ Рассылка завершена.\nУспешно: {sent}\nОшибок: {failed}")
-    context.user_data.pop('broadcast_text', None)
+    run_admin_job(context, q.message.chat_id, 'Рассылка', job)
 
 
 async def broadcast_mods(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1857,26 +1824,31 @@ async def broadcast_mods(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def test_parse(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         return
-    await update.message.reply_text("🔄 Запускаю тестовый парсинг...")
-    try:
-        ads = await fetch_all_ads()
-        if ads:
-            ad = ads[0]
-            text = (
-                f"✅ Найдено {len(ads)} объявлений\n\n"
-                f"*Первое:*\n"
-                f"Источник: {ad.source}\n"
-                f"Название: {ad.title[:100]}\n"
-                f"Цена: {ad.price}\n"
-                f"Адрес: {ad.address[:100]}\n"
-                f"Метро: {ad.metro}\n"
-                f"Ссылка: {ad.link[:100]}"
-            )
-        else:
-            text = "⚠️ Объявлений не найдено. Проверьте парсеры."
-        await update.message.reply_text(text, parse_mode='Markdown')
-    except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка парсинга: {e}")
+    await update.message.reply_text("🔄 Запускаю тестовый парсинг, результат придёт отдельным сообщением...")
+    message = update.message
+
+    async def job():
+        try:
+            ads = await fetch_all_ads()
+            if ads:
+                ad = ads[0]
+                text = (
+                    f"✅ Найдено {len(ads)} объявлений\n\n"
+                    f"*Первое:*\n"
+                    f"Источник: {ad.source}\n"
+                    f"Название: {ad.title[:100]}\n"
+                    f"Цена: {ad.price}\n"
+                    f"Адрес: {ad.address[:100]}\n"
+                    f"Метро: {ad.metro}\n"
+                    f"Ссылка: {ad.link[:100]}"
+                )
+            else:
+                text = "⚠️ Объявлений не найдено. Проверьте парсеры."
+            await message.reply_text(text, parse_mode='Markdown')
+        except Exception as e:
+            await message.reply_text(f"❌ Ошибка парсинга: {e}")
+
+    run_admin_job(context, message.chat_id, 'Тестовый парсинг', job)
 
 
 async def daily_by_metro(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2018,151 +1990,47 @@ async def add_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def export_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         return
-    users = await Database.get_all_users(limit=100000, offset=0)
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['user_id', 'subscribed_until', 'plan', 'subscription_source'])
-    for row in users:
-        writer.writerow([row['user_id'], row['subscribed_until'], row['plan'], row['subscription_source']])
-    output.seek(0)
-    await update.message.reply_document(
-        document=output.getvalue().encode('utf-8'),
-        filename=f'users_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    )
+    await update.message.reply_text("📤 Готовлю выгрузку пользователей...")
+    message = update.message
+
+    async def job():
+        users = await Database.get_all_users(limit=100000, offset=0)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['user_id', 'subscribed_until', 'plan', 'subscription_source'])
+        for row in users:
+            writer.writerow([row['user_id'], row['subscribed_until'], row['plan'], row['subscription_source']])
+        await message.reply_document(
+            document=output.getvalue().encode('utf-8'),
+            filename=f'users_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        )
 
+    run_admin_job(context, message.chat_id, 'Выгрузка пользователей', job)
 
-# ========== ФОНОВЫЕ ЗАДАЧИ ==========
-def _norm_text(value: str) -> str:
-    return re.sub(r"\s+", " ", str(value or "").replace("ё", "е")).strip().lower()
-
-
-def _norm_metro(value: str) -> str:
-    value = _norm_text(value)
-    value = re.sub(r"\bм\.?\s*", "", value)
-    value = re.sub(r"\d+\s*мин.*$", "", value).strip(" ,.-")
-    return value
-
-
-def _extract_metro_variants(value: str) -> set[str]:
-    text = _norm_text(value).replace("метро", "").replace("м.", "")
-    text = re.sub(r"\([^)]*мин[^)]*\)", "", text)
-    text = re.sub(r"\d+\s*мин[^,;|/]*", "", text)
-    return {part.strip(" .-–—") for part in re.split(r"[,;|/\n]+", text) if part.strip(" .-–—")}
-
-
-def _detect_ad_district(ad: Ad) -> Optional[str]:
-    hay = _norm_text(" ".join([ad.district_detected or "", ad.address or "", ad.title or ""]))
-    aliases = {
-        "ЦАО": ["цао", "центральный административный округ"],
-        "САО": ["сао", "северный административный округ"],
-        "СВАО": ["свао", "северо-восточный административный округ"],
-        "ВАО": ["вао", "восточный административный округ"],
-        "ЮВАО": ["ювао", "юго-восточный административный округ"],
-        "ЮАО": ["юао", "южный административный округ"],
-        "ЮЗАО": ["юзао", "юго-западный административный округ"],
-        "ЗАО": ["зао", "западный административный округ"],
-        "СЗАО": ["сзао", "северо-западный административный округ"],
-        "НАО": ["нао", "новомосковский административный округ"],
-        "ТАО": ["тао", "троицкий административный округ"],
-        "ЗелАО": ["зелао", "зеленоградский административный округ"],
-    }
-    for district, names in aliases.items():
-        if any(name in hay for name in names):
-            return district
-    return None
-
-
-def matches_filters(ad: Ad, filters_dict: dict) -> bool:
-    if ad.source not in filters_dict.get('sources', ['cian', 'avito']):
-        return False
-    if ad.deal_type != filters_dict.get('deal_type', 'sale'):
-        return False
-
-    districts = filters_dict.get('districts', [])
-    if districts:
-        ad_district = _detect_ad_district(ad)
-        if not ad_district or ad_district not in districts:
-            return False
-
-    metros = filters_dict.get('metros', [])
-    if metros:
-        ad_variants = {_norm_metro(v) for v in _extract_metro_variants(ad.metro)}
-        selected = {_norm_metro(v) for v in metros}
-        if not ad_variants or not (ad_variants & selected):
-            return False
-
-    rooms = filters_dict.get('rooms', [])
-    if rooms:
-        rc = str(ad.rooms).lower().strip()
-        mapping = {'студия': 'Студия', '1': '1-комнатная', '2': '2-комнатная', '3': '3-комнатная'}
-        room_type = mapping.get(rc)
-        if room_type is None and rc.isdigit() and int(rc) >= 4:
-            room_type = '4-комнатная+'
-        if room_type not in rooms:
-            return False
-
-    if filters_dict.get('owner_only', False) and not ad.owner:
-        return False
-    return True
-
-
-async def send_ad_to_user(bot, user_id: int, ad: Ad, telegram_semaphore):
-    async with telegram_semaphore:
-        async with Database._pool.acquire() as conn:
-            inserted = await conn.fetchval(
-                """
-                INSERT INTO sent_ads (user_id, ad_id)
-                VALUES ($1, $2)
-                ON CONFLICT (user_id, ad_id) DO NOTHING
-                RETURNING id
-                """,
-                user_id, ad.id
-            )
-            if not inserted:
-                return
-
-        owner_text = 'Собственник' if ad.owner else 'Агент/посредник'
-        deal_text = 'Продажа' if ad.deal_type == 'sale' else 'Аренда'
-        source_name = 'ЦИАН' if ad.source == 'cian' else 'Авито'
-        district = _detect_ad_district(ad) or 'не определён'
-        text = (
-            f"<b>Новое объявление • {html_escape(source_name)}</b>\n"
-            f"<b>Цена:</b> {html_escape(ad.price)}\n"
-            f"<b>Адрес:</b> {html_escape(ad.address)}\n"
-            f"<b>Метро:</b> {html_escape(ad.metro)}\n"
-            f"<b>Округ:</b> {html_escape(district)}\n"
-            f"<b>Этаж:</b> {html_escape(ad.floor)}\n"
-            f"<b>Площадь:</b> {html_escape(ad.area)}\n"
-            f"<b>Комнат:</b> {html_escape(str(ad.rooms))}\n"
-            f"<b>Тип:</b> {html_escape(owner_text)} • {html_escape(deal_text)}\n\n"
-            f"<a href=\"{html_escape(ad.link)}\">Открыть объявление</a>"
-        )
 
+# ========== ФОНОВЫЕ ЗАДАЧИ ==========
+async def send_ad_to_user(bot, user_id: int, ad: Ad):
+    """Отправка одного объявления из готового payload; ошибки Telegram обрабатывает очередь доставки"""
+    payload = ad_payload(ad, SubscriberRegistry.role(user_id))
+    if payload.photo:
         try:
-            if ad.photos and ad.photos[0].startswith('http'):
-                await bot.send_photo(chat_id=user_id, photo=ad.photos[0], caption=text, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id=user_id, text=text, parse_mode=ParseMode.HTML, disable_web_page_preview=False)
-            await asyncio.sleep(0.35)
-        except RetryAfter as e:
-            logger.warning('Rate limit Telegram для %s: ждём %s', user_id, e.retry_after)
-            await asyncio.sleep(float(e.retry_after) + 1)
-        except (Forbidden, BadRequest):
-            logger.warning('Не удалось доставить объявление пользователю %s', user_id)
-        except TimedOut:
-            logger.warning('Таймаут отправки пользователю %s', user_id)
-        except Exception:
-            logger.exception('Ошибка отправки пользователю %s', user_id)
+            await PhotoCache.send_photo(bot, user_id, ad.id, payload.photo, payload.text)
+            return
+        except BadRequest as e:
+            if not is_photo_error(e):
+                raise
+            # Фото не отправить ни по URL, ни файлом — отправляем текстовый вариант
+            logger.debug(f"Фото объявления {ad.id} не отправлено ({e}), отправляем текст")
+    await bot.send_message(chat_id=user_id, text=payload.text, parse_mode=payload.parse_mode,
+                           disable_web_page_preview=payload.disable_web_page_preview)
 
 
 async def collector_loop(app: Application):
-    """Фоновая задача: сбор объявлений и рассылка подписчикам"""
-    telegram_semaphore = app.bot_data.get('telegram_semaphore')
-
+    """Фоновая задача: сбор объявлений и постановка рассылки в очередь доставки"""
     while True:
         try:
             logger.info("Запуск сбора объявлений...")
-            subscribers = await Database.get_active_subscribers()
+            subscribers = await SubscriberRegistry.snapshot()
             if not subscribers:
                 logger.info("Нет активных подписчиков")
                 await asyncio.sleep(PARSING_INTERVAL)
@@ -2174,10 +2042,7 @@ async def collector_loop(app: Application):
                 await asyncio.sleep(PARSING_INTERVAL)
                 continue
 
-            new_ads = []
-            for ad in ads:
-                if await Database.save_ad(ad):
-                    new_ads.append(ad)
+            new_ads = await Database.save_ads(ads)
 
             if not new_ads:
                 logger.info("Нет новых объявлений после дедупликации")
@@ -2185,29 +2050,20 @@ async def collector_loop(app: Application):
                 continue
 
             logger.info(f"Найдено {len(new_ads)} новых объявлений, рассылаем...")
+            render_ads(enrich_ads(new_ads))
 
-            # Собираем все задачи для всех объявлений и пользователей
-            all_tasks = []
-            for ad in new_ads:
-                for row in subscribers:
-                    user_id = row['user_id']
-                    filters_json = row['filters']
-                    if not filters_json:
-                        continue
-                    try:
-                        f = json.loads(filters_json)
-                    except Exception:
-                        continue
-
-                    if matches_filters(ad, f):
-                        all_tasks.append(send_ad_to_user(app.bot, user_id, ad, telegram_semaphore))
-
-            if all_tasks:
-                await asyncio.gather(*all_tasks, return_exceptions=True)
+            # Пара (пользователь, объявление) попадает в outbox один раз (UNIQUE), sent_ads — после доставки
+            matcher = build_matcher(subscribers)
+            pairs = [(user_id, ad) for ad, user_ids in zip(new_ads, matcher.match_batch(new_ads))
+                     for user_id in user_ids]
+            queued = await Delivery.submit(pairs)
 
             # Очистка старых объявлений раз в день
             await Database.cleanup_old_ads(days=30)
-            logger.info(f"Рассылка завершена. Отправлено задач: {len(all_tasks)}")
+            await Database.cleanup_outbox()
+            logger.info(f"Рассылка поставлена в очередь: {queued}, в очереди доставки {Delivery.depth()}")
+            SubscriberRegistry.log_stats()
+            PhotoCache.log_stats()
 
         except Exception as e:
             logger.error(f"Ошибка в collector_loop: {e}", exc_info=True)
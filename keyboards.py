@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# keyboards.py v2.1.0 (18.10.2026)
+# - Клавиатуры экранов фильтров по маске выбранных значений: небольшие таблицы (комнаты, площадки, тип
+#   объявлений, сделка) строятся при старте, округа и станции веток запоминаются при первом показе
+# - Нажатие на кнопку выбора — поиск готовой разметки по маске и один edit_message_reply_markup
+
+from functools import lru_cache
+from typing import Iterable, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import DISTRICTS, ROOM_OPTIONS, METRO_LINES
+
+__version__ = '2.1.0'
+
+SOURCES = (('cian', 'ЦИАН'), ('avito', 'Авито'))
+BACK_TO_FILTERS = ("« Назад к фильтрам", 'f_back')
+BACK_TO_LINES = ("« Назад к веткам", 'f_metros')
+
+
+def selection_mask(options: Iterable[str], selected: Iterable[str]) -> int:
+    """Бит i — выбран options[i]; значения вне options (старые фильтры) на клавиатуре не показываются"""
+    selected = set(selected)
+    return sum(1 << i for i, option in enumerate(options) if option in selected)
+
+
+@lru_cache(maxsize=8192)
+def _checklist(items: Tuple[Tuple[str, str], ...], back: Tuple[str, str], mask: int) -> InlineKeyboardMarkup:
+    """items — (подпись, callback_data) в порядке бит маски"""
+    keyboard = [[InlineKeyboardButton(f"{'✅' if mask >> i & 1 else '⬜'} {label}", callback_data=data)]
+                for i, (label, data) in enumerate(items)]
+    keyboard.append([InlineKeyboardButton(back[0], callback_data=back[1])])
+    return InlineKeyboardMarkup(keyboard)
+
+
+DISTRICT_ITEMS = tuple((d, f'd_{d}') for d in DISTRICTS)
+ROOM_ITEMS = tuple((r, f'r_{r}') for r in ROOM_OPTIONS)
+SOURCE_ITEMS = tuple((label, f'src_{code}') for code, label in SOURCES)
+OWNER_ITEMS = (("Все объявления", 'owner_all'), ("Только собственники", 'owner_only'))
+DEAL_ITEMS = (("Продажа", 'deal_sale'), ("Аренда", 'deal_rent'))
+LINE_ITEMS = {
+    code: tuple((station, f'm_{code}_{idx}') for idx, station in enumerate(line['stations']))
+    for code, line in METRO_LINES.items()
+}
+
+
+def districts_keyboard(selected: Iterable[str]) -> InlineKeyboardMarkup:
+    return _checklist(DISTRICT_ITEMS, BACK_TO_FILTERS, selection_mask(DISTRICTS, selected))
+
+
+def rooms_keyboard(selected: Iterable[str]) -> InlineKeyboardMarkup:
+    return _checklist(ROOM_ITEMS, BACK_TO_FILTERS, selection_mask(ROOM_OPTIONS, selected))
+
+
+def sources_keyboard(selected: Iterable[str]) -> InlineKeyboardMarkup:
+    return _checklist(SOURCE_ITEMS, BACK_TO_FILTERS, selection_mask([code for code, _ in SOURCES], selected))
+
+
+def owner_keyboard(owner_only: bool) -> InlineKeyboardMarkup:
+    return _checklist(OWNER_ITEMS, BACK_TO_FILTERS, 2 if owner_only else 1)
+
+
+def deal_type_keyboard(deal_type: str) -> InlineKeyboardMarkup:
+    return _checklist(DEAL_ITEMS, BACK_TO_FILTERS, 1 if deal_type == 'sale' else 2)
+
+
+def metro_line_keyboard(line_code: str, selected: Iterable[str]) -> InlineKeyboardMarkup:
+    stations = METRO_LINES[line_code]['stations']
+    return _checklist(LINE_ITEMS[line_code], BACK_TO_LINES, selection_mask(stations, selected))
+
+
+@lru_cache(maxsize=4096)
+def _metro_lines(counts: Tuple[int, ...], total: int) -> InlineKeyboardMarkup:
+    keyboard = []
+    for (code, line), count in zip(METRO_LINES.items(), counts):
+        suffix = f" ({count})" if count > 0 else ""
+        keyboard.append([InlineKeyboardButton(f"{line['name']}{suffix}", callback_data=f'l_{code}')])
+    keyboard.append([InlineKeyboardButton("🔍 Поиск по названию", callback_data='metro_search')])
+    if total:
+        keyboard.append([InlineKeyboardButton(f"🗑 Сбросить всё ({total})", callback_data='metro_clear')])
+    keyboard.append([InlineKeyboardButton(BACK_TO_FILTERS[0], callback_data=BACK_TO_FILTERS[1])])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def metro_lines_keyboard(selected: Iterable[str]) -> InlineKeyboardMarkup:
+    selected = list(selected)
+    chosen = set(selected)
+    counts = tuple(sum(1 for s in line['stations'] if s in chosen) for line in METRO_LINES.values())
+    return _metro_lines(counts, len(selected))
+
+
+@lru_cache(maxsize=1024)
+def filters_menu_keyboard(districts: int, rooms: int, metros: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"🏘 Округа ({districts})", callback_data='f_districts')],
+        [InlineKeyboardButton(f"🛏 Комнаты ({rooms})", callback_data='f_rooms')],
+        [InlineKeyboardButton(f"🚇 Метро ({metros})", callback_data='f_metros')],
+        [InlineKeyboardButton("📱 Площадки", callback_data='f_sources')],
+        [InlineKeyboardButton("👤 Тип объявлений", callback_data='f_owner')],
+        [InlineKeyboardButton("📋 Тип сделки", callback_data='f_deal_type')],
+        [InlineKeyboardButton("✅ Сохранить фильтры", callback_data='f_done')],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu')]
+    ])
+
+
+def warm_up():
+    """Все варианты небольших клавиатур заранее (вызывается из post_init)"""
+    for items in (ROOM_ITEMS, SOURCE_ITEMS, OWNER_ITEMS, DEAL_ITEMS):
+        for mask in range(1 << len(items)):
+            _checklist(items, BACK_TO_FILTERS, mask)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# matcher.py v2.1.0 (18.10.2026)
+# - Проверка объявления по фильтрам подписчика (matches_filters) и определение округа вынесены из handlers.py
+# - SubscriptionIndex: фильтры всех подписчиков один раз собираются в инвертированные индексы
+#   (площадка+тип сделки, округ, станция метро, комнатность, только собственник); подписчики объявления —
+#   пересечение множеств вместо перебора объявления × подписчики
+# - CompiledFilter: фильтры пользователя в виде frozenset-ов (__slots__), кэш FilterCache по users.filters_version
+# - AdFeatures: станции, округ, комнатность, площадь и этаж объявления считаются один раз (enrich_ads)
+# - build_matcher: выбор индекса или битовой матрицы NumPy (matcher_bitset.py) по MATCHER_BACKEND
+# - MATCHER_VERIFY: сверка каждого объявления с перебором через matches_filters; запуск как скрипта —
+#   дифференциальная проверка и замер на синтетических фильтрах
+
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+from config import DISTRICTS, ROOM_OPTIONS, ALL_METRO_STATIONS, MATCHER_VERIFY, MATCHER_BACKEND
+from gazetteer import Gazetteer
+from models import Ad
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCES = ['cian', 'avito']
+
+
+def _norm_text(value: str) -> str:
+    return re.sub(r"\s+", " ", str(value or "").replace("ё", "е")).strip().lower()
+
+
+def _norm_metro(value: str) -> str:
+    value = _norm_text(value)
+    value = re.sub(r"\bм\.?\s*", "", value)
+    value = re.sub(r"\d+\s*мин.*$", "", value).strip(" ,.-")
+    return value
+
+
+def _extract_metro_variants(value: str) -> set[str]:
+    text = _norm_text(value).replace("метро", "").replace("м.", "")
+    text = re.sub(r"\([^)]*мин[^)]*\)", "", text)
+    text = re.sub(r"\d+\s*мин[^,;|/]*", "", text)
+    return {part.strip(" .-–—") for part in re.split(r"[,;|/\n]+", text) if part.strip(" .-–—")}
+
+
+DISTRICT_ALIASES = {
+    "ЦАО": ["цао", "центральный административный округ"],
+    "САО": ["сао", "северный административный округ"],
+    "СВАО": ["свао", "северо-восточный административный округ"],
+    "ВАО": ["вао", "восточный административный округ"],
+    "ЮВАО": ["ювао", "юго-восточный административный округ"],
+    "ЮАО": ["юао", "южный административный округ"],
+    "ЮЗАО": ["юзао", "юго-западный административный округ"],
+    "ЗАО": ["зао", "западный административный округ"],
+    "СЗАО": ["сзао", "северо-западный административный округ"],
+    "НАО": ["нао", "новомосковский административный округ"],
+    "ТАО": ["тао", "троицкий административный округ"],
+    "ЗелАО": ["зелао", "зеленоградский административный округ"],
+}
+_DISTRICT_BY_ALIAS = {name: district for district, names in DISTRICT_ALIASES.items() for name in names}
+# Границы слова с учётом дефиса: «вао» не совпадает внутри «ювао», «западный» — внутри «юго-западный»
+_DISTRICT_ALIAS_RE = re.compile(
+    r"(?<![\w-])(" + "|".join(re.escape(n) for n in sorted(_DISTRICT_BY_ALIAS, key=len, reverse=True)) + r")(?![\w-])"
+)
+
+
+def _detect_ad_district(ad: Ad) -> Optional[str]:
+    if ad.district_detected in DISTRICTS:
+        return ad.district_detected
+    hay = _norm_text(" ".join([ad.district_detected or "", ad.address or "", ad.title or ""]))
+    match = _DISTRICT_ALIAS_RE.search(hay)
+    if match:
+        return _DISTRICT_BY_ALIAS[match.group(1)]
+    return Gazetteer.detect(ad.address, ad.metro)
+
+
+_AREA_RE = re.compile(r"(\d+(?:[.,]\d+)?)")
+_FLOOR_RE = re.compile(r"(\d+)\s*(?:/|из)\s*(\d+)|(\d+)")
+# Нормализованное название станции -> индекс в ALL_METRO_STATIONS
+STATION_IDS = {_norm_metro(station): i for i, station in enumerate(ALL_METRO_STATIONS)}
+
+
+def _room_type(ad: Ad) -> Optional[str]:
+    rc = str(ad.rooms).lower().strip()
+    room_type = {'студия': 'Студия', '1': '1-комнатная', '2': '2-комнатная', '3': '3-комнатная'}.get(rc)
+    if room_type is None and rc.isdigit() and int(rc) >= 4:
+        room_type = '4-комнатная+'
+    return room_type
+
+
+class AdFeatures:
+    """Признаки объявления, считаются один раз после сбора: станции (нормализованные названия и индексы
+    ALL_METRO_STATIONS), округ, комнатность в терминах ROOM_OPTIONS, площадь, этаж, собственник"""
+    __slots__ = ('metro_names', 'station_ids', 'district', 'room_type', 'area', 'floor', 'floors_total', 'owner')
+
+    def __init__(self, ad: Ad):
+        self.metro_names = frozenset(_norm_metro(v) for v in _extract_metro_variants(ad.metro))
+        self.station_ids = frozenset(STATION_IDS[name] for name in self.metro_names if name in STATION_IDS)
+        self.district = _detect_ad_district(ad)
+        self.room_type = _room_type(ad)
+        area = _AREA_RE.search(ad.area or "")
+        self.area = float(area.group(1).replace(",", ".")) if area else None
+        floor = _FLOOR_RE.search(ad.floor or "")
+        if floor:
+            self.floor = int(floor.group(1) or floor.group(3))
+            self.floors_total = int(floor.group(2)) if floor.group(2) else None
+        else:
+            self.floor = self.floors_total = None
+        self.owner = bool(ad.owner)
+
+
+def ad_features(ad: Ad) -> AdFeatures:
+    if ad._features is None:
+        ad._features = AdFeatures(ad)
+    return ad._features
+
+
+def enrich_ads(ads: Iterable[Ad]) -> List[Ad]:
+    """Этап конвейера после fetch_all_ads: признаки считаются до подбора подписчиков и рассылки"""
+    ads = list(ads)
+    for ad in ads:
+        ad._features = AdFeatures(ad)
+    return ads
+
+
+def matches_filters(ad: Ad, filters_dict: dict) -> bool:
+    if ad.source not in filters_dict.get('sources', ['cian', 'avito']):
+        return False
+    if ad.deal_type != filters_dict.get('deal_type', 'sale'):
+        return False
+    features = ad_features(ad)
+
+    districts = filters_dict.get('districts', [])
+    if districts:
+        if not features.district or features.district not in districts:
+            return False
+
+    metros = filters_dict.get('metros', [])
+    if metros:
+        selected = {_norm_metro(v) for v in metros}
+        if not features.metro_names or not (features.metro_names & selected):
+            return False
+
+    rooms = filters_dict.get('rooms', [])
+    if rooms:
+        if features.room_type not in rooms:
+            return False
+
+    if filters_dict.get('owner_only', False) and not ad.owner:
+        return False
+    return True
+
+
+def _str_set(value) -> Optional[FrozenSet[str]]:
+    """Список строк из фильтра -> frozenset; всё остальное (строка, число, вложенные списки) не индексируется"""
+    if isinstance(value, (list, tuple, set, frozenset)) and all(isinstance(v, str) for v in value):
+        return frozenset(value)
+    return None
+
+
+class CompiledFilter:
+    """Фильтры пользователя, приведённые к виду для индекса: пары (площадка, тип сделки), округа, нормализованные
+    станции и комнатность. Пустое множество — без ограничения. indexable=False — фильтры нестандартной формы,
+    их проверяет matches_filters по raw"""
+    __slots__ = ('version', 'channels', 'districts', 'metros', 'rooms', 'owner_only', 'indexable', 'raw')
+
+    def __init__(self, raw: dict, version: int = 0):
+        self.version = version
+        self.raw = raw
+        self.owner_only = bool(raw.get('owner_only', False))
+        sources = _str_set(raw.get('sources', DEFAULT_SOURCES))
+        deal_type = raw.get('deal_type', 'sale')
+        districts = raw.get('districts', [])
+        rooms = raw.get('rooms', [])
+        self.districts = _str_set(districts) if districts else frozenset()
+        self.rooms = _str_set(rooms) if rooms else frozenset()
+        try:
+            self.metros = frozenset(_norm_metro(v) for v in raw.get('metros', []) or [])
+        except TypeError:
+            self.metros = None
+        self.indexable = (
+            sources is not None and isinstance(deal_type, str)
+            and self.districts is not None and self.rooms is not None and self.metros is not None
+        )
+        self.channels = frozenset((source, deal_type) for source in sources) if self.indexable else frozenset()
+
+    @classmethod
+    def from_json(cls, filters_json: Optional[str], version: int = 0) -> Optional['CompiledFilter']:
+        """None — фильтров нет или их не разобрать (такие подписчики пропускаются, как и раньше)"""
+        if not filters_json:
+            return None
+        try:
+            raw = json.loads(filters_json)
+        except Exception:
+            return None
+        if not isinstance(raw, dict):
+            return None
+        return cls(raw, version)
+
+
+class FilterCache:
+    """user_id -> CompiledFilter между циклами сбора; запись заменяется, когда в БД растёт filters_version"""
+    _compiled: Dict[int, Optional[CompiledFilter]] = {}
+    _versions: Dict[int, int] = {}
+    stats: Dict[str, int] = {'hit': 0, 'compiled': 0}
+
+    @classmethod
+    def get(cls, user_id: int, filters_json: Optional[str], version: Optional[int]) -> Optional[CompiledFilter]:
+        version = version or 0
+        if user_id in cls._versions and cls._versions[user_id] == version:
+            cls.stats['hit'] += 1
+            return cls._compiled[user_id]
+        compiled = CompiledFilter.from_json(filters_json, version)
+        cls._compiled[user_id] = compiled
+        cls._versions[user_id] = version
+        cls.stats['compiled'] += 1
+        return compiled
+
+    @classmethod
+    def put(cls, user_id: int, filters_dict: dict, version: Optional[int]):
+        """Вызывается после сохранения фильтров: следующий цикл возьмёт готовый объект"""
+        cls._compiled[user_id] = CompiledFilter(filters_dict, version or 0)
+        cls._versions[user_id] = version or 0
+
+    @classmethod
+    def retain(cls, user_ids: Iterable[int]):
+        """Убирает пользователей, у которых закончилась подписка"""
+        keep = set(user_ids)
+        for user_id in [u for u in cls._compiled if u not in keep]:
+            del cls._compiled[user_id]
+            del cls._versions[user_id]
+
+
+class _Dimension:
+    """Одно измерение фильтра: пользователи без ограничения и индекс значение -> пользователи"""
+    __slots__ = ('unrestricted', 'index')
+
+    def __init__(self):
+        self.unrestricted: Set[int] = set()
+        self.index: Dict[str, Set[int]] = {}
+
+    def add(self, user: int, values: Optional[Iterable[str]]):
+        if not values:
+            self.unrestricted.add(user)
+            return
+        for value in values:
+            self.index.setdefault(value, set()).add(user)
+
+    @property
+    def restricted(self) -> bool:
+        return bool(self.index)
+
+    def narrow(self, candidates: Set[int], values: Iterable[str]) -> Set[int]:
+        allowed = candidates & self.unrestricted
+        for value in values:
+            users = self.index.get(value)
+            if users:
+                allowed |= candidates & users
+        return allowed
+
+
+class SubscriptionIndex:
+    """Инвертированные индексы по фильтрам подписчиков. match(ad) возвращает тех же пользователей и в том же
+    порядке, что перебор строк get_active_subscribers с matches_filters"""
+
+    def __init__(self, subscribers: Iterable):
+        started = time.perf_counter()
+        self._user_ids: List[int] = []
+        self._filters: List[dict] = []
+        self._channels: Dict[tuple, Set[int]] = {}
+        self._districts = _Dimension()
+        self._metros = _Dimension()
+        self._rooms = _Dimension()
+        self._owner_only: Set[int] = set()
+        # Фильтры нестандартной формы проверяются matches_filters напрямую
+        self._residual: List[int] = []
+        user_ids = []
+        for row in subscribers:
+            user_ids.append(row['user_id'])
+            compiled = FilterCache.get(row['user_id'], row['filters'], row.get('filters_version'))
+            if compiled is not None:
+                self._add(row['user_id'], compiled)
+        FilterCache.retain(user_ids)
+        logger.debug(
+            'Индекс подписок: %s пользователей (%s без индекса) за %.1f ms, кэш фильтров %s',
+            len(self._user_ids), len(self._residual), (time.perf_counter() - started) * 1000, FilterCache.stats,
+        )
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def _add(self, user_id: int, compiled: CompiledFilter):
+        user = len(self._user_ids)
+        self._user_ids.append(user_id)
+        self._filters.append(compiled.raw)
+        if not compiled.indexable:
+            self._residual.append(user)
+            return
+        for channel in compiled.channels:
+            self._channels.setdefault(channel, set()).add(user)
+        self._districts.add(user, compiled.districts)
+        self._metros.add(user, compiled.metros)
+        self._rooms.add(user, compiled.rooms)
+        if compiled.owner_only:
+            self._owner_only.add(user)
+
+    def _match_indexed(self, ad: Ad) -> Set[int]:
+        channel = self._channels.get((ad.source, ad.deal_type))
+        if not channel:
+            return set()
+        features = ad_features(ad)
+        candidates = channel
+        if not features.owner and self._owner_only:
+            candidates = candidates - self._owner_only
+        if candidates and self._rooms.restricted:
+            candidates = self._rooms.narrow(candidates, (features.room_type,) if features.room_type else ())
+        if candidates and self._districts.restricted:
+            candidates = self._districts.narrow(candidates, (features.district,) if features.district else ())
+        if candidates and self._metros.restricted:
+            candidates = self._metros.narrow(candidates, features.metro_names)
+        # Множество канала принадлежит индексу, наружу отдаём копию
+        return set(candidates) if candidates is channel else candidates
+
+    def match(self, ad: Ad) -> List[int]:
+        """user_id подписчиков, которым подходит объявление, в порядке строк подписчиков"""
+        users = self._match_indexed(ad)
+        for user in self._residual:
+            try:
+                if matches_filters(ad, self._filters[user]):
+                    users.add(user)
+            except Exception:
+                logger.debug('Фильтры пользователя %s не проверить', self._user_ids[user], exc_info=True)
+        matched = [self._user_ids[user] for user in sorted(users)]
+        if MATCHER_VERIFY:
+            expected = self.match_brute_force(ad)
+            if matched != expected:
+                logger.warning(
+                    'Индекс подписок расходится с matches_filters для %s: индекс %s, перебор %s',
+                    ad.id, matched, expected,
+                )
+                return expected
+        return matched
+
+    def match_batch(self, ads: List[Ad]) -> List[List[int]]:
+        return [self.match(ad) for ad in ads]
+
+    def match_brute_force(self, ad: Ad) -> List[int]:
+        matched = []
+        for user_id, filters_dict in zip(self._user_ids, self._filters):
+            try:
+                if matches_filters(ad, filters_dict):
+                    matched.append(user_id)
+            except Exception:
+                continue
+        return matched
+
+
+def build_matcher(subscribers: Iterable):
+    """Подборщик на цикл по MATCHER_BACKEND: 'numpy' — общая битовая матрица (matcher_bitset), иначе индекс"""
+    if MATCHER_BACKEND == 'numpy':
+        from matcher_bitset import NUMPY_AVAILABLE, BitsetMatcher
+        if NUMPY_AVAILABLE:
+            return BitsetMatcher.shared().refresh(subscribers)
+        logger.warning('MATCHER_BACKEND=numpy, но numpy не установлен — используется индекс')
+    return SubscriptionIndex(subscribers)
+
+
+# ========== Дифференциальная проверка ==========
+def _random_filters(rng: random.Random, odd_share: float = 0.05) -> dict:
+    filters_dict = {
+        'deal_type': rng.choice(['sale', 'rent']),
+        'sources': rng.sample(DEFAULT_SOURCES, rng.randint(1, 2)),
+        'districts': rng.sample(DISTRICTS, rng.choice([0, 0, 1, 2, 4])),
+        'rooms': rng.sample(ROOM_OPTIONS, rng.choice([0, 0, 1, 2, 3])),
+        'metros': rng.sample(ALL_METRO_STATIONS, rng.choice([0, 0, 0, 1, 3, 8])),
+        'owner_only': rng.random() < 0.2,
+    }
+    if rng.random() < odd_share:
+        # нестандартные формы фильтров из старых записей
+        filters_dict['districts'] = rng.choice(DISTRICTS)
+    return filters_dict
+
+
+def _random_ad(rng: random.Random, number: int) -> Ad:
+    stations = rng.sample(ALL_METRO_STATIONS, rng.randint(0, 3))
+    metro = ', '.join(f'{s} ({rng.randint(1, 25)} мин)' for s in stations)
+    okrug = rng.choice(DISTRICTS + [''] * 12)
+    return Ad(
+        id=f'synthetic_{number}',
+        source=rng.choice(DEFAULT_SOURCES),
+        deal_type=rng.choice(['sale', 'rent']),
+        title=f'{rng.randint(1, 4)}-комн. квартира',
+        link=f'https://example.invalid/{number}',
+        price=f'{rng.randint(5, 90) * 1000000} ₽',
+        address=', '.join(p for p in ('Москва', okrug, f'ул. Тестовая, {number}') if p),
+        metro=metro,
+        rooms=rng.choice(['студия', '1', '2', '3', '4', '5', '']),
+        area='',
+        floor='',
+        owner=rng.random() < 0.3,
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Сверка SubscriptionIndex с matches_filters на синтетических данных')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ads', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(args.seed)
+    rows = [{'user_id': 1000 + i, 'filters': json.dumps(_random_filters(rng), ensure_ascii=False)}
+            for i in range(args.users)]
+    ads = [_random_ad(rng, i) for i in range(args.ads)]
+    started = time.perf_counter()
+    enrich_ads(ads)
+    enrich_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = SubscriptionIndex(rows)
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    brute = [[row['user_id'] for row in rows if matches_filters(ad, json.loads(row['filters']))] for ad in ads]
+    brute_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [index.match(ad) for ad in ads]
+    index_time = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(brute, indexed) if a != b)
+    pairs = sum(len(m) for m in brute)
+    print(f'пользователей {args.users}, объявлений {args.ads}, совпадений {pairs}')
+    print(f'признаки объявлений: {enrich_time * 1000:.0f} ms')
+    print(f'перебор: {brute_time * 1000:.0f} ms, индекс: {index_time * 1000:.0f} ms (+ построение {built * 1000:.0f} ms)')
+    print(f'расхождений: {mismatches}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
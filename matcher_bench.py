@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# matcher_bench.py v2.1.0 (18.10.2026)
+# - Замер подбора подписчиков на синтетических фильтрах: перебор matches_filters, индекс, битовая матрица NumPy
+# - Пары объявление×пользователь в секунду для 1k/10k/100k пользователей и сверка результатов с перебором
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from matcher import SubscriptionIndex, FilterCache, enrich_ads, matches_filters, _random_ad, _random_filters
+from matcher_bitset import NUMPY_AVAILABLE, BitsetMatcher
+
+__version__ = '2.1.0'
+
+
+def _rows(rng: random.Random, users: int, odd_share: float) -> list[dict]:
+    return [{'user_id': 1000 + i, 'filters': json.dumps(_random_filters(rng, odd_share), ensure_ascii=False),
+             'filters_version': 1}
+            for i in range(users)]
+
+
+def bench(users: int, ads_count: int, seed: int, brute_limit: int, odd_share: float) -> list[tuple]:
+    rng = random.Random(seed)
+    rows = _rows(rng, users, odd_share)
+    ads = enrich_ads(_random_ad(rng, i) for i in range(ads_count))
+    pairs = users * ads_count
+    result = []
+
+    expected = None
+    if users <= brute_limit:
+        # Перебор как в прежнем collector_loop, но без json.loads на каждую пару
+        filters = [(row['user_id'], json.loads(row['filters'])) for row in rows]
+        started = time.perf_counter()
+        expected = [[user_id for user_id, f in filters if matches_filters(ad, f)] for ad in ads]
+        elapsed = time.perf_counter() - started
+        result.append(('brute', 0.0, elapsed, pairs / elapsed, 0))
+
+    FilterCache._compiled.clear()
+    FilterCache._versions.clear()
+    started = time.perf_counter()
+    index = SubscriptionIndex(rows)
+    built = time.perf_counter() - started
+    started = time.perf_counter()
+    matched = index.match_batch(ads)
+    elapsed = time.perf_counter() - started
+    result.append(('index', built, elapsed, pairs / elapsed, _mismatches(expected, matched)))
+    expected = expected or matched
+
+    if NUMPY_AVAILABLE:
+        started = time.perf_counter()
+        matrix = BitsetMatcher().refresh(rows)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        matched = matrix.match_batch(ads)
+        elapsed = time.perf_counter() - started
+        result.append(('numpy', built, elapsed, pairs / elapsed, _mismatches(expected, matched)))
+    return result
+
+
+def _mismatches(expected, actual) -> int:
+    if expected is None:
+        return 0
+    return sum(1 for a, b in zip(expected, actual) if a != b)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Замер подбора подписчиков: перебор, индекс, NumPy')
+    parser.add_argument('--users', default='1000,10000,100000', help='размеры базы через запятую')
+    parser.add_argument('--ads', type=int, default=100, help='объявлений в цикле')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--odd-share', type=float, default=0.001,
+                        help='доля фильтров нестандартной формы (проверяются matches_filters)')
+    parser.add_argument('--brute-limit', type=int, default=100000, help='перебор только до этого числа пользователей')
+    args = parser.parse_args(argv)
+
+    if not NUMPY_AVAILABLE:
+        print('numpy не установлен — замеряются только перебор и индекс', file=sys.stderr)
+    failed = 0
+    for users in [int(u) for u in args.users.split(',') if u.strip()]:
+        print(f'\nпользователей {users}, объявлений {args.ads}')
+        print(f"{'backend':<8} {'build ms':>9} {'match ms':>10} {'pairs/sec':>13} {'diff':>5}")
+        for name, built, elapsed, rate, diff in bench(users, args.ads, args.seed, args.brute_limit, args.odd_share):
+            failed += diff
+            print(f'{name:<8} {built * 1000:>9.0f} {elapsed * 1000:>10.0f} {rate:>13,.0f} {diff:>5}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
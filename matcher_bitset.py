@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# matcher_bitset.py v2.1.0 (18.10.2026)
+# - Подбор подписчиков на NumPy (MATCHER_BACKEND=numpy): фильтры всех пользователей — матрица битовых масок
+#   (площадка×тип сделки, округа, комнатность, станции метро, только собственник), объявление или пачка
+#   объявлений проверяется против всех пользователей за один векторный проход
+# - Матрица обновляется инкрементально: перекодируются только строки пользователей с новой версией фильтров
+
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from config import DISTRICTS, ROOM_OPTIONS, MATCHER_VERIFY
+from matcher import (
+    DEFAULT_SOURCES, STATION_IDS, CompiledFilter, FilterCache, ad_features, matches_filters,
+)
+from models import Ad
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+DEAL_TYPES_BITS = ('sale', 'rent')
+CHANNEL_BITS = {(s, d): 1 << i for i, (s, d) in enumerate((s, d) for s in DEFAULT_SOURCES for d in DEAL_TYPES_BITS)}
+DISTRICT_BITS = {name: 1 << i for i, name in enumerate(DISTRICTS)}
+ROOM_BITS = {name: 1 << i for i, name in enumerate(ROOM_OPTIONS)}
+# Объявлений в одном векторном проходе: матрица BATCH_ADS × подписчики
+BATCH_ADS = 64
+
+
+def _fits(compiled: CompiledFilter) -> bool:
+    """Фильтры, значения которых укладываются в фиксированные маски; остальные проверяет matches_filters"""
+    return (
+        compiled.indexable
+        and all(channel in CHANNEL_BITS for channel in compiled.channels)
+        and all(d in DISTRICT_BITS for d in compiled.districts)
+        and all(r in ROOM_BITS for r in compiled.rooms)
+    )
+
+
+class BitsetMatcher:
+    """Строка матрицы — пользователь. Маска 0 в измерении означает «без ограничения».
+    Станции: индексы ALL_METRO_STATIONS плюс нестандартные названия из фильтров, дописываемые в словарь"""
+    _shared: Optional['BitsetMatcher'] = None
+
+    def __init__(self, capacity: int = 1024):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError('numpy не установлен')
+        self._stations: Dict[str, int] = dict(STATION_IDS)
+        self._words = self._words_for(len(self._stations))
+        self._alloc(capacity)
+        self._row_of: Dict[int, int] = {}
+        self._compiled: Dict[int, CompiledFilter] = {}
+        self._free: List[int] = []
+        self._residual: Dict[int, CompiledFilter] = {}
+        self._snapshot: List[int] = []
+        self._positions: Dict[int, int] = {}
+        self.stats: Dict[str, int] = {'rows_encoded': 0, 'rows_cleared': 0}
+
+    @classmethod
+    def shared(cls) -> 'BitsetMatcher':
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @staticmethod
+    def _words_for(stations: int) -> int:
+        return max(1, (stations + 63) // 64)
+
+    def _alloc(self, capacity: int):
+        self._channels = np.zeros(capacity, dtype=np.uint8)
+        self._districts = np.zeros(capacity, dtype=np.uint16)
+        self._rooms = np.zeros(capacity, dtype=np.uint8)
+        self._owner_only = np.zeros(capacity, dtype=bool)
+        self._metros = np.zeros((capacity, self._words), dtype=np.uint64)
+        self._metro_any = np.ones(capacity, dtype=bool)
+        self._order = np.full(capacity, np.iinfo(np.int64).max, dtype=np.int64)
+        self._user_ids = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+
+    def _reserve(self, rows: int, words: int):
+        """Расширяет матрицу (вдвое по строкам) при нехватке строк или слов под станции"""
+        capacity = len(self._channels)
+        if rows <= capacity and words <= self._words:
+            return
+        old = (self._channels, self._districts, self._rooms, self._owner_only, self._metros, self._metro_any,
+               self._order, self._user_ids)
+        n, old_words = self._size, self._words
+        self._words = max(words, old_words)
+        self._alloc(max(capacity, rows * 2 if rows > capacity else capacity))
+        for new, prev in zip((self._channels, self._districts, self._rooms, self._owner_only, self._metro_any,
+                              self._order, self._user_ids), old[:4] + old[5:]):
+            new[:n] = prev[:n]
+        self._metros[:n, :old_words] = old[4][:n]
+        self._size = n
+
+    def refresh(self, subscribers: Iterable) -> 'BitsetMatcher':
+        """Снимок подписчиков на цикл: перекодирует изменившиеся строки, освобождает строки ушедших"""
+        started = time.perf_counter()
+        seen: Dict[int, int] = {}
+        snapshot: List[int] = []
+        for row in subscribers:
+            user_id = row['user_id']
+            compiled = FilterCache.get(user_id, row['filters'], row.get('filters_version'))
+            if compiled is None or user_id in seen:
+                continue
+            seen[user_id] = len(snapshot)
+            snapshot.append(user_id)
+            if self._compiled.get(user_id) is not compiled:
+                self._encode(user_id, compiled)
+        for user_id in [u for u in self._compiled if u not in seen]:
+            self._clear(user_id)
+        for user_id, position in seen.items():
+            row_index = self._row_of.get(user_id)
+            if row_index is not None:
+                self._order[row_index] = position
+        self._snapshot = snapshot
+        self._positions = seen
+        FilterCache.retain(seen)
+        logger.debug(
+            'Матрица подписок: %s строк, %s слов станций, %s без маски, обновление %.1f ms, %s',
+            len(self._row_of), self._words, len(self._residual), (time.perf_counter() - started) * 1000, self.stats,
+        )
+        return self
+
+    def _encode(self, user_id: int, compiled: CompiledFilter):
+        self._compiled[user_id] = compiled
+        self.stats['rows_encoded'] += 1
+        if not _fits(compiled):
+            self._drop_row(user_id)
+            self._residual[user_id] = compiled
+            return
+        self._residual.pop(user_id, None)
+        for name in compiled.metros:
+            if name not in self._stations:
+                self._stations[name] = len(self._stations)
+        row_index = self._row_of.get(user_id)
+        if row_index is None and self._free:
+            row_index = self._free.pop()
+            self._row_of[user_id] = row_index
+        self._reserve(self._size + (row_index is None), self._words_for(len(self._stations)))
+        if row_index is None:
+            row_index = self._size
+            self._size += 1
+            self._row_of[user_id] = row_index
+
+        mask = 0
+        for channel in compiled.channels:
+            mask |= CHANNEL_BITS[channel]
+        self._channels[row_index] = mask
+        self._districts[row_index] = sum(DISTRICT_BITS[d] for d in compiled.districts)
+        self._rooms[row_index] = sum(ROOM_BITS[r] for r in compiled.rooms)
+        self._owner_only[row_index] = compiled.owner_only
+        self._metros[row_index] = self._station_words(compiled.metros)
+        self._metro_any[row_index] = not compiled.metros
+        self._user_ids[row_index] = user_id
+
+    def _drop_row(self, user_id: int):
+        row_index = self._row_of.pop(user_id, None)
+        if row_index is None:
+            return
+        self._channels[row_index] = 0
+        self._order[row_index] = np.iinfo(np.int64).max
+        self._free.append(row_index)
+
+    def _clear(self, user_id: int):
+        self._drop_row(user_id)
+        self._residual.pop(user_id, None)
+        self._compiled.pop(user_id, None)
+        self.stats['rows_cleared'] += 1
+
+    def _station_words(self, names: Iterable[str]) -> 'np.ndarray':
+        words = np.zeros(self._words, dtype=np.uint64)
+        for name in names:
+            bit = self._stations.get(name)
+            if bit is not None:
+                words[bit >> 6] |= np.uint64(1 << (bit & 63))
+        return words
+
+    def _ad_masks(self, ad: Ad):
+        features = ad_features(ad)
+        return (
+            CHANNEL_BITS.get((ad.source, ad.deal_type), 0),
+            DISTRICT_BITS.get(features.district, 0),
+            ROOM_BITS.get(features.room_type, 0),
+            features.owner,
+            self._station_words(features.metro_names),
+        )
+
+    def match_batch(self, ads: List[Ad]) -> List[List[int]]:
+        """Пачка объявлений против всех строк: маски площадки, округа, комнат и собственника — матрица
+        объявления × пользователи за один проход, станции — только по прошедшим строкам с ограничением по метро"""
+        result: List[List[int]] = []
+        for start in range(0, len(ads), BATCH_ADS):
+            result.extend(self._match_chunk(ads[start:start + BATCH_ADS]))
+        return result
+
+    def _match_chunk(self, ads: List[Ad]) -> List[List[int]]:
+        n = self._size
+        masks = [self._ad_masks(ad) for ad in ads]
+        channel = np.array([m[0] for m in masks], dtype=np.uint8)[:, None]
+        district = np.array([m[1] for m in masks], dtype=np.uint16)[:, None]
+        room = np.array([m[2] for m in masks], dtype=np.uint8)[:, None]
+        owner = np.array([m[3] for m in masks], dtype=bool)[:, None]
+
+        ok = (self._channels[:n] & channel) != 0
+        ok &= (self._districts[:n] == 0) | ((self._districts[:n] & district) != 0)
+        ok &= (self._rooms[:n] == 0) | ((self._rooms[:n] & room) != 0)
+        ok &= ~self._owner_only[:n] | owner
+
+        result = []
+        for ad, row_ok, ad_masks in zip(ads, ok, masks):
+            rows = np.flatnonzero(row_ok)
+            restricted = rows[~self._metro_any[rows]]
+            if len(restricted):
+                hit = (self._metros[restricted] & ad_masks[4]).any(axis=1)
+                rows = np.union1d(rows[self._metro_any[rows]], restricted[hit])
+            users = list(zip(self._order[rows].tolist(), self._user_ids[rows].tolist()))
+            for user_id, compiled in self._residual.items():
+                try:
+                    if matches_filters(ad, compiled.raw):
+                        users.append((self._positions[user_id], user_id))
+                except Exception:
+                    logger.debug('Фильтры пользователя %s не проверить', user_id, exc_info=True)
+            matched = [user_id for _, user_id in sorted(users)]
+            if MATCHER_VERIFY:
+                expected = self.match_brute_force(ad)
+                if matched != expected:
+                    logger.warning(
+                        'Битовая матрица расходится с matches_filters для %s: матрица %s, перебор %s',
+                        ad.id, matched, expected,
+                    )
+                    matched = expected
+            result.append(matched)
+        return result
+
+    def match(self, ad: Ad) -> List[int]:
+        return self.match_batch([ad])[0]
+
+    def match_brute_force(self, ad: Ad) -> List[int]:
+        matched = []
+        for user_id in self._snapshot:
+            try:
+                if matches_filters(ad, self._compiled[user_id].raw):
+                    matched.append(user_id)
+            except Exception:
+                continue
+        return matched
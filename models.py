@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
-# models.py v2.0.0 (11.03.2026)
-# - Добавлена явная версия модуля
+# models.py v2.1.0 (18.10.2026)
+# - Ad._features: признаки объявления для подбора и рассылки (matcher.AdFeatures), в model_dump не попадают
+# - Ad._payloads: готовые сообщения рассылки по варианту роли (render.AdPayload)
 
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List
+from pydantic import BaseModel, Field, PrivateAttr, validator
+from typing import Any, Optional, List
 import re
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 
 class Ad(BaseModel):
@@ -25,6 +26,8 @@ class Ad(BaseModel):
     photos: List[str] = []
     district_detected: Optional[str] = None
     price_value: int = 0
+    _features: Any = PrivateAttr(default=None)
+    _payloads: Any = PrivateAttr(default=None)
 
     @validator('price_value', always=True, pre=True)
     def extract_price_value(cls, v, values):
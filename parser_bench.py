@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# parser_bench.py v2.1.0 (18.10.2026)
+# - Микробенчмарк бэкендов разбора HTML на сохранённых debug-страницах: время и пиковая память на страницу
+
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from parsers import (
+    DEBUG_DIR, PARSE_BACKENDS, CIAN_CARD_SELECTORS, AVITO_CARD_SELECTORS,
+    parse_listing_page, _extract_ads_from_cards,
+)
+
+__version__ = '2.1.0'
+
+SELECTORS = {'cian': CIAN_CARD_SELECTORS, 'avito': AVITO_CARD_SELECTORS}
+
+
+def _source_for(path: Path) -> str:
+    return 'avito' if path.name.startswith('avito') else 'cian'
+
+
+def _run_once(html: str, source: str, backend: str) -> int:
+    _, cards = parse_listing_page(html, source, SELECTORS[source], backend=backend)
+    return len(_extract_ads_from_cards(cards, source, 'sale'))
+
+
+def bench_file(path: Path, backends: list[str], repeat: int) -> list[tuple]:
+    html = path.read_text(encoding='utf-8', errors='replace')
+    source = _source_for(path)
+    rows = []
+    for backend in backends:
+        timings = []
+        ads = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ads = _run_once(html, source, backend)
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        _run_once(html, source, backend)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rows.append((backend, statistics.median(timings), min(timings), peak / 1024 / 1024, ads))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Сравнение бэкендов разбора HTML на сохранённых страницах')
+    parser.add_argument('files', nargs='*', help=f'HTML-файлы (по умолчанию {DEBUG_DIR}/*_debug.html)')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов на бэкенд')
+    parser.add_argument('--backends', default=','.join(PARSE_BACKENDS), help='список через запятую')
+    args = parser.parse_args(argv)
+
+    files = [Path(f) for f in args.files] or sorted(DEBUG_DIR.glob('*_debug.html'))
+    if not files:
+        print(f'Нет сохранённых страниц в {DEBUG_DIR}', file=sys.stderr)
+        return 1
+    backends = [b.strip() for b in args.backends.split(',') if b.strip() in PARSE_BACKENDS]
+
+    for path in files:
+        rows = bench_file(path, backends, max(1, args.repeat))
+        print(f'\n{path.name} ({path.stat().st_size // 1024} KB, {_source_for(path)})')
+        print(f"{'backend':<10} {'median ms':>10} {'min ms':>10} {'peak MB':>9} {'ads':>5}")
+        for backend, median, best, peak, ads in rows:
+            print(f'{backend:<10} {median:>10.1f} {best:>10.1f} {peak:>9.1f} {ads:>5}')
+        if len({row[4] for row in rows}) > 1:
+            print('ВНИМАНИЕ: бэкенды нашли разное число объявлений')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
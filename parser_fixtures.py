@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# parser_fixtures.py v2.1.0 (18.10.2026)
+# - Формат корпуса HTML-фикстур парсеров: name.html + name.json (источник, тип сделки, страница, ожидаемые Ad)
+# - Сохранение фикстур из боевого сбора (PARSER_FIXTURE_CAPTURE) с ротацией старых файлов
+
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from config import PARSER_FIXTURES_DIR
+from models import Ad
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = Path(PARSER_FIXTURES_DIR)
+FIXTURE_KEEP = 200
+
+
+class Fixture(BaseModel):
+    name: str
+    html_path: Path
+    source: str
+    deal_type: str
+    page: int = 1
+    captured_at: Optional[str] = None
+    expected: List[dict] = []
+
+    @property
+    def meta_path(self) -> Path:
+        return self.html_path.with_suffix('.json')
+
+    def read_html(self) -> str:
+        return self.html_path.read_text(encoding='utf-8', errors='replace')
+
+    def save_meta(self):
+        meta = {
+            'source': self.source,
+            'deal_type': self.deal_type,
+            'page': self.page,
+            'captured_at': self.captured_at,
+            'expected': self.expected,
+        }
+        self.meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding='utf-8')
+
+
+def ads_to_dicts(ads: List[Ad]) -> List[dict]:
+    return [ad.model_dump() for ad in ads]
+
+
+def load_fixtures(directory: Path = FIXTURES_DIR, pattern: str = '*') -> List[Fixture]:
+    fixtures: List[Fixture] = []
+    for meta_path in sorted(directory.glob(f'{pattern}.json')):
+        html_path = meta_path.with_suffix('.html')
+        if not html_path.exists():
+            logger.warning('Фикстура %s без HTML, пропускаем', meta_path.name)
+            continue
+        try:
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning('Фикстура %s: не удалось прочитать метаданные: %s', meta_path.name, e)
+            continue
+        fixtures.append(Fixture(
+            name=meta_path.stem,
+            html_path=html_path,
+            source=meta.get('source', 'cian'),
+            deal_type=meta.get('deal_type', 'sale'),
+            page=int(meta.get('page', 1)),
+            captured_at=meta.get('captured_at'),
+            expected=meta.get('expected') or [],
+        ))
+    return fixtures
+
+
+def save_fixture(html: str, source: str, deal_type: str, page: int, ads: List[Ad],
+                 directory: Path = FIXTURES_DIR) -> Fixture:
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now()
+    name = f"{source}_{deal_type}_p{page}_{now.strftime('%Y%m%d_%H%M%S')}"
+    fixture = Fixture(
+        name=name,
+        html_path=directory / f'{name}.html',
+        source=source,
+        deal_type=deal_type,
+        page=page,
+        captured_at=now.isoformat(timespec='seconds'),
+        expected=ads_to_dicts(ads),
+    )
+    fixture.html_path.write_text(html, encoding='utf-8')
+    fixture.save_meta()
+    _rotate(directory)
+    return fixture
+
+
+def _rotate(directory: Path):
+    metas = sorted(directory.glob('*.json'), key=lambda p: p.stat().st_mtime)
+    for meta_path in metas[:-FIXTURE_KEEP]:
+        meta_path.with_suffix('.html').unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
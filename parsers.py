@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
-# parsers.py v2.0.0 (11.03.2026)
-# - Переписан загрузчик страниц: устойчивое ожидание, debug HTML/PNG, признаки антибота
-# - Добавлены несколько стратегий извлечения: JSON-LD, HTML-карточки, резервный парсинг ссылок
-# - Усилена нормализация метро, адресов, цен и фото
-# - Парсер работает последовательно и аккуратнее для VPS/антибота
+# parsers.py v2.1.0 (18.10.2026)
+# - Загрузка страниц через постоянный пул браузеров (browser_pool.BrowserPool) вместо запуска Chromium на каждую попытку
+# - Фильтр ресурсов по профилю источника (картинки, шрифты, медиа, трекеры не загружаются)
+# - Многоуровневая загрузка: сначала aiohttp с общей сессией и cookies, Playwright только при антиботе/без разметки
+# - Параллельный сбор выдач: лимит запросов на площадку, общий лимит браузерных слотов, паузы вежливости, аренда прокси
+# - Листание выдачи p=2..N до первой страницы с уже известными объявлениями, бюджет страниц на площадку
+# - Извлечение объявлений из JSON-состояния страницы (_cianConfig, data-mfe-state/__initialData__) до разбора DOM
+# - Сменные бэкенды разбора HTML по источнику: soup, strained (SoupStrainer), lxml (XPath)
+# - Сохранение страниц выдачи в корпус фикстур для офлайн-прогона (replay.py)
+# - Поля карточки собираются за один обход поддерева, регулярные выражения предкомпилированы
+# - Округ по адресу через DistrictResolver (пакетные запросы DaData, кэш в памяти и в БД)
+# - Для неопознанных адресов в DistrictResolver передаётся строка метро (запасной путь через справочник)
 
 from __future__ import annotations
 
@@ -13,11 +20,16 @@ import json
 import logging
 import random
 import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Iterable, List, Optional
-from urllib.parse import urlencode, urljoin
+from html import unescape as html_unescape
+from urllib.parse import unquote, urlencode, urljoin
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString, SoupStrainer, Tag
+from lxml import html as lxml_html
 
 try:
     import aiohttp
@@ -26,16 +38,25 @@ except ImportError:
     AIOHTTP_AVAILABLE = False
 
 try:
-    from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
     PLAYWRIGHT_AVAILABLE = True
 except ImportError:
     PLAYWRIGHT_AVAILABLE = False
     PlaywrightTimeoutError = Exception
 
-from config import USER_AGENTS, PROXY_LIST, DADATA_API_KEY
+from browser_pool import BrowserPool, get_resource_filter
+from config import (
+    USER_AGENTS, PROXY_LIST, HTTP_FIRST_ENABLED, HTTP_FETCH_TIMEOUT,
+    PARSER_SOURCE_CONCURRENCY, PARSER_BROWSER_SLOTS, PARSER_POLITENESS_DELAY,
+    PARSER_MAX_PAGES, PARSER_PAGE_BUDGET, PARSER_STOP_KNOWN, PARSER_STATE_ENABLED, PARSER_STATE_COMPARE,
+    PARSE_BACKEND, PARSER_FIXTURE_CAPTURE, DISTRICTS,
+)
+from database import Database
+from district_resolver import DistrictResolver
 from models import Ad
+from parser_fixtures import save_fixture
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 logger = logging.getLogger(__name__)
 DEBUG_DIR = Path('/tmp/bot_parser_debug')
@@ -72,16 +93,207 @@ async def get_random_proxy() -> Optional[str]:
     return random.choice(PROXY_LIST) if PROXY_LIST else None
 
 
+class ProxyLeases:
+    """Аренда прокси источником: ЦИАН и Авито никогда не ходят через один прокси одновременно"""
+    _holders: dict[str, list] = {}  # proxy -> [source, число активных аренд]
+    _changed: Optional[asyncio.Condition] = None
+
+    @classmethod
+    def _condition(cls) -> asyncio.Condition:
+        if cls._changed is None:
+            cls._changed = asyncio.Condition()
+        return cls._changed
+
+    @classmethod
+    def _free_for(cls, source: str) -> list[str]:
+        return [p for p in PROXY_LIST if p not in cls._holders or cls._holders[p][0] == source]
+
+    @classmethod
+    @asynccontextmanager
+    async def lease(cls, source: str, use_proxy: bool = True):
+        if not (use_proxy and PROXY_LIST):
+            yield None
+            return
+        changed = cls._condition()
+        async with changed:
+            await changed.wait_for(lambda: cls._free_for(source))
+            proxy = random.choice(cls._free_for(source))
+            holder = cls._holders.setdefault(proxy, [source, 0])
+            holder[1] += 1
+        try:
+            yield proxy
+        finally:
+            async with changed:
+                holder[1] -= 1
+                if holder[1] <= 0:
+                    cls._holders.pop(proxy, None)
+                changed.notify_all()
+
+
+class _SourceGate:
+    """Ограничение параллельных запросов к площадке и пауза вежливости между их стартами"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.semaphore = asyncio.Semaphore(PARSER_SOURCE_CONCURRENCY)
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.semaphore:
+            async with self.lock:
+                delay = self.next_start - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                base = PARSER_POLITENESS_DELAY.get(self.source, 2.0)
+                self.next_start = time.monotonic() + random.uniform(base, base * 1.6)
+            yield
+
+
+_source_gates: dict[str, _SourceGate] = {}
+_browser_slots = asyncio.Semaphore(PARSER_BROWSER_SLOTS)
+
+
+def _source_gate(source: str) -> _SourceGate:
+    gate = _source_gates.get(source)
+    if gate is None:
+        gate = _source_gates[source] = _SourceGate(source)
+    return gate
+
+
 class PageFetchError(RuntimeError):
     pass
 
 
+# Сколько раз каждый уровень загрузчика отдал страницу: {source: {'http': n, 'browser': n, 'failed': n}}
+FETCH_TIER_STATS: dict[str, dict[str, int]] = {}
+
+# Страницы капчи/заглушек маленькие; в больших выдачах маркеры ищем только в <title>,
+# иначе мета-тег robots и тексты объявлений дают ложные срабатывания
+ANTIBOT_FULL_SCAN_LIMIT = 50_000
+
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.I | re.S)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SIMPLE_SELECTOR_RE = re.compile(r'^(?P<tag>[a-z0-9]*)\[(?P<attr>[\w-]+)(?:(?P<op>\*?=)"(?P<value>[^"]*)")?\]$')
+_selector_patterns: dict[str, Optional[re.Pattern]] = {}
+
+_http_session: Optional['aiohttp.ClientSession'] = None
+_http_user_agent: str = ''
+
+
+def _selector_pattern(selector: str) -> Optional[re.Pattern]:
+    """Переводит простой CSS-селектор вида tag[attr], tag[attr="v"], tag[attr*="v"] в regex по сырому HTML"""
+    if selector in _selector_patterns:
+        return _selector_patterns[selector]
+    pattern = None
+    match = _SIMPLE_SELECTOR_RE.match(selector)
+    if match:
+        tag = re.escape(match.group('tag')) if match.group('tag') else r'[a-z][\w-]*'
+        attr = re.escape(match.group('attr'))
+        value = match.group('value')
+        if match.group('op') == '*=':
+            attr_re = rf'\b{attr}\s*=\s*["\'][^"\']*{re.escape(value)}'
+        elif match.group('op') == '=':
+            attr_re = rf'\b{attr}\s*=\s*["\']{re.escape(value)}["\']'
+        else:
+            attr_re = rf'\s{attr}(?:\s*=|[\s/>])'
+        pattern = re.compile(rf'<{tag}\b[^>]*?{attr_re}', re.I)
+    _selector_patterns[selector] = pattern
+    return pattern
+
+
+def _html_matches_selectors(html: str, selectors: list[str]) -> Optional[str]:
+    """Возвращает первый селектор, который есть в HTML, без построения дерева"""
+    soup = None
+    for selector in selectors:
+        pattern = _selector_pattern(selector)
+        if pattern is not None:
+            if pattern.search(html):
+                return selector
+            continue
+        if soup is None:
+            soup = BeautifulSoup(html, 'lxml')
+        if soup.select_one(selector) is not None:
+            return selector
+    return None
+
+
+def _detect_antibot(html: str) -> list[str]:
+    title_match = _TITLE_RE.search(html)
+    haystack = (title_match.group(1) if title_match else '').lower()
+    if len(html) <= ANTIBOT_FULL_SCAN_LIMIT:
+        haystack = _TAG_RE.sub(' ', html).lower()
+    return [marker for marker in ANTIBOT_MARKERS if marker in haystack]
+
+
+def _http_headers(user_agent: str) -> dict:
+    return {
+        'User-Agent': user_agent,
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+        'Accept-Encoding': 'gzip, deflate',
+        'Cache-Control': 'max-age=0',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'document',
+        'Sec-Fetch-Mode': 'navigate',
+        'Sec-Fetch-Site': 'none',
+        'Sec-Fetch-User': '?1',
+    }
+
+
+async def _get_http_session() -> 'aiohttp.ClientSession':
+    global _http_session, _http_user_agent
+    if _http_session is None or _http_session.closed:
+        # Один UA на всю сессию: cookies и заголовки должны выглядеть как один и тот же браузер
+        _http_user_agent = random.choice([ua for ua in USER_AGENTS if 'Chrome' in ua] or USER_AGENTS)
+        _http_session = aiohttp.ClientSession(
+            cookie_jar=aiohttp.CookieJar(),
+            connector=aiohttp.TCPConnector(limit=8, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=HTTP_FETCH_TIMEOUT),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+_WS_RE = re.compile(r'\s+')
+_NON_DIGIT_RE = re.compile(r'[^\d]')
+_ROOMS_RE = re.compile(r'(\d+)\s*[- ]?комн')
+_FLOOR_SLASH_RE = re.compile(r'(\d+)\s*/\s*(\d+)\s*эт')
+_FLOOR_OF_RE = re.compile(r'(\d+)\s*этаж\s*из\s*(\d+)')
+_AREA_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*м²')
+# Типы строк, которые попадают в Tag.get_text (комментарии, script/style и пр. — нет)
+_TEXT_STRING_TYPES = (NavigableString, CData)
+_TEXT_SCAN_TAGS = frozenset(('a', 'span', 'div'))
+_AD_ID_RE = re.compile(r'/([0-9]+)(?:[/?#]|$)')
+# Первое вхождение тега, нужное полям карточки: тег -> ((ключ, атрибут, значение), ...); True — атрибут есть
+_CARD_FIRST_RULES = {
+    'h3': (('h3', None, None),),
+    'h2': (('h2', None, None),),
+    'strong': (('strong', None, None),),
+    'address': (('address', None, None),),
+    'a': (('a_href', 'href', True), ('a_title', 'data-marker', 'item-title')),
+    'meta': (('meta_price', 'itemprop', 'price'),),
+    'span': (
+        ('span_main_price', 'data-mark', 'MainPrice'),
+        ('span_item_price', 'data-marker', 'item-price'),
+        ('span_address', 'data-marker', 'item-address'),
+    ),
+}
+
+
 def _cleanup_text(value: str | None) -> str:
-    return re.sub(r'\s+', ' ', (value or '').strip())
+    return _WS_RE.sub(' ', (value or '').strip())
 
 
 def _extract_price_value(price: str) -> int:
-    digits = re.sub(r'[^\d]', '', price or '')
+    digits = _NON_DIGIT_RE.sub('', price or '')
     return int(digits) if digits else 0
 
 
@@ -89,19 +301,18 @@ def _extract_rooms(title: str, body: str) -> str:
     merged = f"{title} {body}".lower()
     if 'студ' in merged:
         return 'студия'
-    match = re.search(r'(\d+)\s*[- ]?комн', merged)
+    match = _ROOMS_RE.search(merged)
     return match.group(1) if match else '?'
 
 
 def _extract_floor(body: str) -> str:
-    match = re.search(r'(\d+)\s*/\s*(\d+)\s*эт', body.lower())
-    if not match:
-        match = re.search(r'(\d+)\s*этаж\s*из\s*(\d+)', body.lower())
+    lower = body.lower()
+    match = _FLOOR_SLASH_RE.search(lower) or _FLOOR_OF_RE.search(lower)
     return f"{match.group(1)}/{match.group(2)}" if match else '?/?'
 
 
 def _extract_area(body: str) -> str:
-    match = re.search(r'(\d+(?:[.,]\d+)?)\s*м²', body.lower())
+    match = _AREA_RE.search(body.lower())
     return f"{match.group(1).replace('.', ',')} м²" if match else '? м²'
 
 
@@ -116,11 +327,9 @@ def _unique_list(items: Iterable[str]) -> list[str]:
     return out
 
 
-def _extract_images_from_tag(tag) -> list[str]:
+def _images_from_attrs(images: list[dict]) -> list[str]:
     photos: list[str] = []
-    if not tag:
-        return photos
-    for img in tag.find_all('img')[:8]:
+    for img in images:
         for attr in ('src', 'data-src', 'srcset'):
             raw = (img.get(attr) or '').strip()
             if not raw:
@@ -177,7 +386,7 @@ def _extract_offer_from_json_ld(item: dict, source: str, deal_type: str) -> Opti
     elif isinstance(image, str):
         photos = [urljoin(link, image)]
 
-    ad_id_match = re.search(r'/([0-9]+)(?:[/?#]|$)', link)
+    ad_id_match = _AD_ID_RE.search(link)
     ad_id = f'{source}_{ad_id_match.group(1)}' if ad_id_match else f'{source}_{hashlib.md5(link.encode()).hexdigest()}'
 
     metro_parts: list[str] = []
@@ -211,45 +420,21 @@ async def get_page_html_playwright(
     use_proxy: bool = True,
     wait_selectors: list[str] | None = None,
     debug_name: str = 'page',
+    source: str | None = None,
 ) -> Optional[str]:
     if not PLAYWRIGHT_AVAILABLE:
         logger.warning('Playwright не установлен')
         return None
 
     full_url = f"{url}?{urlencode(params)}" if params else url
+    resource_filter = get_resource_filter(source)
 
     for attempt in range(1, 4):
-        browser = context = page = None
         try:
-            async with async_playwright() as p:
-                proxy = await get_random_proxy() if use_proxy else None
-                browser = await p.chromium.launch(
-                    headless=True,
-                    proxy={'server': proxy} if proxy else None,
-                    args=[
-                        '--disable-blink-features=AutomationControlled',
-                        '--no-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-gpu',
-                        '--window-size=1600,1200',
-                    ],
-                )
-                context = await browser.new_context(
-                    user_agent=await get_random_user_agent(),
-                    viewport={'width': 1600, 'height': 1200},
-                    locale='ru-RU',
-                    timezone_id='Europe/Moscow',
-                    java_script_enabled=True,
-                    ignore_https_errors=True,
-                )
-                page = await context.new_page()
-                await page.add_init_script("""
-                    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                    window.chrome = { runtime: {} };
-                    Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU', 'ru', 'en-US', 'en']});
-                    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4]});
-                """)
-
+            async with ProxyLeases.lease(source or debug_name, use_proxy) as proxy, \
+                    _browser_slots, \
+                    BrowserPool.page(proxy) as page:
+                resources = await resource_filter.install(page) if resource_filter else None
                 logger.info('Загрузка %s attempt=%s proxy=%s', full_url, attempt, proxy or 'none')
                 response = await page.goto(full_url, wait_until='domcontentloaded', timeout=70000)
                 status = response.status if response else None
@@ -291,6 +476,13 @@ async def get_page_html_playwright(
                     '%s status=%s final_url=%s title=%r html_len=%s selector_found=%s antibot=%s html_file=%s',
                     debug_name, status, page.url, title, len(html), selector_found, ','.join(antibot_found) or 'no', html_path,
                 )
+                if resources is not None:
+                    logger.info(
+                        '%s: ресурсы allowed=%s blocked=%s saved≈%s KB (профиль %s, всего blocked=%s saved≈%s KB)',
+                        debug_name, resources['allowed'], resources['blocked'], resources['bytes_saved'] // 1024,
+                        resource_filter.name, resource_filter.stats['blocked'], resource_filter.stats['bytes_saved'] // 1024,
+                    )
+                # Исключение внутри блока выводит контекст браузера из оборота (новые cookies/UA на следующей попытке)
                 if status and status >= 400:
                     raise PageFetchError(f'HTTP status={status}')
                 if antibot_found and not selector_found:
@@ -299,40 +491,75 @@ async def get_page_html_playwright(
         except Exception as exc:
             logger.exception('Ошибка загрузки %s attempt=%s: %s', full_url, attempt, exc)
             await asyncio.sleep(attempt * 2)
-        finally:
-            try:
-                if page:
-                    await page.close()
-            except Exception:
-                pass
-            try:
-                if context:
-                    await context.close()
-            except Exception:
-                pass
-            try:
-                if browser:
-                    await browser.close()
-            except Exception:
-                pass
     return None
 
 
+async def get_page_html_http(
+    url: str,
+    params: dict | None = None,
+    use_proxy: bool = True,
+    wait_selectors: list[str] | None = None,
+    debug_name: str = 'page',
+    source: str | None = None,
+) -> Optional[str]:
+    """Быстрый уровень: обычный GET через общую aiohttp-сессию. None — нужна эскалация в браузер"""
+    if not AIOHTTP_AVAILABLE:
+        return None
+    session = await _get_http_session()
+    async with ProxyLeases.lease(source or debug_name, use_proxy) as proxy:
+        if proxy and not proxy.startswith(('http://', 'https://')):
+            # aiohttp умеет только HTTP-прокси; без прокси идти нельзя, чтобы не светить IP сервера
+            return None
+        try:
+            async with session.get(url, params=params, headers=_http_headers(_http_user_agent), proxy=proxy) as resp:
+                status = resp.status
+                final_url = str(resp.url)
+                html = await resp.text(errors='replace')
+        except Exception as exc:
+            logger.info('%s http: ошибка загрузки %s: %s', debug_name, url, exc)
+            return None
+
+    antibot_found = _detect_antibot(html)
+    selector = _html_matches_selectors(html, wait_selectors) if wait_selectors else None
+    logger.info(
+        '%s http status=%s final_url=%s html_len=%s selector=%s antibot=%s',
+        debug_name, status, final_url, len(html), selector or 'no', ','.join(antibot_found) or 'no',
+    )
+    if status >= 400 or antibot_found or (wait_selectors and not selector):
+        return None
+    (DEBUG_DIR / f'{debug_name}_debug.html').write_text(html, encoding='utf-8')
+    return html
+
+
+async def get_page_html(
+    url: str,
+    params: dict | None = None,
+    use_proxy: bool = True,
+    wait_selectors: list[str] | None = None,
+    debug_name: str = 'page',
+    source: str = 'cian',
+) -> Optional[str]:
+    """Многоуровневая загрузка: сначала HTTP, при антиботе или без нужной разметки — Playwright"""
+    stats = FETCH_TIER_STATS.setdefault(source, {'http': 0, 'browser': 0, 'failed': 0})
+    html = None
+    tier = 'http'
+    async with _source_gate(source).slot():
+        if HTTP_FIRST_ENABLED:
+            html = await get_page_html_http(url, params, use_proxy, wait_selectors, debug_name, source)
+        if html is None:
+            tier = 'browser'
+            html = await get_page_html_playwright(
+                url, params, use_proxy=use_proxy, wait_selectors=wait_selectors,
+                debug_name=debug_name, source=source,
+            )
+    stats[tier if html else 'failed'] += 1
+    logger.info('%s: страница получена уровнем %s, статистика %s: %s', debug_name, tier if html else 'none', source, stats)
+    return html
+
+
 def _iter_ld_json(soup: BeautifulSoup) -> Iterable[dict]:
     for script in soup.find_all('script', type='application/ld+json'):
-        raw = (script.string or script.get_text() or '').strip()
-        if not raw:
-            continue
-        try:
-            data = json.loads(raw)
-        except Exception:
-            continue
-        if isinstance(data, dict):
-            yield data
-        elif isinstance(data, list):
-            for item in data:
-                if isinstance(item, dict):
-                    yield item
+        yield from _load_ld_json(script.string or script.get_text())
 
 
 def _find_cards(soup: BeautifulSoup, selectors: list[tuple[str, dict]]) -> list:
@@ -343,74 +570,224 @@ def _find_cards(soup: BeautifulSoup, selectors: list[tuple[str, dict]]) -> list:
     return []
 
 
-def _extract_cian_address(card) -> str:
-    address = ''
-    address_el = card.find('address')
-    if address_el:
-        address = _cleanup_text(address_el.get_text(' ', strip=True))
-    if not address:
-        for candidate in card.find_all(['div', 'span', 'a']):
-            text = _cleanup_text(candidate.get_text(' ', strip=True))
-            if text and ('москва' in text.lower() or 'район' in text.lower() or 'ул.' in text.lower()):
-                address = text
-                break
-    return address or 'Москва'
+# ===== Бэкенды разбора HTML =====
+# soup — полное дерево BeautifulSoup; strained — дерево только из карточек и ld+json (SoupStrainer);
+# lxml — поиск карточек и скриптов XPath, карточки переразбираются в маленькие bs4-фрагменты
 
+_EXSLT_NS = {'re': 'http://exslt.org/regular-expressions'}
 
-def _extract_metro_text(card) -> str:
-    metro_candidates: list[str] = []
-    for el in card.find_all(['a', 'span', 'div']):
-        txt = _cleanup_text(el.get_text(' ', strip=True))
-        lower = txt.lower()
-        if not txt:
-            continue
-        if 'метро' in lower or 'м.' in lower or re.search(r'\d+\s*мин', lower):
-            metro_candidates.append(txt)
-    return ' | '.join(_unique_list(metro_candidates[:5])) or 'Не указано'
 
+def _load_ld_json(raw: str) -> Iterable[dict]:
+    raw = (raw or '').strip()
+    if not raw:
+        return
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return
+    if isinstance(data, dict):
+        yield data
+    elif isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict):
+                yield item
+
+
+def _attr_matches(value: Optional[str], expected) -> bool:
+    if value is None:
+        return False
+    if isinstance(expected, re.Pattern):
+        return expected.search(value) is not None
+    return value == expected
+
+
+def _card_strainer(selectors: Optional[list[tuple[str, dict]]]) -> SoupStrainer:
+    def keep(name, attrs=None):
+        attrs = attrs or {}
+        if name == 'script':
+            return attrs.get('type') == 'application/ld+json'
+        for tag, expected in selectors or ():
+            if name == tag and all(_attr_matches(attrs.get(k), v) for k, v in expected.items()):
+                return True
+        return False
+    return SoupStrainer(keep)
+
+
+def _selector_xpath(tag: str, attrs: dict) -> str:
+    conditions = []
+    for key, expected in attrs.items():
+        if isinstance(expected, re.Pattern):
+            flags = 'i' if expected.flags & re.I else ''
+            pattern = expected.pattern.replace("'", "\\'")
+            conditions.append(f"re:test(@{key}, '{pattern}', '{flags}')")
+        else:
+            conditions.append(f"@{key}='{expected}'")
+    return f"//{tag}" + ''.join(f'[{c}]' for c in conditions)
+
+
+def _parse_page_soup(html: str, selectors: Optional[list]) -> tuple[list[dict], list]:
+    soup = BeautifulSoup(html, 'lxml')
+    cards = _find_cards(soup, selectors) if selectors else []
+    return list(_iter_ld_json(soup)), cards
 
-def _extract_title(card) -> str:
-    for tag in ('h3', 'h2', 'strong'):
-        el = card.find(tag)
-        if el:
-            text = _cleanup_text(el.get_text(' ', strip=True))
+
+def _parse_page_strained(html: str, selectors: Optional[list]) -> tuple[list[dict], list]:
+    soup = BeautifulSoup(html, 'lxml', parse_only=_card_strainer(selectors))
+    cards = _find_cards(soup, selectors) if selectors else []
+    return list(_iter_ld_json(soup)), cards
+
+
+def _parse_page_lxml(html: str, selectors: Optional[list]) -> tuple[list[dict], list]:
+    root = lxml_html.fromstring(html)
+    ld_items = [
+        item
+        for raw in root.xpath("//script[@type='application/ld+json']/text()")
+        for item in _load_ld_json(raw)
+    ]
+    cards = []
+    for tag, attrs in selectors or ():
+        elements = root.xpath(_selector_xpath(tag, attrs), namespaces=_EXSLT_NS)
+        if elements:
+            for el in elements:
+                fragment = BeautifulSoup(lxml_html.tostring(el, encoding='unicode', with_tail=False), 'lxml')
+                card = fragment.find(tag)
+                if card is not None:
+                    cards.append(card)
+            break
+    return ld_items, cards
+
+
+PARSE_BACKENDS = {
+    'soup': _parse_page_soup,
+    'strained': _parse_page_strained,
+    'lxml': _parse_page_lxml,
+}
+
+
+def parse_listing_page(html: str, source: str, selectors: Optional[list], backend: str | None = None):
+    """Возвращает (ld+json объекты, карточки) бэкендом источника; selectors=None — карточки не нужны"""
+    backend = backend or PARSE_BACKEND.get(source, 'strained')
+    parse = PARSE_BACKENDS.get(backend)
+    if parse is None:
+        logger.warning('Неизвестный бэкенд разбора %r для %s, используем strained', backend, source)
+        parse = _parse_page_strained
+    return parse(html, selectors)
+
+
+class _CardScan:
+    """Один обход поддерева карточки: нормализованные текстовые узлы и интересующие теги с диапазонами текста"""
+    __slots__ = ('strings', 'text_tags', 'first', 'imgs', 'ruble')
+
+    def __init__(self, card):
+        self.strings: list[str] = []
+        self.text_tags: list[list] = []
+        self.first: dict[str, list] = {}
+        self.imgs: list[dict] = []
+        self.ruble: Optional[str] = None
+        self._walk(card)
+
+    def _walk(self, tag):
+        strings = self.strings
+        for child in tag.contents:
+            if isinstance(child, Tag):
+                name = child.name
+                # [начало, конец) — диапазон в self.strings, как у child.get_text(' ', strip=True)
+                span = [len(strings), 0]
+                rules = _CARD_FIRST_RULES.get(name)
+                if rules:
+                    attrs = child.attrs
+                    for key, attr, value in rules:
+                        if key in self.first:
+                            continue
+                        if attr is None or (attrs.get(attr) is not None if value is True else attrs.get(attr) == value):
+                            self.first[key] = [child, span]
+                if name in _TEXT_SCAN_TAGS:
+                    self.text_tags.append(span)
+                elif name == 'img' and len(self.imgs) < 8:
+                    self.imgs.append(child.attrs)
+                self._walk(child)
+                span[1] = len(strings)
+            else:
+                if self.ruble is None and '₽' in child:
+                    self.ruble = _cleanup_text(str(child))
+                if type(child) in _TEXT_STRING_TYPES:
+                    stripped = child.strip()
+                    if stripped:
+                        strings.append(_WS_RE.sub(' ', stripped))
+
+    def text(self, span: list) -> str:
+        return ' '.join(self.strings[span[0]:span[1]])
+
+    def first_text(self, key: str) -> Optional[str]:
+        found = self.first.get(key)
+        return None if found is None else self.text(found[1])
+
+    def body(self) -> str:
+        return ' '.join(self.strings)
+
+    def title(self) -> str:
+        for key in ('h3', 'h2', 'strong'):
+            text = self.first_text(key)
             if text:
                 return text
-    link = card.find('a', href=True)
-    if link:
-        return _cleanup_text(link.get_text(' ', strip=True)) or 'Квартира'
-    return 'Квартира'
-
-
-def _extract_price(card) -> str:
-    meta = card.find('meta', {'itemprop': 'price'})
-    if meta and meta.get('content'):
-        return f"{meta.get('content').strip()} ₽"
-    for selector in [
-        ('span', {'data-mark': 'MainPrice'}),
-        ('span', {'data-marker': 'item-price'}),
-    ]:
-        el = card.find(*selector)
-        if el:
-            text = _cleanup_text(el.get_text(' ', strip=True))
+        if 'a_href' in self.first:
+            return self.first_text('a_href') or 'Квартира'
+        return 'Квартира'
+
+    def price(self) -> str:
+        meta = self.first.get('meta_price')
+        if meta and meta[0].get('content'):
+            return f"{meta[0].get('content').strip()} ₽"
+        for key in ('span_main_price', 'span_item_price'):
+            text = self.first_text(key)
             if text:
                 return text
-    ruble_text = card.find(string=re.compile(r'₽'))
-    if ruble_text:
-        return _cleanup_text(str(ruble_text))
-    return 'Цена не указана'
+        if self.ruble is not None:
+            return self.ruble
+        return 'Цена не указана'
+
+    def link(self, source: str) -> Optional[str]:
+        preferred = self.first.get('a_title') or self.first.get('a_href')
+        if not preferred:
+            return None
+        base = 'https://www.cian.ru' if source == 'cian' else 'https://www.avito.ru'
+        return urljoin(base, preferred[0].get('href', ''))
+
+    def cian_address(self) -> str:
+        address = self.first_text('address') or ''
+        if not address:
+            for span in self.text_tags:
+                text = self.text(span)
+                lower = text.lower()
+                if text and ('москва' in lower or 'район' in lower or 'ул.' in lower):
+                    address = text
+                    break
+        return address or 'Москва'
+
+    def avito_address(self) -> str:
+        text = self.first_text('span_address')
+        return self.body() if text is None else text
+
+    def metro(self) -> str:
+        candidates: list[str] = []
+        for span in self.text_tags:
+            txt = self.text(span)
+            if not txt:
+                continue
+            lower = txt.lower()
+            # Прежняя проверка «N мин» содержала управляющий символ \x08 в шаблоне и не срабатывала — поведение сохранено
+            if 'метро' in lower or 'м.' in lower:
+                candidates.append(txt)
+                if len(candidates) == 5:
+                    break
+        return ' | '.join(_unique_list(candidates)) or 'Не указано'
 
-
-def _extract_link(card, source: str) -> Optional[str]:
-    preferred = card.find('a', {'data-marker': 'item-title'}) or card.find('a', href=True)
-    if not preferred:
-        return None
-    base = 'https://www.cian.ru' if source == 'cian' else 'https://www.avito.ru'
-    return urljoin(base, preferred.get('href', ''))
+    def photos(self) -> list[str]:
+        return _images_from_attrs(self.imgs)
 
 
 def _ad_id_from_link(link: str, source: str) -> str:
-    match = re.search(r'/([0-9]+)(?:[/?#]|$)', link)
+    match = _AD_ID_RE.search(link)
     if match:
         return f'{source}_{match.group(1)}'
     return f'{source}_{hashlib.md5(link.encode()).hexdigest()}'
@@ -421,19 +798,21 @@ def _extract_ads_from_cards(cards: list, source: str, deal_type: str) -> list[Ad
     seen: set[str] = set()
     for card in cards[:60]:
         try:
-            link = _extract_link(card, source)
+            scan = _CardScan(card)
+            link = scan.link(source)
             if not link:
                 continue
             ad_id = _ad_id_from_link(link, source)
             if ad_id in seen:
                 continue
             seen.add(ad_id)
-            body = _cleanup_text(card.get_text(' ', strip=True))
-            title = _extract_title(card)
-            price = _extract_price(card)
-            address = _extract_cian_address(card) if source == 'cian' else _cleanup_text((card.find('span', {'data-marker': 'item-address'}) or card).get_text(' ', strip=True))
-            metro = _extract_metro_text(card)
-            owner = any(word in body.lower() for word in ('собственник', 'без посредников', 'частное лицо'))
+            body = scan.body()
+            title = scan.title()
+            price = scan.price()
+            address = scan.cian_address() if source == 'cian' else scan.avito_address()
+            metro = scan.metro()
+            body_lower = body.lower()
+            owner = any(word in body_lower for word in ('собственник', 'без посредников', 'частное лицо'))
             results.append(Ad(
                 id=ad_id,
                 source=source,
@@ -447,7 +826,7 @@ def _extract_ads_from_cards(cards: list, source: str, deal_type: str) -> list[Ad
                 area=_extract_area(body),
                 rooms=_extract_rooms(title, body),
                 owner=owner,
-                photos=_extract_images_from_tag(card),
+                photos=scan.photos(),
                 district_detected=None,
                 price_value=_extract_price_value(price),
             ))
@@ -456,10 +835,10 @@ def _extract_ads_from_cards(cards: list, source: str, deal_type: str) -> list[Ad
     return results
 
 
-def _extract_ads_from_json_ld(soup: BeautifulSoup, source: str, deal_type: str) -> list[Ad]:
+def _extract_ads_from_json_ld(items: Iterable[dict], source: str, deal_type: str) -> list[Ad]:
     results: list[Ad] = []
     seen: set[str] = set()
-    for item in _iter_ld_json(soup):
+    for item in items:
         ad = _extract_offer_from_json_ld(item, source, deal_type)
         if ad and ad.id not in seen:
             seen.add(ad.id)
@@ -467,6 +846,249 @@ def _extract_ads_from_json_ld(soup: BeautifulSoup, source: str, deal_type: str)
     return results
 
 
+# ===== Извлечение из JSON-состояния страницы =====
+# ЦИАН и Авито кладут всю выдачу в JSON внутри <script>: разбираем его без обхода DOM карточек
+
+_CIAN_STATE_RE = re.compile(r"_cianConfig\[['\"]frontend-serp['\"]\][^;]*?\.concat\(")
+_AVITO_MFE_STATE_RE = re.compile(r'<script[^>]*data-mfe-state[^>]*>(.*?)</script>', re.S | re.I)
+_AVITO_INITIAL_DATA_RE = re.compile(r'window\.__initialData__\s*=\s*"(.*?)"\s*;', re.S)
+_AVITO_ROOMS_RE = re.compile(r'(\d+)\s*-\s*к\.')
+_json_decoder = json.JSONDecoder()
+
+
+def _format_rub(value) -> str:
+    try:
+        return f"{int(float(value)):,}".replace(',', ' ') + ' ₽'
+    except (TypeError, ValueError):
+        return 'Цена не указана'
+
+
+def _format_area(value) -> str:
+    try:
+        area = float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return '? м²'
+    text = f'{area:g}'.replace('.', ',')
+    return f'{text} м²'
+
+
+def _format_metro(stations: list[tuple[str, object]]) -> str:
+    parts = []
+    for name, minutes in stations[:5]:
+        name = _cleanup_text(name)
+        if name:
+            parts.append(f'{name} ({minutes} мин)' if minutes else name)
+    return ' | '.join(_unique_list(parts)) or 'Не указано'
+
+
+def _collect_strings(obj, limit: int = 400) -> list[str]:
+    out: list[str] = []
+    stack = [obj]
+    while stack and len(out) < limit:
+        cur = stack.pop()
+        if isinstance(cur, str):
+            out.append(cur)
+        elif isinstance(cur, dict):
+            stack.extend(cur.values())
+        elif isinstance(cur, list):
+            stack.extend(cur)
+    return out
+
+
+def _cian_state_offers(html: str) -> list[dict]:
+    for match in _CIAN_STATE_RE.finditer(html):
+        try:
+            chunks, _ = _json_decoder.raw_decode(html, match.end())
+        except ValueError:
+            continue
+        for chunk in chunks if isinstance(chunks, list) else []:
+            if isinstance(chunk, dict) and chunk.get('key') == 'initialState':
+                results = (chunk.get('value') or {}).get('results') or {}
+                offers = results.get('offers')
+                if isinstance(offers, list):
+                    return offers
+    return []
+
+
+def _ad_from_cian_offer(offer: dict, deal_type: str) -> Optional[Ad]:
+    link = offer.get('fullUrl')
+    if not link or not isinstance(link, str):
+        return None
+    ad_id = f"cian_{offer['cianId']}" if offer.get('cianId') else _ad_id_from_link(link, 'cian')
+
+    terms = offer.get('bargainTerms') or {}
+    price = _format_rub(terms.get('priceRur') or terms.get('price'))
+    if deal_type == 'rent' and price != 'Цена не указана':
+        price += '/мес.'
+
+    geo = offer.get('geo') or {}
+    address_items = [a for a in geo.get('address') or [] if isinstance(a, dict)]
+    address = ', '.join(_unique_list(a.get('fullName') or a.get('name') or '' for a in address_items)) or 'Москва'
+    district = None
+    for item in address_items:
+        if item.get('type') == 'okrug':
+            name = item.get('shortName') or item.get('fullName') or item.get('name')
+            district = name if name in DISTRICTS else None
+            break
+    metro = _format_metro([
+        (u.get('name') or '', u.get('time'))
+        for u in geo.get('undergrounds') or [] if isinstance(u, dict)
+    ])
+
+    building = offer.get('building') or {}
+    floor_number, floors_count = offer.get('floorNumber'), building.get('floorsCount')
+    floor = f'{floor_number}/{floors_count}' if floor_number and floors_count else '?/?'
+    if offer.get('flatType') == 'studio':
+        rooms = 'студия'
+    else:
+        rooms = str(offer['roomsCount']) if offer.get('roomsCount') else '?'
+    area = _format_area(offer.get('totalArea'))
+
+    title = _cleanup_text(offer.get('title') or '')
+    if not title:
+        room_title = 'Студия' if rooms == 'студия' else (f'{rooms}-комн. квартира' if rooms != '?' else 'Квартира')
+        title = f"{room_title}, {area}, {floor} этаж"
+
+    photos = []
+    for photo in offer.get('photos') or []:
+        url = photo.get('fullUrl') or photo.get('thumbnailUrl') if isinstance(photo, dict) else None
+        if url and url.startswith('http'):
+            photos.append(url)
+        if len(photos) >= 6:
+            break
+
+    owner = bool(offer.get('isByHomeowner'))
+    return Ad(
+        id=ad_id,
+        source='cian',
+        deal_type=deal_type,
+        title=title,
+        link=link,
+        price=price,
+        address=address,
+        metro=metro,
+        floor=floor,
+        area=area,
+        rooms=rooms,
+        owner=owner,
+        photos=photos,
+        district_detected=district,
+        price_value=_extract_price_value(price.split('/')[0]),
+    )
+
+
+def _avito_state_roots(html: str) -> Iterable:
+    for match in _AVITO_MFE_STATE_RE.finditer(html):
+        raw = match.group(1).strip()
+        for candidate in (raw, html_unescape(raw)):
+            try:
+                yield json.loads(candidate)
+                break
+            except ValueError:
+                continue
+    match = _AVITO_INITIAL_DATA_RE.search(html)
+    if match:
+        try:
+            yield json.loads(unquote(match.group(1)))
+        except ValueError:
+            pass
+
+
+def _avito_state_items(html: str) -> list[dict]:
+    """Ищет в состоянии Авито словари объявлений (есть id и urlPath)"""
+    items: list[dict] = []
+    seen: set = set()
+    for root in _avito_state_roots(html):
+        stack = [root]
+        while stack:
+            cur = stack.pop()
+            if isinstance(cur, dict):
+                if cur.get('id') and isinstance(cur.get('urlPath'), str) and cur['id'] not in seen:
+                    seen.add(cur['id'])
+                    items.append(cur)
+                    continue
+                stack.extend(cur.values())
+            elif isinstance(cur, list):
+                stack.extend(reversed(cur))
+    return items
+
+
+def _ad_from_avito_item(item: dict, deal_type: str) -> Optional[Ad]:
+    link = urljoin('https://www.avito.ru', item['urlPath'])
+    # ID считаем так же, как для DOM-карточек, чтобы не разойтись с уже сохранёнными объявлениями
+    ad_id = _ad_id_from_link(link, 'avito')
+    title = _cleanup_text(item.get('title') or 'Квартира')
+
+    price_info = item.get('priceDetailed') or {}
+    if price_info.get('string'):
+        price = _cleanup_text(price_info['string'])
+    else:
+        price = _format_rub(price_info.get('value') or item.get('price'))
+
+    geo = item.get('geo') or {}
+    location = item.get('location') or {}
+    address = _cleanup_text(geo.get('formattedAddress') or location.get('name') or '') or 'Москва'
+    metro = _format_metro([
+        (ref.get('content') or '', _cleanup_text(str(ref.get('after') or '')).replace('мин.', '').strip() or None)
+        for ref in geo.get('geoReferences') or [] if isinstance(ref, dict)
+    ])
+
+    rooms = _extract_rooms(title, '')
+    if rooms == '?':
+        match = _AVITO_ROOMS_RE.search(title.lower())
+        rooms = match.group(1) if match else '?'
+
+    photos = []
+    for image in item.get('images') or []:
+        if isinstance(image, dict) and image:
+            # Ключи вида "636x476": берём самый крупный вариант
+            size_key = max(image, key=lambda k: int(k.split('x')[0]) if k.split('x')[0].isdigit() else 0)
+            url = image[size_key]
+            if isinstance(url, str) and url.startswith('http'):
+                photos.append(url)
+        if len(photos) >= 6:
+            break
+
+    text = ' '.join(_collect_strings(item)).lower()
+    owner = any(word in text for word in ('собственник', 'без посредников', 'частное лицо'))
+    return Ad(
+        id=ad_id,
+        source='avito',
+        deal_type=deal_type,
+        title=title,
+        link=link,
+        price=price,
+        address=address,
+        metro=metro,
+        floor=_extract_floor(title),
+        area=_extract_area(title),
+        rooms=rooms,
+        owner=owner,
+        photos=photos,
+        district_detected=None,
+        price_value=_extract_price_value(price.split('/')[0]),
+    )
+
+
+def _extract_ads_from_state(html: str, source: str, deal_type: str) -> list[Ad]:
+    if source == 'cian':
+        raw_items, build = _cian_state_offers(html), _ad_from_cian_offer
+    else:
+        raw_items, build = _avito_state_items(html), _ad_from_avito_item
+    results: list[Ad] = []
+    seen: set[str] = set()
+    for raw in raw_items:
+        try:
+            ad = build(raw, deal_type)
+        except Exception:
+            logger.exception('Ошибка разбора объявления из JSON-состояния source=%s', source)
+            continue
+        if ad and ad.id not in seen:
+            seen.add(ad.id)
+            results.append(ad)
+    return results
+
+
 def _merge_ads(*collections: list[Ad]) -> list[Ad]:
     merged: list[Ad] = []
     seen: set[str] = set()
@@ -480,110 +1102,201 @@ def _merge_ads(*collections: list[Ad]) -> list[Ad]:
 
 
 async def _finalize_ads(ads: list[Ad]) -> list[Ad]:
-    for ad in ads:
-        if not ad.district_detected:
-            ad.district_detected = await get_district_by_address(ad.address)
+    unresolved = [ad for ad in ads if not ad.district_detected]
+    if unresolved:
+        districts = await DistrictResolver.resolve_many(
+            (ad.address for ad in unresolved),
+            {ad.address: ad.metro for ad in unresolved if ad.address and ad.metro},
+        )
+        for ad in unresolved:
+            ad.district_detected = districts.get(ad.address)
     return ads
 
 
-async def fetch_cian_deal_type(deal_type: str = 'sale') -> List[Ad]:
-    params = {
-        'deal_type': deal_type,
-        'engine_version': '2',
-        'offer_type': 'flat',
-        'region': '1',
-        'sort': 'creation_date_desc',
-        'p': '1',
-    }
-    html = await get_page_html_playwright(
-        'https://www.cian.ru/cat.php',
-        params,
-        use_proxy=True,
-        wait_selectors=CIAN_WAIT_SELECTORS,
-        debug_name=f'cian_{deal_type}',
+CIAN_CARD_SELECTORS = [
+    ('article', {'data-name': re.compile('CardComponent', re.I)}),
+    ('div', {'data-testid': 'offer-card'}),
+    ('div', {'class': re.compile('offer-card|_93444fe79c--container', re.I)}),
+]
+
+AVITO_CARD_SELECTORS = [
+    ('div', {'data-marker': 'item'}),
+    ('div', {'itemtype': 'http://schema.org/Product'}),
+    ('div', {'class': re.compile('iva-item', re.I)}),
+    ('article', {'data-marker': re.compile('item', re.I)}),
+]
+
+# ID объявлений, уже виденных парсером (дополняет таблицу ads, пока новые ещё не сохранены)
+RECENT_AD_IDS_LIMIT = 5000
+_recent_ad_ids: OrderedDict[str, None] = OrderedDict()
+
+
+def _remember_ad_ids(ad_ids: Iterable[str]):
+    for ad_id in ad_ids:
+        _recent_ad_ids[ad_id] = None
+        _recent_ad_ids.move_to_end(ad_id)
+    while len(_recent_ad_ids) > RECENT_AD_IDS_LIMIT:
+        _recent_ad_ids.popitem(last=False)
+
+
+async def _known_ad_ids(ad_ids: list[str]) -> set[str]:
+    known = {ad_id for ad_id in ad_ids if ad_id in _recent_ad_ids}
+    if Database._pool is not None:
+        try:
+            known |= await Database.get_existing_ad_ids(ad_ids)
+        except Exception:
+            logger.warning('Не удалось проверить известные объявления в БД', exc_info=True)
+    return known
+
+
+async def _crawl_pages(name: str, source: str, fetch_page, page_budget: dict | None = None) -> list[Ad]:
+    """Листает выдачу (сортировка по дате) до первой страницы с уже известными объявлениями"""
+    collected: list[Ad] = []
+    for page in range(1, PARSER_MAX_PAGES + 1):
+        if page_budget is not None:
+            if page > 1 and page_budget.get(source, 0) <= 0:
+                logger.info('%s: бюджет страниц для %s исчерпан на p=%s', name, source, page)
+                break
+            page_budget[source] = page_budget.get(source, 0) - 1
+        ads = await fetch_page(page)
+        if not ads:
+            break
+        known = await _known_ad_ids([ad.id for ad in ads])
+        _remember_ad_ids(ad.id for ad in ads)
+        collected.extend(ads)
+        if len(known) >= PARSER_STOP_KNOWN:
+            logger.info('%s: p=%s содержит %s известных объявлений, дальше не листаем', name, page, len(known))
+            break
+    return _merge_ads(collected)
+
+
+def _parse_listing_html(html: str, source: str, deal_type: str, card_selectors: list) -> list[Ad]:
+    """Разбор страницы выдачи: JSON-состояние, ld+json, DOM-карточки (последние — только если состояния нет)"""
+    started = time.perf_counter()
+    state_ads = _extract_ads_from_state(html, source, deal_type) if PARSER_STATE_ENABLED else []
+    state_ms = (time.perf_counter() - started) * 1000
+
+    need_cards = not state_ads or PARSER_STATE_COMPARE
+    card_ads: list[Ad] = []
+    started = time.perf_counter()
+    ld_items, cards = parse_listing_page(html, source, card_selectors if need_cards else None)
+    json_ads = _extract_ads_from_json_ld(ld_items, source, deal_type)
+    if need_cards:
+        card_ads = _extract_ads_from_cards(cards, source, deal_type)
+    dom_ms = (time.perf_counter() - started) * 1000
+    if state_ads and PARSER_STATE_COMPARE:
+        state_ids, card_ids = {ad.id for ad in state_ads}, {ad.id for ad in card_ads}
+        logger.info(
+            '%s (%s): сравнение state/DOM: state=%s ads %.1f ms, DOM=%s ads %.1f ms, общих ID=%s',
+            source, deal_type, len(state_ads), state_ms, len(card_ads), dom_ms, len(state_ids & card_ids),
+        )
+        card_ads = []
+
+    ads = _merge_ads(state_ads, json_ads, card_ads)
+    logger.info(
+        '%s (%s): state=%s json=%s cards=%s merged=%s, разбор state=%.1f ms DOM(%s)=%.1f ms',
+        source, deal_type, len(state_ads), len(json_ads), len(card_ads), len(ads), state_ms,
+        PARSE_BACKEND.get(source, 'strained'), dom_ms,
     )
-    if not html:
-        return []
+    return ads
 
-    soup = BeautifulSoup(html, 'lxml')
-    card_ads = _extract_ads_from_cards(_find_cards(soup, [
-        ('article', {'data-name': re.compile('CardComponent', re.I)}),
-        ('div', {'data-testid': 'offer-card'}),
-        ('div', {'class': re.compile('offer-card|_93444fe79c--container', re.I)}),
-    ]), 'cian', deal_type)
-    json_ads = _extract_ads_from_json_ld(soup, 'cian', deal_type)
-    ads = _merge_ads(json_ads, card_ads)
-    logger.info('ЦИАН (%s): json=%s cards=%s merged=%s', deal_type, len(json_ads), len(card_ads), len(ads))
+
+def _capture_fixture(html: str, source: str, deal_type: str, page: int, ads: list[Ad]):
+    if not PARSER_FIXTURE_CAPTURE:
+        return
+    try:
+        fixture = save_fixture(html, source, deal_type, page, ads)
+        logger.info('Сохранена фикстура %s (%s объявлений)', fixture.name, len(ads))
+    except Exception:
+        logger.warning('Не удалось сохранить фикстуру %s_%s p=%s', source, deal_type, page, exc_info=True)
+
+
+def _parse_cian_html(html: str, deal_type: str) -> list[Ad]:
+    return _parse_listing_html(html, 'cian', deal_type, CIAN_CARD_SELECTORS)
+
+
+def _parse_avito_html(html: str, deal_type: str) -> list[Ad]:
+    return _parse_listing_html(html, 'avito', deal_type, AVITO_CARD_SELECTORS)
+
+
+async def fetch_cian_deal_type(deal_type: str = 'sale', page_budget: dict | None = None) -> List[Ad]:
+    async def fetch_page(page: int) -> list[Ad]:
+        params = {
+            'deal_type': deal_type,
+            'engine_version': '2',
+            'offer_type': 'flat',
+            'region': '1',
+            'sort': 'creation_date_desc',
+            'p': str(page),
+        }
+        html = await get_page_html(
+            'https://www.cian.ru/cat.php',
+            params,
+            use_proxy=True,
+            wait_selectors=CIAN_WAIT_SELECTORS,
+            debug_name=f'cian_{deal_type}' if page == 1 else f'cian_{deal_type}_p{page}',
+            source='cian',
+        )
+        if not html:
+            return []
+        ads = _parse_cian_html(html, deal_type)
+        _capture_fixture(html, 'cian', deal_type, page, ads)
+        return ads
+
+    ads = await _crawl_pages(f'cian_{deal_type}', 'cian', fetch_page, page_budget)
     return await _finalize_ads(ads)
 
 
-async def fetch_avito_deal_type(deal_type: str = 'sale') -> List[Ad]:
+async def fetch_avito_deal_type(deal_type: str = 'sale', page_budget: dict | None = None) -> List[Ad]:
     category = 'prodazha-kvartir' if deal_type == 'sale' else 'snyat-kvartiru'
-    html = await get_page_html_playwright(
-        f'https://www.avito.ru/moskva/kvartiry/{category}',
-        {'s': '1', 'p': '1'},
-        use_proxy=True,
-        wait_selectors=AVITO_WAIT_SELECTORS,
-        debug_name=f'avito_{deal_type}',
-    )
-    if not html:
-        return []
 
-    soup = BeautifulSoup(html, 'lxml')
-    card_ads = _extract_ads_from_cards(_find_cards(soup, [
-        ('div', {'data-marker': 'item'}),
-        ('div', {'itemtype': 'http://schema.org/Product'}),
-        ('div', {'class': re.compile('iva-item', re.I)}),
-        ('article', {'data-marker': re.compile('item', re.I)}),
-    ]), 'avito', deal_type)
-    json_ads = _extract_ads_from_json_ld(soup, 'avito', deal_type)
-    ads = _merge_ads(json_ads, card_ads)
-    logger.info('Авито (%s): json=%s cards=%s merged=%s', deal_type, len(json_ads), len(card_ads), len(ads))
+    async def fetch_page(page: int) -> list[Ad]:
+        html = await get_page_html(
+            f'https://www.avito.ru/moskva/kvartiry/{category}',
+            {'s': '1', 'p': str(page)},
+            use_proxy=True,
+            wait_selectors=AVITO_WAIT_SELECTORS,
+            debug_name=f'avito_{deal_type}' if page == 1 else f'avito_{deal_type}_p{page}',
+            source='avito',
+        )
+        if not html:
+            return []
+        ads = _parse_avito_html(html, deal_type)
+        _capture_fixture(html, 'avito', deal_type, page, ads)
+        return ads
+
+    ads = await _crawl_pages(f'avito_{deal_type}', 'avito', fetch_page, page_budget)
     return await _finalize_ads(ads)
 
 
+async def _run_fetch_job(name: str, coro) -> list[Ad]:
+    started = time.monotonic()
+    try:
+        part = await coro
+    except Exception:
+        logger.exception('Ошибка в парсере %s', name)
+        return []
+    logger.info('%s: получено %s объявлений за %.1f с', name, len(part), time.monotonic() - started)
+    return part
+
+
 async def fetch_all_ads() -> List[Ad]:
-    tasks = [
-        ('cian_sale', fetch_cian_deal_type('sale')),
-        ('cian_rent', fetch_cian_deal_type('rent')),
-        ('avito_sale', fetch_avito_deal_type('sale')),
-        ('avito_rent', fetch_avito_deal_type('rent')),
+    """Запускает все выдачи параллельно; ограничения — в _source_gate, ProxyLeases и _browser_slots"""
+    started = time.monotonic()
+    page_budget = dict(PARSER_PAGE_BUDGET)
+    jobs = [
+        ('cian_sale', fetch_cian_deal_type('sale', page_budget)),
+        ('cian_rent', fetch_cian_deal_type('rent', page_budget)),
+        ('avito_sale', fetch_avito_deal_type('sale', page_budget)),
+        ('avito_rent', fetch_avito_deal_type('rent', page_budget)),
     ]
-    all_ads: list[Ad] = []
-    for name, coro in tasks:
-        try:
-            part = await coro
-            logger.info('%s: получено %s объявлений', name, len(part))
-            all_ads.extend(part)
-            await asyncio.sleep(random.uniform(1.0, 2.4))
-        except Exception:
-            logger.exception('Ошибка в парсере %s', name)
+    parts = await asyncio.gather(*(_run_fetch_job(name, coro) for name, coro in jobs))
+    all_ads: list[Ad] = [ad for part in parts for ad in part]
     unique = _merge_ads(all_ads)
-    logger.info('Всего собрано %s уникальных объявлений', len(unique))
+    logger.info('Всего собрано %s уникальных объявлений за %.1f с', len(unique), time.monotonic() - started)
+    DistrictResolver.log_cycle_stats()
     return unique
 
 
 async def get_district_by_address(address: str) -> Optional[str]:
-    if not (DADATA_API_KEY and AIOHTTP_AVAILABLE and address):
-        return None
-    url = 'https://cleaner.dadata.ru/api/v1/clean/address'
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': f'Token {DADATA_API_KEY}',
-    }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=[address], timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status != 200:
-                    return None
-                payload = await resp.json()
-        if payload and isinstance(payload, list):
-            item = payload[0]
-            area = item.get('area')
-            area_type = item.get('area_type')
-            if area and area_type == 'округ':
-                return area.upper()
-    except Exception:
-        logger.debug('DaData не смог определить округ', exc_info=True)
-    return None
+    return await DistrictResolver.resolve(address)
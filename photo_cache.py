@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# photo_cache.py v2.1.0 (18.10.2026)
+# - Кэш file_id фотографий объявлений: первая отправка передаёт Telegram URL (или загружает файл, если
+#   Telegram не смог его скачать), остальные получатели получают фото по file_id
+# - LRU в памяти перед таблицей photo_files (url -> file_id), одновременные первые отправки одного фото
+#   ждут одну загрузку
+# - Счётчики попаданий и среднее время отправки по URL и по file_id (сэкономленное время)
+# - Запасные пути (повтор по URL, загрузка файлом) — только на ошибки самого фото; остальные BadRequest
+#   (чат не найден, разметка, длина подписи) пробрасываются сразу
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from config import PHOTO_CACHE_SIZE, PHOTO_FETCH_TIMEOUT, USER_AGENTS
+from database import Database
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты текста BadRequest (в нижнем регистре): file_id больше не принимается
+STALE_FILE_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file reference')
+# Telegram не смог скачать фото по URL
+FETCH_ERRORS = ('failed to get http url content', 'wrong type of the web page content', 'http url specified')
+
+
+def _bad_request_matches(error: BadRequest, fragments) -> bool:
+    message = (error.message or '').lower()
+    return any(fragment in message for fragment in fragments)
+
+
+def is_photo_error(error: BadRequest) -> bool:
+    """Ошибка самого фото (file_id или URL), а не чата, текста или подписи"""
+    return _bad_request_matches(error, STALE_FILE_ERRORS + FETCH_ERRORS)
+
+
+class PhotoCache:
+    """URL фото -> file_id. Кэшируются только file_id, полученные от Telegram после успешной отправки"""
+    _files: 'OrderedDict[str, str]' = OrderedDict()
+    _inflight: Dict[str, asyncio.Future] = {}
+    _session: Optional['aiohttp.ClientSession'] = None
+    stats: Dict[str, float] = {'hits': 0, 'db_hits': 0, 'misses': 0, 'waited': 0, 'uploads': 0, 'stale': 0,
+                               'url_sends': 0, 'url_ms': 0.0, 'file_id_sends': 0, 'file_id_ms': 0.0}
+
+    @classmethod
+    def _remember(cls, url: str, file_id: str):
+        cls._files[url] = file_id
+        cls._files.move_to_end(url)
+        while len(cls._files) > PHOTO_CACHE_SIZE:
+            cls._files.popitem(last=False)
+
+    @classmethod
+    async def send_photo(cls, bot, chat_id: int, ad_id: str, url: str, caption: str):
+        file_id = cls._files.get(url)
+        if file_id is None:
+            flight = cls._inflight.get(url)
+            if flight is not None:
+                # Фото этого объявления уже отправляется другому получателю — ждём его file_id
+                cls.stats['waited'] += 1
+                file_id = await asyncio.shield(flight)
+            else:
+                return await cls._first_send(bot, chat_id, ad_id, url, caption)
+        if file_id is None:
+            return await cls._send_by_url(bot, chat_id, url, caption)
+        if url in cls._files:
+            cls._files.move_to_end(url)
+        started = time.perf_counter()
+        try:
+            message = await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, parse_mode=ParseMode.HTML)
+        except BadRequest as e:
+            if not _bad_request_matches(e, STALE_FILE_ERRORS):
+                raise
+            # file_id больше не принимается — забываем (и в БД) и отправляем по URL заново
+            logger.debug('file_id фото %s не принят, отправляем по URL', url)
+            cls.stats['stale'] += 1
+            await cls._forget(url)
+            return await cls._first_send(bot, chat_id, ad_id, url, caption)
+        cls.stats['hits'] += 1
+        cls.stats['file_id_sends'] += 1
+        cls.stats['file_id_ms'] += (time.perf_counter() - started) * 1000
+        return message
+
+    @classmethod
+    async def _first_send(cls, bot, chat_id: int, ad_id: str, url: str, caption: str):
+        flight = asyncio.get_running_loop().create_future()
+        cls._inflight[url] = flight
+        file_id = None
+        try:
+            file_id = await cls._stored_file_id(url)
+            message = None
+            if file_id is not None:
+                try:
+                    message = await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption,
+                                                   parse_mode=ParseMode.HTML)
+                    cls.stats['db_hits'] += 1
+                except BadRequest as e:
+                    if not _bad_request_matches(e, STALE_FILE_ERRORS):
+                        raise
+                    # Сохранённый file_id устарел: удаляем строку, иначе после каждого перезапуска фото не уйдёт
+                    logger.debug('file_id фото %s из БД не принят, отправляем по URL', url)
+                    cls.stats['stale'] += 1
+                    await cls._forget(url)
+                    file_id = None
+            if message is None:
+                cls.stats['misses'] += 1
+                message = await cls._send_by_url(bot, chat_id, url, caption)
+                file_id = message.photo[-1].file_id if message.photo else None
+                if file_id is not None:
+                    await cls._store(url, ad_id, file_id)
+            return message
+        except Exception:
+            file_id = None
+            raise
+        finally:
+            if file_id is not None:
+                cls._remember(url, file_id)
+            flight.set_result(file_id)
+            cls._inflight.pop(url, None)
+
+    @classmethod
+    async def _stored_file_id(cls, url: str) -> Optional[str]:
+        if Database._pool is None:
+            return None
+        try:
+            return (await Database.get_photo_files([url])).get(url)
+        except Exception:
+            logger.warning('Не удалось прочитать кэш фото из БД', exc_info=True)
+            return None
+
+    @classmethod
+    async def _store(cls, url: str, ad_id: str, file_id: str):
+        if Database._pool is None:
+            return
+        try:
+            await Database.save_photo_file(url, ad_id, file_id)
+        except Exception:
+            logger.warning('Не удалось сохранить file_id фото %s', url, exc_info=True)
+
+    @classmethod
+    async def _forget(cls, url: str):
+        cls._files.pop(url, None)
+        if Database._pool is None:
+            return
+        try:
+            await Database.delete_photo_file(url)
+        except Exception:
+            logger.warning('Не удалось удалить устаревший file_id фото %s', url, exc_info=True)
+
+    @classmethod
+    async def _send_by_url(cls, bot, chat_id: int, url: str, caption: str):
+        started = time.perf_counter()
+        try:
+            message = await bot.send_photo(chat_id=chat_id, photo=url, caption=caption, parse_mode=ParseMode.HTML)
+        except BadRequest as e:
+            if not _bad_request_matches(e, FETCH_ERRORS):
+                raise
+            # Telegram не смог скачать фото (CDN не отдаёт по hotlink) — скачиваем сами и загружаем файл
+            content = await cls._download(url)
+            if content is None:
+                raise
+            logger.debug('Telegram не скачал фото %s (%s), загружаем файл', url, e)
+            message = await bot.send_photo(chat_id=chat_id, photo=content, caption=caption,
+                                           parse_mode=ParseMode.HTML)
+            cls.stats['uploads'] += 1
+        cls.stats['url_sends'] += 1
+        cls.stats['url_ms'] += (time.perf_counter() - started) * 1000
+        return message
+
+    @classmethod
+    async def _download(cls, url: str) -> Optional[bytes]:
+        if not AIOHTTP_AVAILABLE:
+            return None
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PHOTO_FETCH_TIMEOUT))
+        try:
+            async with cls._session.get(url, headers={'User-Agent': random.choice(USER_AGENTS)}) as response:
+                if response.status != 200:
+                    return None
+                return await response.read()
+        except Exception:
+            logger.debug('Не удалось скачать фото %s', url, exc_info=True)
+            return None
+
+    @classmethod
+    def summary(cls) -> Dict[str, float]:
+        """Доля отправок по file_id и сэкономленное время относительно отправки по URL"""
+        s = cls.stats
+        sends = s['hits'] + s['db_hits'] + s['misses']
+        url_avg = s['url_ms'] / s['url_sends'] if s['url_sends'] else 0.0
+        file_id_avg = s['file_id_ms'] / s['file_id_sends'] if s['file_id_sends'] else 0.0
+        return {
+            'hit_rate': (s['hits'] + s['db_hits']) / sends if sends else 0.0,
+            'url_ms': url_avg,
+            'file_id_ms': file_id_avg,
+            'saved_s': max(0.0, url_avg - file_id_avg) * s['hits'] / 1000,
+        }
+
+    @classmethod
+    def log_stats(cls):
+        summary = cls.summary()
+        if cls.stats['url_sends'] or cls.stats['file_id_sends']:
+            logger.info(
+                'Кэш фото: попаданий %.0f%%, по URL %.0f мс, по file_id %.0f мс, сэкономлено %.0f с, размер %s, %s',
+                summary['hit_rate'] * 100, summary['url_ms'], summary['file_id_ms'], summary['saved_s'],
+                len(cls._files), cls.stats,
+            )
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
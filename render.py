@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# render.py v2.1.0 (18.10.2026)
+# - Готовое сообщение рассылки (AdPayload) собирается один раз на объявление этапом render_ads после
+#   enrich_ads; воркеры доставки подставляют только chat_id
+# - Вариант текста для роли пользователя (агент/частное лицо) — отдельный payload в маленьком кэше на объявлении
+
+from html import escape as html_escape
+from typing import Iterable, List, NamedTuple, Optional
+
+from telegram.constants import ParseMode
+
+from matcher import ad_features
+from models import Ad
+
+__version__ = '2.1.0'
+
+SOURCE_NAMES = {'cian': 'ЦИАН', 'avito': 'Авито'}
+DEAL_NAMES = {'sale': 'Продажа', 'rent': 'Аренда'}
+# (собственник, агент) в строке «Тип»; роли без своей формулировки получают базовый payload
+OWNER_TEXT = ('Собственник', 'Агент/посредник')
+ROLE_OWNER_TEXT = {
+    'agent': ('Собственник, без посредников', 'Агент/посредник'),
+}
+
+
+class AdPayload(NamedTuple):
+    """Неизменяемое сообщение: text — подпись к фото и текст без фото (при ошибке фото)"""
+    text: str
+    parse_mode: str
+    photo: Optional[str]
+    disable_web_page_preview: bool = False
+
+
+def _render(ad: Ad, owner_text: tuple) -> AdPayload:
+    owner = owner_text[0] if ad.owner else owner_text[1]
+    district = ad_features(ad).district or 'не определён'
+    text = (
+        f"<b>Новое объявление • {html_escape(SOURCE_NAMES.get(ad.source, 'Авито'))}</b>\n"
+        f"<b>Цена:</b> {html_escape(ad.price)}\n"
+        f"<b>Адрес:</b> {html_escape(ad.address)}\n"
+        f"<b>Метро:</b> {html_escape(ad.metro)}\n"
+        f"<b>Округ:</b> {html_escape(district)}\n"
+        f"<b>Этаж:</b> {html_escape(ad.floor)}\n"
+        f"<b>Площадь:</b> {html_escape(ad.area)}\n"
+        f"<b>Комнат:</b> {html_escape(str(ad.rooms))}\n"
+        f"<b>Тип:</b> {html_escape(owner)} • {html_escape(DEAL_NAMES.get(ad.deal_type, 'Аренда'))}\n\n"
+        f"<a href=\"{html_escape(ad.link)}\">Открыть объявление</a>"
+    )
+    photo = ad.photos[0] if ad.photos and ad.photos[0].startswith('http') else None
+    return AdPayload(text, ParseMode.HTML, photo)
+
+
+def ad_payload(ad: Ad, role: Optional[str] = None) -> AdPayload:
+    """Payload объявления для роли; ключ кэша — роль с собственной формулировкой или None"""
+    variant = role if role in ROLE_OWNER_TEXT else None
+    if ad._payloads is None:
+        ad._payloads = {}
+    payload = ad._payloads.get(variant)
+    if payload is None:
+        payload = ad._payloads[variant] = _render(ad, ROLE_OWNER_TEXT.get(variant, OWNER_TEXT))
+    return payload
+
+
+def render_ads(ads: Iterable[Ad]) -> List[Ad]:
+    """Этап конвейера после enrich_ads: базовый payload каждого объявления"""
+    ads = list(ads)
+    for ad in ads:
+        ad._payloads = {None: _render(ad, OWNER_TEXT)}
+    return ads
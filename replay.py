@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# replay.py v2.1.0 (18.10.2026)
+# - Офлайн-прогон парсеров по корпусу HTML-фикстур: сравнение с ожидаемыми Ad, --update перезаписывает ожидания
+# - Режим --bench: ms/страницу и объявлений/сек по каждой стратегии извлечения
+
+import argparse
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from parser_fixtures import FIXTURES_DIR, Fixture, ads_to_dicts, load_fixtures
+from parsers import (
+    CIAN_CARD_SELECTORS, AVITO_CARD_SELECTORS,
+    parse_listing_page, _extract_ads_from_state, _extract_ads_from_json_ld, _extract_ads_from_cards,
+    _merge_ads, _parse_listing_html,
+)
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+SELECTORS = {'cian': CIAN_CARD_SELECTORS, 'avito': AVITO_CARD_SELECTORS}
+
+
+def _strategy_state(html: str, source: str, deal_type: str):
+    return _extract_ads_from_state(html, source, deal_type)
+
+
+def _strategy_json_ld(html: str, source: str, deal_type: str):
+    ld_items, _ = parse_listing_page(html, source, None)
+    return _extract_ads_from_json_ld(ld_items, source, deal_type)
+
+
+def _strategy_cards(html: str, source: str, deal_type: str):
+    _, cards = parse_listing_page(html, source, SELECTORS[source])
+    return _extract_ads_from_cards(cards, source, deal_type)
+
+
+def _strategy_merged(html: str, source: str, deal_type: str):
+    ld_items, cards = parse_listing_page(html, source, SELECTORS[source])
+    return _merge_ads(
+        _extract_ads_from_state(html, source, deal_type),
+        _extract_ads_from_json_ld(ld_items, source, deal_type),
+        _extract_ads_from_cards(cards, source, deal_type),
+    )
+
+
+def _strategy_pipeline(html: str, source: str, deal_type: str):
+    return _parse_listing_html(html, source, deal_type, SELECTORS[source])
+
+
+# pipeline — то, что реально отдаёт сбор; с ним сравниваются ожидания фикстур
+STRATEGIES = {
+    'state': _strategy_state,
+    'json_ld': _strategy_json_ld,
+    'cards': _strategy_cards,
+    'merged': _strategy_merged,
+    'pipeline': _strategy_pipeline,
+}
+
+
+def diff_ads(expected: list[dict], actual: list[dict]) -> list[str]:
+    problems: list[str] = []
+    expected_by_id = {ad['id']: ad for ad in expected}
+    actual_by_id = {ad['id']: ad for ad in actual}
+    missing = [ad_id for ad_id in expected_by_id if ad_id not in actual_by_id]
+    extra = [ad_id for ad_id in actual_by_id if ad_id not in expected_by_id]
+    if missing:
+        problems.append(f'пропали: {", ".join(missing[:10])}' + (' …' if len(missing) > 10 else ''))
+    if extra:
+        problems.append(f'лишние: {", ".join(extra[:10])}' + (' …' if len(extra) > 10 else ''))
+    for ad_id, exp in expected_by_id.items():
+        act = actual_by_id.get(ad_id)
+        if act is None:
+            continue
+        for key in sorted(set(exp) | set(act)):
+            if exp.get(key) != act.get(key):
+                problems.append(f'{ad_id}.{key}: {exp.get(key)!r} → {act.get(key)!r}')
+    if not problems and [ad['id'] for ad in expected] != [ad['id'] for ad in actual]:
+        problems.append('изменился порядок объявлений')
+    return problems
+
+
+def run_replay(fixtures: list[Fixture], update: bool = False) -> int:
+    failed = 0
+    for fixture in fixtures:
+        actual = ads_to_dicts(_strategy_pipeline(fixture.read_html(), fixture.source, fixture.deal_type))
+        if update:
+            fixture.expected = actual
+            fixture.save_meta()
+            print(f'UPD  {fixture.name}: {len(actual)} объявлений')
+            continue
+        problems = diff_ads(fixture.expected, actual)
+        if problems:
+            failed += 1
+            print(f'FAIL {fixture.name}: ожидалось {len(fixture.expected)}, получено {len(actual)}')
+            for problem in problems[:20]:
+                print(f'     {problem}')
+        else:
+            print(f'OK   {fixture.name}: {len(actual)} объявлений')
+    print(f'\nФикстур: {len(fixtures)}, расхождений: {failed}')
+    return 1 if failed else 0
+
+
+def run_bench(fixtures: list[Fixture], strategies: list[str], repeat: int) -> int:
+    pages = [(f, f.read_html()) for f in fixtures]
+    print(f"{'strategy':<10} {'ms/page':>9} {'p95 ms':>9} {'ads/sec':>10} {'ads':>6}")
+    for name in strategies:
+        extract = STRATEGIES[name]
+        timings: list[float] = []
+        total_ads = 0
+        for _ in range(repeat):
+            for fixture, html in pages:
+                started = time.perf_counter()
+                ads = extract(html, fixture.source, fixture.deal_type)
+                timings.append(time.perf_counter() - started)
+                total_ads += len(ads)
+        total_time = sum(timings)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        ads_per_sec = total_ads / total_time if total_time else 0.0
+        print(f'{name:<10} {statistics.mean(timings) * 1000:>9.1f} {p95 * 1000:>9.1f} '
+              f'{ads_per_sec:>10.0f} {total_ads // repeat:>6}')
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Офлайн-прогон парсеров по HTML-фикстурам')
+    parser.add_argument('--dir', default=str(FIXTURES_DIR), help='каталог фикстур')
+    parser.add_argument('--filter', default='*', help='glob по имени фикстуры, например cian_*')
+    parser.add_argument('--update', action='store_true', help='перезаписать ожидаемые объявления')
+    parser.add_argument('--bench', action='store_true', help='замерить стратегии извлечения')
+    parser.add_argument('--strategies', default=','.join(STRATEGIES), help='стратегии для --bench')
+    parser.add_argument('--repeat', type=int, default=3, help='повторов для --bench')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    fixtures = load_fixtures(Path(args.dir), args.filter)
+    if not fixtures:
+        print(f'Нет фикстур в {args.dir}', file=sys.stderr)
+        return 1
+    if args.bench:
+        strategies = [s.strip() for s in args.strategies.split(',') if s.strip() in STRATEGIES]
+        return run_bench(fixtures, strategies, max(1, args.repeat))
+    return run_replay(fixtures, update=args.update)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
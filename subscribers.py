@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# subscribers.py v2.1.0 (18.10.2026)
+# - Реестр активных подписчиков в памяти: полная загрузка один раз, дальше — точечные перечитывания по
+#   NOTIFY subscribers_changed (триггер на users: фильтры, подписка, бан)
+# - Окончание подписки отслеживается локальной кучей subscribed_until, без запросов к БД
+# - Полная перезагрузка раз в SUBSCRIBERS_FULL_RELOAD и после обрыва LISTEN-соединения
+# - Роль подписчика для варианта текста рассылки (SubscriberRegistry.role)
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from config import SUBSCRIBERS_LISTEN, SUBSCRIBERS_FULL_RELOAD
+from database import Database, SUBSCRIBERS_CHANNEL
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberRegistry:
+    """user_id -> {user_id, filters, filters_version, subscribed_until, role}; только с действующей подпиской и без бана"""
+    _rows: Dict[int, dict] = {}
+    _expiry: List[Tuple[int, int]] = []
+    _dirty: Set[int] = set()
+    _conn: Optional[asyncpg.Connection] = None
+    _listening = False
+    _loaded_at = 0.0
+    _lock: Optional[asyncio.Lock] = None
+    stats: Dict[str, int] = {'full_loads': 0, 'rows_loaded': 0, 'notifications': 0, 'rows_refreshed': 0, 'expired': 0}
+
+    @classmethod
+    async def start(cls):
+        cls._lock = asyncio.Lock()
+        async with cls._lock:
+            await cls._connect()
+            await cls._full_load()
+
+    @classmethod
+    async def _connect(cls):
+        if not SUBSCRIBERS_LISTEN or cls._listening:
+            return
+        try:
+            cls._conn = await Database.listen(SUBSCRIBERS_CHANNEL, cls._on_notify, cls._on_termination)
+            cls._listening = True
+        except Exception:
+            logger.warning('LISTEN %s недоступен, подписчики перечитываются каждый цикл', SUBSCRIBERS_CHANNEL,
+                           exc_info=True)
+
+    @classmethod
+    def _on_notify(cls, connection, pid, channel, payload):
+        try:
+            cls._dirty.add(int(payload))
+            cls.stats['notifications'] += 1
+        except (TypeError, ValueError):
+            logger.debug('Непонятное уведомление %s: %r', channel, payload)
+
+    @classmethod
+    def _on_termination(cls, connection):
+        if cls._conn is not connection:
+            return
+        # Уведомления за время обрыва потеряны — следующий снимок перечитает всех
+        logger.warning('LISTEN-соединение реестра подписчиков закрыто')
+        cls._listening = False
+        cls._conn = None
+
+    @classmethod
+    async def _full_load(cls):
+        # Уведомления, пришедшие до загрузки, уже учтены в ней
+        cls._dirty.clear()
+        rows = await Database.get_active_subscribers()
+        cls._rows = {}
+        cls._expiry = []
+        for row in rows:
+            cls._put(row)
+        cls._loaded_at = time.monotonic()
+        cls.stats['full_loads'] += 1
+        cls.stats['rows_loaded'] += len(rows)
+        logger.info('Реестр подписчиков загружен: %s', len(cls._rows))
+
+    @classmethod
+    def _put(cls, row):
+        until = row['subscribed_until'] or 0
+        cls._rows[row['user_id']] = {
+            'user_id': row['user_id'],
+            'filters': row['filters'],
+            'filters_version': row['filters_version'],
+            'subscribed_until': until,
+            'role': row['role'],
+        }
+        heapq.heappush(cls._expiry, (until, row['user_id']))
+
+    @classmethod
+    async def _apply_dirty(cls):
+        dirty, cls._dirty = cls._dirty, set()
+        rows = await Database.get_subscriber_rows(list(dirty))
+        now = int(time.time())
+        found = set()
+        for row in rows:
+            found.add(row['user_id'])
+            if row['banned'] or not row['subscribed_until'] or row['subscribed_until'] <= now:
+                cls._rows.pop(row['user_id'], None)
+            else:
+                cls._put(row)
+        for user_id in dirty - found:
+            cls._rows.pop(user_id, None)
+        cls.stats['rows_refreshed'] += len(dirty)
+
+    @classmethod
+    def _expire(cls):
+        now = int(time.time())
+        while cls._expiry and cls._expiry[0][0] <= now:
+            until, user_id = heapq.heappop(cls._expiry)
+            row = cls._rows.get(user_id)
+            # В куче могут остаться старые записи пользователя после продления
+            if row is not None and row['subscribed_until'] == until:
+                del cls._rows[user_id]
+                cls.stats['expired'] += 1
+        if len(cls._expiry) > 2 * len(cls._rows) + 1024:
+            cls._expiry = [(row['subscribed_until'], user_id) for user_id, row in cls._rows.items()]
+            heapq.heapify(cls._expiry)
+
+    @classmethod
+    async def snapshot(cls) -> List[dict]:
+        """Согласованный список подписчиков на цикл сбора"""
+        if cls._lock is None:
+            await cls.start()
+        async with cls._lock:
+            was_listening = cls._listening
+            await cls._connect()
+            stale = time.monotonic() - cls._loaded_at > SUBSCRIBERS_FULL_RELOAD
+            if not (was_listening and cls._listening) or stale:
+                await cls._full_load()
+            elif cls._dirty:
+                try:
+                    await cls._apply_dirty()
+                except Exception:
+                    # Не потерять изменения: следующий снимок перечитает всех
+                    cls._loaded_at = 0.0
+                    raise
+            cls._expire()
+            return list(cls._rows.values())
+
+    @classmethod
+    def role(cls, user_id: int) -> Optional[str]:
+        row = cls._rows.get(user_id)
+        return row['role'] if row is not None else None
+
+    @classmethod
+    def log_stats(cls):
+        logger.debug('Реестр подписчиков: %s активных, LISTEN=%s, %s', len(cls._rows), cls._listening, cls.stats)
+
+    @classmethod
+    async def close(cls):
+        conn, cls._conn = cls._conn, None
+        cls._listening = False
+        if conn is not None and not conn.is_closed():
+            await conn.close()
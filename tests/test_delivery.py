@@ -0,0 +1,159 @@
+"""Очередь доставки поверх outbox в памяти: повторы и max attempts, продление аренды, остановка"""
+
+import asyncio
+import collections
+import time
+
+import pytest
+
+import delivery
+from delivery import Delivery
+from models import Ad
+
+AD = Ad(id='ad1', title='', link='', price='', address='', metro='', floor='', area='', rooms='1')
+
+
+class FakeOutbox:
+    """Таблица outbox в памяти с теми же правилами выборки, что claim_outbox (pending или просроченная аренда)"""
+
+    def __init__(self, rows: int, user_id: int = 1):
+        self.rows = {
+            i: {'id': i, 'user_id': user_id, 'ad_id': AD.id, 'attempts': 0, 'status': 'pending', 'locked': 0.0,
+                'error': None}
+            for i in range(rows)
+        }
+        self.claims = collections.Counter()
+
+    async def claim_outbox(self, limit, lease):
+        now, claimed = time.monotonic(), []
+        for row in self.rows.values():
+            if len(claimed) >= limit:
+                break
+            expired = row['status'] == 'in_flight' and row['locked'] < now - lease.total_seconds()
+            if row['status'] == 'pending' or expired:
+                row.update(status='in_flight', locked=now, attempts=row['attempts'] + 1)
+                self.claims[row['id']] += 1
+                claimed.append(dict(row))
+        return claimed
+
+    async def outbox_renew(self, ids):
+        for i in ids:
+            if self.rows[i]['status'] == 'in_flight':
+                self.rows[i]['locked'] = time.monotonic()
+
+    async def outbox_delivered(self, ids):
+        for i in ids:
+            self.rows[i]['status'] = 'delivered'
+
+    async def outbox_retry(self, outbox_id, delay, error):
+        # Задержка не соблюдается, чтобы тест не ждал backoff
+        self.rows[outbox_id].update(status='pending', error=error)
+
+    async def outbox_failed(self, outbox_id, error):
+        self.rows[outbox_id].update(status='failed', error=error)
+
+    async def outbox_release(self, ids):
+        for i in ids:
+            if self.rows[i]['status'] == 'in_flight':
+                self.rows[i].update(status='pending', attempts=max(self.rows[i]['attempts'] - 1, 0))
+
+    async def get_ads_by_ids(self, ad_ids):
+        return []
+
+    async def get_outbox_counts(self):
+        return dict(collections.Counter(row['status'] for row in self.rows.values()))
+
+    def statuses(self):
+        return collections.Counter(row['status'] for row in self.rows.values())
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    def make(rows, **settings):
+        fake = FakeOutbox(rows)
+        monkeypatch.setattr(delivery, 'Database', fake)
+        monkeypatch.setattr(delivery, 'OUTBOX_POLL_INTERVAL', 0.02)
+        monkeypatch.setattr(delivery, 'DELIVERY_ACK_INTERVAL', 0.05)
+        for name, value in settings.items():
+            monkeypatch.setattr(delivery, name, value)
+        Delivery._ads.clear()
+        Delivery.remember_ads([AD])
+        return fake
+    yield make
+    Delivery._tasks = []
+
+
+async def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'условие не выполнилось за отведённое время'
+        await asyncio.sleep(0.02)
+
+
+def test_job_that_always_raises_ends_failed(outbox):
+    fake = outbox(1, DELIVERY_MAX_ATTEMPTS=3)
+    calls = []
+
+    async def broken_send(bot, user_id, ad):
+        calls.append(user_id)
+        raise ValueError('битые данные объявления')
+
+    async def scenario():
+        Delivery.start(None, broken_send)
+        try:
+            await _wait_for(lambda: fake.rows[0]['status'] == 'failed')
+            await asyncio.sleep(0.1)
+        finally:
+            await Delivery.close()
+
+    asyncio.run(scenario())
+    assert fake.rows[0]['attempts'] == 3
+    assert len(calls) == 3
+    assert 'ValueError' in fake.rows[0]['error']
+    assert not Delivery._held
+
+
+def test_deferred_jobs_are_not_claimed_twice(outbox):
+    # 40 сообщений одному чату при 20/с ждут в памяти ~2 с — дольше аренды в 0.4 с
+    fake = outbox(40, OUTBOX_LEASE=0.4, DELIVERY_CHAT_RATE=20, DELIVERY_GLOBAL_RATE=100)
+
+    async def send(bot, user_id, ad):
+        pass
+
+    async def scenario():
+        Delivery.start(None, send)
+
+        async def rival():
+            # Второй процесс бота забирает всё, что считает брошенным
+            while True:
+                await asyncio.sleep(0.1)
+                await fake.claim_outbox(100, delivery.timedelta(seconds=delivery.OUTBOX_LEASE))
+
+        other = asyncio.create_task(rival())
+        try:
+            await _wait_for(lambda: fake.statuses()['delivered'] == 40, timeout=10)
+        finally:
+            other.cancel()
+            await Delivery.close()
+
+    asyncio.run(scenario())
+    assert fake.statuses() == {'delivered': 40}
+    assert all(count == 1 for count in fake.claims.values())
+
+
+def test_close_flushes_acks_and_releases_unsent(outbox):
+    fake = outbox(20, DELIVERY_CHAT_RATE=10, DELIVERY_ACK_INTERVAL=100)
+
+    async def send(bot, user_id, ad):
+        pass
+
+    async def scenario():
+        Delivery.start(None, send)
+        await _wait_for(lambda: len(Delivery._acks) >= 5)
+        assert fake.statuses() == {'in_flight': 20}
+        await Delivery.close()
+
+    asyncio.run(scenario())
+    statuses = fake.statuses()
+    assert statuses['delivered'] >= 5
+    assert statuses['delivered'] + statuses['pending'] == 20
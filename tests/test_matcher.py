@@ -0,0 +1,147 @@
+"""Дифференциальная проверка подборщиков: SubscriptionIndex и BitsetMatcher должны возвращать тех же
+пользователей и в том же порядке, что перебор строк подписчиков через matches_filters"""
+
+import json
+import random
+
+import pytest
+
+import matcher
+import matcher_bitset
+from config import ALL_METRO_STATIONS, DISTRICTS, ROOM_OPTIONS
+from matcher import FilterCache, SubscriptionIndex, matches_filters, _random_ad, _random_filters
+from models import Ad
+
+# Нестандартные фильтры из старых записей и ручных правок в БД
+EDGE_FILTERS = [
+    {},
+    {'deal_type': 'rent'},
+    {'metros': ALL_METRO_STATIONS[0]},
+    {'metros': [ALL_METRO_STATIONS[1].upper(), 'Несуществующая']},
+    {'metros': [1, 2]},
+    {'metros': None},
+    {'sources': None},
+    {'sources': 'cian'},
+    {'sources': []},
+    {'sources': ['cian', 'yandex']},
+    {'districts': ['Неизвестный округ']},
+    {'districts': [DISTRICTS[0], 'Неизвестный округ']},
+    {'districts': DISTRICTS[0]},
+    {'rooms': ['10']},
+    {'rooms': ROOM_OPTIONS[0]},
+    {'deal_type': None},
+    {'owner_only': True},
+    {'owner_only': True, 'districts': [DISTRICTS[1]], 'metros': [ALL_METRO_STATIONS[2]], 'rooms': ['1']},
+    {'owner_only': 1, 'sources': ['avito'], 'deal_type': 'rent'},
+]
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch):
+    # Сверка внутри match подменила бы результат индекса перебором и скрыла расхождение
+    monkeypatch.setattr(matcher, 'MATCHER_VERIFY', False)
+    monkeypatch.setattr(matcher_bitset, 'MATCHER_VERIFY', False)
+    FilterCache._compiled.clear()
+    FilterCache._versions.clear()
+    yield
+    FilterCache._compiled.clear()
+    FilterCache._versions.clear()
+
+
+def _rows(filters_list):
+    return [{'user_id': 1000 + i, 'filters': json.dumps(f, ensure_ascii=False), 'filters_version': 1}
+            for i, f in enumerate(filters_list)]
+
+
+def _brute_force(rows, ad):
+    matched = []
+    for row in rows:
+        try:
+            if matches_filters(ad, json.loads(row['filters'])):
+                matched.append(row['user_id'])
+        except Exception:
+            continue
+    return matched
+
+
+def _edge_ads():
+    station = ALL_METRO_STATIONS[2]
+    base = dict(title='квартира', link='https://example.invalid/', price='1 000 000 ₽', floor='', area='')
+    return [
+        Ad(id='no_metro', address='Москва, ул. Тестовая, 1', metro='', rooms='1', **base),
+        Ad(id='unknown_metro', address='Москва, ул. Тестовая, 2', metro='Несуществующая (5 мин)', rooms='2',
+           **base),
+        Ad(id='owner', address=f'Москва, {DISTRICTS[1]}, ул. Тестовая, 3', metro=f'{station} (3 мин)', rooms='1',
+           owner=True, **base),
+        Ad(id='rent_avito', source='avito', deal_type='rent', address=f'Москва, {DISTRICTS[0]}',
+           metro=f'{ALL_METRO_STATIONS[0]}, {ALL_METRO_STATIONS[1]}', rooms='студия', **base),
+        Ad(id='unknown_source', source='yandex', address='Москва', metro=station, rooms='', **base),
+        Ad(id='detected', address='Москва', metro='', rooms='3', district_detected=DISTRICTS[0], **base),
+    ]
+
+
+def _dataset(seed, users=400, ads=120):
+    rng = random.Random(seed)
+    filters_list = [_random_filters(rng, odd_share=0.1) for _ in range(users)] + EDGE_FILTERS
+    rng.shuffle(filters_list)
+    return _rows(filters_list), [_random_ad(rng, i) for i in range(ads)] + _edge_ads()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_subscription_index_matches_brute_force(seed):
+    rows, ads = _dataset(seed)
+    index = SubscriptionIndex(rows)
+    for ad in ads:
+        assert index.match(ad) == _brute_force(rows, ad), ad.id
+
+
+def test_subscription_index_edge_filters():
+    rows = _rows(EDGE_FILTERS)
+    index = SubscriptionIndex(rows)
+    for ad in _edge_ads():
+        assert index.match(ad) == _brute_force(rows, ad), ad.id
+
+
+def test_subscription_index_skips_broken_filters():
+    rows = _rows([{'owner_only': False}]) + [
+        {'user_id': 1, 'filters': None},
+        {'user_id': 2, 'filters': 'not json'},
+        {'user_id': 3, 'filters': '[1, 2]'},
+    ]
+    index = SubscriptionIndex(rows)
+    assert len(index) == 1
+    assert index.match(_edge_ads()[0]) == [1000]
+
+
+def test_subscription_index_sees_filter_version_change():
+    ad = _edge_ads()[0]
+    rows = _rows([{'deal_type': 'sale'}])
+    assert SubscriptionIndex(rows).match(ad) == [1000]
+    rows[0].update(filters=json.dumps({'deal_type': 'rent'}), filters_version=2)
+    assert SubscriptionIndex(rows).match(ad) == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitset_matcher_matches_brute_force(seed):
+    pytest.importorskip('numpy')
+    rows, ads = _dataset(seed)
+    bitset = matcher_bitset.BitsetMatcher(capacity=16)
+    bitset.refresh(rows)
+    assert bitset.match_batch(ads) == [_brute_force(rows, ad) for ad in ads]
+
+
+def test_bitset_matcher_incremental_refresh():
+    pytest.importorskip('numpy')
+    rng = random.Random(42)
+    rows, ads = _dataset(7, users=200, ads=60)
+    bitset = matcher_bitset.BitsetMatcher(capacity=16)
+    bitset.refresh(rows)
+    # Часть пользователей ушла, часть сменила фильтры, появились новые — матрица обновляется по строкам
+    rows = [row for row in rows if rng.random() > 0.2]
+    for row in rows[::5]:
+        row.update(filters=json.dumps(_random_filters(rng, odd_share=0.3), ensure_ascii=False),
+                   filters_version=row['filters_version'] + 1)
+    rows += [{'user_id': 5000 + i, 'filters': json.dumps(f, ensure_ascii=False), 'filters_version': 1}
+             for i, f in enumerate(EDGE_FILTERS)]
+    bitset.refresh(rows)
+    assert bitset.match_batch(ads + _edge_ads()) == [_brute_force(rows, ad) for ad in ads + _edge_ads()]
@@ -0,0 +1,111 @@
+"""PhotoCache: устаревший file_id (в памяти и в photo_files) заменяется отправкой по URL"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+import photo_cache
+from photo_cache import PhotoCache
+
+URL = 'https://img.example.invalid/1.jpg'
+STALE = 'Wrong remote file identifier specified: wrong padding in the string'
+
+
+class FakePhotoFiles:
+    _pool = object()
+
+    def __init__(self, stored=None):
+        self.rows = dict(stored or {})
+        self.deleted = []
+
+    async def get_photo_files(self, urls):
+        return {url: self.rows[url] for url in urls if url in self.rows}
+
+    async def save_photo_file(self, url, ad_id, file_id):
+        self.rows[url] = file_id
+
+    async def delete_photo_file(self, url):
+        self.deleted.append(url)
+        self.rows.pop(url, None)
+
+
+class FakeBot:
+    """file_id из valid принимаются, остальные — ошибка устаревшего идентификатора; URL всегда скачивается"""
+
+    def __init__(self, valid=()):
+        self.valid = set(valid)
+        self.sent = []
+        self.uploaded = 0
+
+    async def send_photo(self, chat_id, photo, caption, parse_mode):
+        self.sent.append(photo)
+        if photo == URL:
+            self.uploaded += 1
+            file_id = f'fresh-{self.uploaded}'
+            self.valid.add(file_id)
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=file_id)])
+        if photo not in self.valid:
+            raise BadRequest(STALE)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+
+
+@pytest.fixture(autouse=True)
+def _clean_cache():
+    PhotoCache._files.clear()
+    PhotoCache._inflight.clear()
+    for key in PhotoCache.stats:
+        PhotoCache.stats[key] = 0
+    yield
+    PhotoCache._files.clear()
+
+
+def test_stale_file_id_from_db_is_replaced(monkeypatch):
+    db = FakePhotoFiles({URL: 'stale-id'})
+    monkeypatch.setattr(photo_cache, 'Database', db)
+    bot = FakeBot()
+
+    async def scenario():
+        await PhotoCache.send_photo(bot, 1, 'ad1', URL, 'caption')
+        await PhotoCache.send_photo(bot, 2, 'ad1', URL, 'caption')
+
+    asyncio.run(scenario())
+    assert bot.sent == ['stale-id', URL, 'fresh-1']
+    assert db.deleted == [URL]
+    assert db.rows == {URL: 'fresh-1'}
+    assert PhotoCache._files[URL] == 'fresh-1'
+    assert PhotoCache.stats['stale'] == 1
+    assert PhotoCache.stats['hits'] == 1
+    assert PhotoCache.stats['db_hits'] == 0
+
+
+def test_stale_file_id_in_memory_is_dropped_from_db(monkeypatch):
+    db = FakePhotoFiles({URL: 'stale-id'})
+    monkeypatch.setattr(photo_cache, 'Database', db)
+    PhotoCache._remember(URL, 'stale-id')
+    bot = FakeBot()
+
+    asyncio.run(PhotoCache.send_photo(bot, 1, 'ad1', URL, 'caption'))
+    # После устаревшего id из памяти в БД не идём за тем же id — сразу URL
+    assert bot.sent == ['stale-id', URL]
+    assert db.rows == {URL: 'fresh-1'}
+    assert PhotoCache._files[URL] == 'fresh-1'
+
+
+def test_other_bad_request_keeps_cache(monkeypatch):
+    db = FakePhotoFiles({URL: 'good-id'})
+    monkeypatch.setattr(photo_cache, 'Database', db)
+    PhotoCache._remember(URL, 'good-id')
+
+    class ChatNotFound(FakeBot):
+        async def send_photo(self, chat_id, photo, caption, parse_mode):
+            self.sent.append(photo)
+            raise BadRequest('Chat not found')
+
+    bot = ChatNotFound()
+    with pytest.raises(BadRequest):
+        asyncio.run(PhotoCache.send_photo(bot, 1, 'ad1', URL, 'caption'))
+    assert bot.sent == ['good-id']
+    assert PhotoCache._files[URL] == 'good-id'
+    assert db.deleted == []
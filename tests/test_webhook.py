@@ -0,0 +1,266 @@
+"""WebhookServer через aiohttp test client и полный цикл run_webhook против локального фейкового Bot API"""
+
+import asyncio
+import os
+import signal
+import socket
+
+import pytest
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import Application, MessageHandler, filters
+
+import webhook
+from update_processor import ChatOrderedUpdateProcessor
+from webhook import SECRET_HEADER, UpdateQueue, WebhookServer
+
+TOKEN = '123:test'
+SECRET = 'test-secret'
+
+
+def _update(update_id: int, chat_id: int = 1, text: str = 'hi') -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'test'},
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotApi:
+    """Минимальный Bot API: getMe, setWebhook (запоминает параметры), остальные методы отвечают True"""
+
+    def __init__(self):
+        self.calls = []
+        self.port = _free_port()
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = dict(await request.post()) if request.body_exists else {}
+        self.calls.append((method, data))
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 123, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._method)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+def _application(base_url: str = None, processor=None) -> Application:
+    builder = Application.builder().token(TOKEN).updater(None).update_queue(UpdateQueue())
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    if base_url:
+        builder = builder.base_url(base_url)
+    return builder.build()
+
+
+async def _client(server: WebhookServer) -> TestClient:
+    client = TestClient(TestServer(server.web_app()))
+    await client.start_server()
+    return client
+
+
+def test_rejects_bad_secret():
+    async def scenario():
+        server = WebhookServer(_application(), SECRET, queue_size=10)
+        server.accepting = True
+        client = await _client(server)
+        try:
+            missing = await client.post(server.path, json=_update(1))
+            wrong = await client.post(server.path, json=_update(2), headers={SECRET_HEADER: 'wrong'})
+            ok = await client.post(server.path, json=_update(3), headers={SECRET_HEADER: SECRET})
+        finally:
+            await client.close()
+        assert (missing.status, wrong.status, ok.status) == (403, 403, 200)
+        assert server.stats['bad_secret'] == 2
+        assert server.app.update_queue.qsize() == 1
+        assert server.app.update_queue.get_nowait().update_id == 3
+
+    asyncio.run(scenario())
+
+
+def test_bad_json_is_400():
+    async def scenario():
+        server = WebhookServer(_application(), SECRET, queue_size=10)
+        server.accepting = True
+        client = await _client(server)
+        try:
+            response = await client.post(server.path, data=b'{not json', headers={SECRET_HEADER: SECRET})
+        finally:
+            await client.close()
+        assert response.status == 400
+        assert server.app.update_queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_requires_counting_update_queue():
+    with pytest.raises(TypeError):
+        WebhookServer(Application.builder().token(TOKEN).updater(None).build(), SECRET)
+
+
+def test_503_when_unfinished_updates_reach_limit():
+    """Application с ChatOrderedUpdateProcessor сразу забирает обновления из update_queue (qsize() ~ 0),
+    ограничение должно считать обновления, обработка которых не закончилась"""
+    async def scenario():
+        release = asyncio.Event()
+        started = []
+
+        async def blocked_handler(update, context):
+            started.append(update.update_id)
+            await release.wait()
+
+        async with FakeBotApi() as api:
+            app = _application(api.base_url, ChatOrderedUpdateProcessor(concurrency=8, max_pending=64))
+            app.add_handler(MessageHandler(filters.TEXT, blocked_handler))
+            await app.initialize()
+            await app.start()
+            server = WebhookServer(app, SECRET, queue_size=5)
+            server.accepting = True
+            client = await _client(server)
+            headers = {SECRET_HEADER: SECRET}
+            try:
+                statuses = []
+                for i in range(8):
+                    # Разные чаты: обработчики запускаются параллельно и забирают обновления из очереди
+                    response = await client.post(server.path, json=_update(i, chat_id=i + 1), headers=headers)
+                    statuses.append(response.status)
+                    await asyncio.sleep(0.02)
+                assert app.update_queue.qsize() == 0
+                assert server.backlog() == 5
+                health = await (await client.get('/healthz')).json()
+                release.set()
+                await asyncio.wait_for(app.update_queue.join(), timeout=5)
+                after = await client.post(server.path, json=_update(100), headers=headers)
+            finally:
+                release.set()
+                await client.close()
+                await app.stop()
+                await app.shutdown()
+
+        assert statuses == [200] * 5 + [503] * 3
+        assert sorted(started) == [0, 1, 2, 3, 4, 100]
+        assert server.stats['queue_full'] == 3
+        assert health['queue'] == 5
+        assert after.status == 200
+        assert server.backlog() == 0
+
+    asyncio.run(scenario())
+
+
+def test_drain_stops_accepting_and_waits_for_queue():
+    async def scenario():
+        server = WebhookServer(_application(), SECRET, queue_size=10)
+        server.accepting = True
+        queue = server.app.update_queue
+        client = await _client(server)
+        headers = {SECRET_HEADER: SECRET}
+        processed = []
+
+        async def consumer():
+            while True:
+                update = await queue.get()
+                await asyncio.sleep(0.05)
+                processed.append(update.update_id)
+                queue.task_done()
+
+        try:
+            for i in range(3):
+                assert (await client.post(server.path, json=_update(i), headers=headers)).status == 200
+            worker = asyncio.create_task(consumer())
+            drain = asyncio.create_task(server.drain(timeout=5))
+            await asyncio.sleep(0)
+            during = await client.post(server.path, json=_update(99), headers=headers)
+            await drain
+            worker.cancel()
+        finally:
+            await client.close()
+        assert during.status == 503
+        assert processed == [0, 1, 2]
+        assert server.stats['draining'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_drain_gives_up_after_timeout():
+    async def scenario():
+        server = WebhookServer(_application(), SECRET, queue_size=10)
+        server.accepting = True
+        server.app.update_queue.put_nowait(object())
+        started = asyncio.get_running_loop().time()
+        await server.drain(timeout=0.2)
+        assert asyncio.get_running_loop().time() - started < 2
+        assert not server.accepting
+
+    asyncio.run(scenario())
+
+
+def test_run_webhook_against_fake_bot_api(monkeypatch):
+    port = _free_port()
+    monkeypatch.setattr(webhook, 'WEBHOOK_URL', f'https://bot.example.invalid{webhook.WEBHOOK_PATH}')
+    monkeypatch.setattr(webhook, 'WEBHOOK_SECRET', SECRET)
+    monkeypatch.setattr(webhook, 'WEBHOOK_LISTEN', '127.0.0.1')
+    monkeypatch.setattr(webhook, 'WEBHOOK_PORT', port)
+
+    async def scenario():
+        handled = []
+        stopped = []
+
+        async def slow_handler(update, context):
+            await asyncio.sleep(0.3)
+            handled.append(update.update_id)
+
+        async def post_stop(app):
+            stopped.append(list(handled))
+
+        async with FakeBotApi() as api:
+            app = _application(api.base_url)
+            app.post_stop = post_stop
+            app.add_handler(MessageHandler(filters.TEXT, slow_handler))
+            lifecycle = asyncio.create_task(webhook.run_webhook(app, ['message']))
+            url = f'http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}'
+            async with ClientSession() as session:
+                for _ in range(50):
+                    if any(method == 'setWebhook' for method, _ in api.calls):
+                        break
+                    await asyncio.sleep(0.05)
+                statuses = []
+                for i in range(3):
+                    async with session.post(url, json=_update(i, chat_id=i + 1),
+                                            headers={SECRET_HEADER: SECRET}) as response:
+                        statuses.append(response.status)
+                os.kill(os.getpid(), signal.SIGTERM)
+                await asyncio.wait_for(lifecycle, timeout=10)
+
+        assert statuses == [200, 200, 200]
+        set_webhook = [data for method, data in api.calls if method == 'setWebhook']
+        assert set_webhook and set_webhook[0]['secret_token'] == SECRET
+        assert set_webhook[0]['url'] == webhook.WEBHOOK_URL
+        # Принятые до SIGTERM обновления обработаны до post_stop
+        assert sorted(handled) == [0, 1, 2]
+        assert len(stopped) == 1 and sorted(stopped[0]) == [0, 1, 2]
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# update_processor.py v2.1.0 (18.10.2026)
+# - Параллельная обработка обновлений Telegram: разные чаты обрабатываются одновременно (до UPDATES_CONCURRENCY),
+#   обновления одного чата — строго по очереди (ConversationHandler и user_data не видят гонок)
+# - Ожидающие своей очереди обновления не занимают слоты обработки: всего принятых в работу не больше
+#   UPDATES_MAX_PENDING
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATES_CONCURRENCY, UPDATES_MAX_PENDING
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+
+def _chat_key(update: object) -> Optional[int]:
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Семафор базового класса ограничивает число принятых обновлений (UPDATES_MAX_PENDING), собственный —
+    число одновременно выполняемых обработчиков. Блокировка чата берётся до слота обработки, чтобы очередь
+    одного активного чата не занимала слоты других"""
+    __slots__ = ('_running', '_chats', 'concurrency')
+
+    def __init__(self, concurrency: int = UPDATES_CONCURRENCY, max_pending: int = UPDATES_MAX_PENDING):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._running = asyncio.Semaphore(concurrency)
+        # chat_id -> [блокировка, число обновлений чата в работе]
+        self._chats: Dict[int, List[Any]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self) -> None:
+        logger.info('Обработка обновлений: до %s параллельно, по порядку внутри чата', self.concurrency)
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
-# utils.py v2.0.0 (11.03.2026)
-# - Актуализирована версия модуля
+# utils.py v2.1.0 (18.10.2026)
+# - shutdown закрывает пул браузеров Playwright, HTTP-сессию парсера, сессию DaData, LISTEN-соединение реестра подписчиков
+#   и останавливает очередь доставки; вызывается как Application.post_stop, фоновые задачи останавливаются первыми
 
+import asyncio
 import re
 import logging
 from typing import Optional
 import aiohttp
 from config import TONCENTER_API_KEY, TON_WALLET
 
-__version__ = '2.0.0'
+__version__ = '2.1.0'
 
 logger = logging.getLogger(__name__)
 
@@ -96,11 +98,26 @@ async def check_user_exists(bot, user_id: int) -> bool:
 
 
 async def shutdown(app):
-    """Graceful shutdown: закрываем соединения с БД и останавливаем задачи"""
+    """Graceful shutdown (Application.post_stop): останавливаем фоновые задачи и закрываем соединения"""
     logger.info("Получен сигнал завершения, закрываем соединения...")
     from database import Database
-    await Database.close()
-    # Остановка фоновых задач
-    for task in app.bot_data.get("background_tasks", []):
+    from browser_pool import BrowserPool
+    from parsers import close_http_session
+    from district_resolver import DistrictResolver
+    from subscribers import SubscriberRegistry
+    from delivery import Delivery
+    from photo_cache import PhotoCache
+    # Сбор и админские задачи (рассылка) останавливаются первыми, пока база ещё открыта;
+    # Application.stop их не ждёт — долгая рассылка не задерживает остановку
+    tasks = list(app.bot_data.get("background_tasks", [])) + list(app.bot_data.get("admin_jobs", ()))
+    for task in tasks:
         task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await Delivery.close()
+    await SubscriberRegistry.close()
+    await Database.close()
+    await close_http_session()
+    await DistrictResolver.close()
+    await PhotoCache.close()
+    await BrowserPool.close()
     logger.info("Shutdown completed")
\ No newline at end of file
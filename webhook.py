@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# webhook.py v2.1.0 (18.10.2026)
+# - Режим webhook (BOT_MODE=webhook): встроенный HTTP-сервер aiohttp принимает обновления от Telegram
+#   вместо long polling; проверка X-Telegram-Bot-Api-Secret-Token
+# - Принятые и ещё не обработанные обновления ограничены WEBHOOK_QUEUE_SIZE: при переполнении сервер отвечает
+#   503 и Telegram повторяет доставку позже. Считаются по UpdateQueue (put — task_done): при параллельной
+#   обработке Application сразу забирает обновления из очереди, и qsize() остаётся около нуля
+# - SIGTERM/SIGINT: новые обновления не принимаются, очередь дорабатывается (до WEBHOOK_DRAIN_TIMEOUT),
+#   затем закрываются соединения (post_stop, utils.shutdown)
+# - TELEGRAM_BASE_URL позволяет запускать бота против локального тестового сервера Bot API
+#   (tests/test_webhook.py: секрет, 503, дорабатывание очереди по SIGTERM)
+
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_DRAIN_TIMEOUT,
+)
+
+__version__ = '2.1.0'
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateQueue(asyncio.Queue):
+    """update_queue Application со счётчиком незавершённых обновлений: Application вызывает task_done после
+    обработчиков, поэтому unfinished — и ждущие в очереди, и уже выполняемые"""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.unfinished = 0
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        self.unfinished += 1
+
+    def task_done(self):
+        super().task_done()
+        self.unfinished -= 1
+
+
+class WebhookServer:
+    """Кладёт обновления в app.update_queue; обрабатывает их Application (app.start) своим обработчиком
+    обновлений. Ответ Telegram — сразу после постановки в очередь, не дожидаясь обработчиков"""
+
+    def __init__(self, app: Application, secret: str, path: str = WEBHOOK_PATH,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE):
+        if not isinstance(app.update_queue, UpdateQueue):
+            raise TypeError('WebhookServer: Application должен быть собран с .update_queue(UpdateQueue())')
+        self.app = app
+        self.secret = secret
+        self.path = path
+        self.queue_size = queue_size
+        self.accepting = False
+        self._runner: Optional[web.AppRunner] = None
+        self.stats: Dict[str, int] = {'accepted': 0, 'bad_secret': 0, 'bad_request': 0, 'queue_full': 0,
+                                      'draining': 0}
+
+    def web_app(self) -> web.Application:
+        server = web.Application()
+        server.router.add_post(self.path, self._handle)
+        server.router.add_get('/healthz', self._health)
+        return server
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        self._runner = web.AppRunner(self.web_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.accepting = True
+        logger.info('Webhook-сервер слушает %s:%s%s', host, port, self.path)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            self.stats['bad_secret'] += 1
+            return web.Response(status=403)
+        if not self.accepting:
+            # Остановка: Telegram повторит доставку, обновление получит следующий процесс
+            self.stats['draining'] += 1
+            return web.Response(status=503)
+        if self.backlog() >= self.queue_size:
+            self.stats['queue_full'] += 1
+            return web.Response(status=503)
+        try:
+            update = Update.de_json(await request.json(), self.app.bot)
+        except Exception:
+            self.stats['bad_request'] += 1
+            logger.debug('Некорректное обновление webhook', exc_info=True)
+            return web.Response(status=400)
+        self.app.update_queue.put_nowait(update)
+        self.stats['accepted'] += 1
+        return web.Response()
+
+    def backlog(self) -> int:
+        """Принятые обновления, обработка которых ещё не закончилась"""
+        return self.app.update_queue.unfinished
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response({'accepting': self.accepting, 'queue': self.backlog(), **self.stats})
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Перестаёт принимать обновления и ждёт обработки уже принятых"""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.app.update_queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Очередь обновлений не обработана за %s с, осталось %s', timeout, self.backlog())
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        logger.info('Webhook-сервер остановлен: %s', self.stats)
+
+
+async def run_webhook(app: Application, allowed_updates: list):
+    """Жизненный цикл бота в режиме webhook (вместо app.run_polling), с теми же post_init/post_stop"""
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен! Он нужен в режиме BOT_MODE=webhook.")
+    # Без WEBHOOK_SECRET секрет генерируется на запуск: webhook каждый раз регистрируется заново
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(app, secret)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    await app.bot.set_webhook(url=WEBHOOK_URL, secret_token=secret, allowed_updates=allowed_updates,
+                              max_connections=WEBHOOK_MAX_CONNECTIONS)
+    logger.info('Webhook зарегистрирован: %s', WEBHOOK_URL)
+    try:
+        await stop.wait()
+        logger.info('Получен сигнал завершения, дорабатываем очередь обновлений...')
+        await server.drain()
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()